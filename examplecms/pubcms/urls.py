@@ -1,10 +1,12 @@
 from django.conf.urls import url
 
+from publish.views import published_condition
+
 from .views import page_detail
 from .models import Page
 
 
 urlpatterns = [
     url('^(?P<page_url>.*)\*$', page_detail, { 'queryset': Page.objects.draft()  }, name='draft_page_detail'),
-    url('^(?P<page_url>.*)$',   page_detail, { 'queryset': Page.objects.published() }, name='public_page_detail'),
+    url('^(?P<page_url>.*)$',   published_condition()(page_detail), { 'queryset': Page.objects.published() }, name='public_page_detail'),
 ]
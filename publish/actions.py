@@ -1,8 +1,12 @@
 from django import template
+from django.contrib import messages
 from django.contrib.admin import helpers
 from django.contrib.admin.actions import delete_selected as django_delete_selected
 from django.contrib.admin.utils import quote, model_ngettext, get_deleted_objects
+from django.contrib.auth import get_permission_codename
+from django.core import signing
 from django.core.exceptions import PermissionDenied
+from django.core.urlresolvers import NoReverseMatch, reverse
 from django.db import router, transaction
 from django.shortcuts import render
 from django.template.response import TemplateResponse
@@ -12,8 +16,9 @@ from django.utils.safestring import mark_safe
 from django.utils.text import capfirst
 from django.utils.translation import ugettext as _
 
-from .models import Publishable
-from .utils import NestedSet
+from .history import recording
+from .models import Publishable, PublishException, PublishJob, Release
+from .plan import PublishPlan, StalePlanException
 
 
 def _get_change_view_url(app_label, object_name, pk, levels_to_root):
@@ -93,15 +98,55 @@ def _root_path(admin_site):
     return getattr(admin_site, 'root_path', None)
 
 
+def _get_publish_plan(request, queryset):
+    # re-use the plan from the confirmation page if we have one
+    # (and it is for the objects that were selected), otherwise
+    # work out what would be published
+    signed_plan = request.POST.get('publish_plan')
+    if signed_plan:
+        try:
+            plan = PublishPlan.loads(signed_plan)
+        except signing.BadSignature:
+            plan = None
+        if plan is not None:
+            selected = set(obj.pk for obj in queryset)
+            if selected == set(root.pk for root in plan.roots):
+                return plan
+    return PublishPlan.build(queryset)
+
+
+def _enqueue_publish_job(modeladmin, request, plan, n):
+    items = model_ngettext(modeladmin.opts, n)
+    job = PublishJob.enqueue(plan, user=request.user, description=u'Publish %d %s' % (n, items))
+
+    message = _("Publishing %(count)d %(items)s in the background.") % {"count": n, "items": items}
+    try:
+        url = reverse('%s:publish_publishjob_change' % modeladmin.admin_site.name, args=(job.pk,))
+        message = mark_safe(u'%s <a href="%s">%s</a>' % (escape(message), url, escape(_("View progress"))))
+    except NoReverseMatch:
+        pass
+    modeladmin.message_user(request, message)
+
+
+def _message_stale_plan(modeladmin, request, n):
+    modeladmin.message_user(request, _("Some of the selected %(items)s have changed since publishing was confirmed, "
+                                       "please try again.") % {
+        "items": model_ngettext(modeladmin.opts, n)
+    }, level=messages.ERROR)
+
+
 @transaction.atomic
 def publish_selected(modeladmin, request, queryset):
     queryset = queryset.select_for_update()
     opts = modeladmin.model._meta
     app_label = opts.app_label
 
-    all_published = NestedSet()
-    for obj in queryset:
-        obj.publish(dry_run=True, all_published=all_published)
+    try:
+        plan = _get_publish_plan(request, queryset)
+    except StalePlanException:
+        _message_stale_plan(modeladmin, request, queryset.count())
+        return None
+    all_published = plan.all_published
 
     perms_needed = []
     _check_permissions(modeladmin, all_published, request, perms_needed)
@@ -111,12 +156,20 @@ def publish_selected(modeladmin, request, queryset):
             raise PermissionDenied
 
         n = queryset.count()
+        if n and modeladmin.publish_in_background:
+            _enqueue_publish_job(modeladmin, request, plan, n)
+            return None
         if n:
+            try:
+                with recording(u'Publish %d %s' % (n, model_ngettext(opts, n)), user=request.user):
+                    plan.execute()
+            except StalePlanException:
+                _message_stale_plan(modeladmin, request, n)
+                return None
+
             for object in all_published:
                 modeladmin.log_publication(request, object)
 
-            queryset.publish()
-
             modeladmin.message_user(request, _("Successfully published %(count)d %(items)s.") % {
                 "count": n, "items": model_ngettext(modeladmin.opts, n)
             })
@@ -131,6 +184,7 @@ def publish_selected(modeladmin, request, queryset):
         "all_published": _convert_all_published_to_html(admin_site, all_published),
         "perms_lacking": _to_html(admin_site, perms_needed),
         'queryset': queryset,
+        'publish_plan': plan.dumps(),
         "opts": opts,
         "root_path": _root_path(admin_site),
         "app_label": app_label,
@@ -174,10 +228,11 @@ def unpublish_selected(modeladmin, request, queryset):
 
         n = len(all_unpublished)
         if n:
-            for obj in queryset:
-                obj_public = obj.unpublish()
-                if obj_public:
-                    modeladmin.log_publication(request, object, message="Unpublished")
+            with recording(u'Unpublish %d %s' % (n, model_ngettext(opts, n)), user=request.user, using=using):
+                for obj in queryset:
+                    obj_public = obj.unpublish()
+                    if obj_public:
+                        modeladmin.log_publication(request, object, message="Unpublished")
             modeladmin.message_user(request, _("Successfully unpublished %(count)d %(items)s.") % {
                 "count": n, "items": model_ngettext(modeladmin.opts, n)
             })
@@ -214,5 +269,167 @@ def unpublish_selected(modeladmin, request, queryset):
     ], context)
 
 
+def _has_release_permission(modeladmin, request, action):
+    # ask the Release admin if there is one, otherwise check the user's permissions directly
+    release_admin = modeladmin.admin_site._registry.get(Release, None)
+    if release_admin is not None:
+        return getattr(release_admin, 'has_%s_permission' % action)(request)
+    opts = Release._meta
+    return request.user.has_perm('%s.%s' % (opts.app_label, get_permission_codename(action, opts)))
+
+
+def add_to_release(modeladmin, request, queryset):
+    opts = modeladmin.model._meta
+    app_label = opts.app_label
+    can_change = _has_release_permission(modeladmin, request, 'change')
+    can_add = _has_release_permission(modeladmin, request, 'add')
+    if not (can_change or can_add):
+        modeladmin.message_user(request, _("You don't have permission to add to releases."), level=messages.ERROR)
+        return None
+    releases = Release._default_manager.filter(state=Release.OPEN)
+    if not can_change:
+        releases = releases.none()
+
+    if request.POST.get('post'):
+        release = None
+        release_id, release_name = request.POST.get('release'), request.POST.get('release_name', '').strip()
+        if release_id:
+            release = releases.filter(pk=release_id).first()
+        elif release_name:
+            if not can_add:
+                modeladmin.message_user(request, _("You don't have permission to add releases."),
+                                        level=messages.ERROR)
+                return None
+            release = Release._default_manager.create(name=release_name, user=request.user)
+
+        if release is not None:
+            n = queryset.count()
+            release.add(*queryset)
+            modeladmin.message_user(request, _("Added %(count)d %(items)s to %(release)s.") % {
+                "count": n, "items": model_ngettext(modeladmin.opts, n), "release": force_unicode(release)
+            })
+            # Return None to display the change list page again.
+            return None
+        modeladmin.message_user(request, _("Please choose a release (or name a new one)."), level=messages.ERROR)
+
+    context = {
+        "title": _("Add to release"),
+        "objects_name": force_unicode(opts.verbose_name_plural),
+        "releases": releases,
+        "can_add": can_add,
+        'queryset': queryset,
+        "opts": opts,
+        "app_label": app_label,
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    }
+
+    return render(request, [
+        "admin/%s/%s/add_to_release.html" % (app_label, opts.object_name.lower()),
+        "admin/%s/add_to_release.html" % app_label,
+        "admin/add_to_release.html"
+    ], context)
+
+
+def publish_release(modeladmin, request, queryset):
+    opts = modeladmin.model._meta
+    app_label = opts.app_label
+    releases = list(queryset.filter(state=Release.OPEN))
+
+    plans = [(release, release.build_plan()) for release in releases]
+    perms_needed = []
+    for release, plan in plans:
+        _check_permissions(modeladmin, plan.all_published, request, perms_needed)
+
+    if request.POST.get('post'):
+        if perms_needed:
+            raise PermissionDenied
+
+        published = 0
+        for release, plan in plans:
+            try:
+                with recording(u'Release %s' % release.name, user=request.user):
+                    # (re-using the plan from the preview, if nothing has changed since)
+                    plan = release.publish(plan=plan)
+            except PublishException as e:
+                modeladmin.message_user(request, force_unicode(e), level=messages.ERROR)
+                continue
+            published += 1
+            for instance in plan.all_published:
+                other_modeladmin = modeladmin.admin_site._registry.get(instance.__class__, None)
+                if other_modeladmin is not None and hasattr(other_modeladmin, 'log_publication'):
+                    other_modeladmin.log_publication(request, instance,
+                                                     message="Published in %s" % force_unicode(release))
+        if published:
+            modeladmin.message_user(request, _("Successfully published %(count)d %(items)s.") % {
+                "count": published, "items": model_ngettext(modeladmin.opts, published)
+            })
+        # Return None to display the change list page again.
+        return None
+
+    admin_site = modeladmin.admin_site
+
+    context = {
+        "title": _("Publish release?"),
+        "releases": [(release, _convert_all_published_to_html(admin_site, plan.all_published))
+                     for release, plan in plans],
+        "perms_lacking": _to_html(admin_site, perms_needed),
+        'queryset': queryset,
+        "opts": opts,
+        "app_label": app_label,
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    }
+
+    # Display the confirmation page (a preview of everything in the releases)
+    return render(request, [
+        "admin/%s/%s/publish_release_confirmation.html" % (app_label, opts.object_name.lower()),
+        "admin/%s/publish_release_confirmation.html" % app_label,
+        "admin/publish_release_confirmation.html"
+    ], context)
+
+
+def rollback_selected(modeladmin, request, queryset):
+    opts = modeladmin.model._meta
+    app_label = opts.app_label
+    # newest first, as an operation can't be rolled back before any later ones that changed the same objects
+    operations = list(queryset.filter(rolled_back__isnull=True).order_by('-created', '-id'))
+
+    if request.POST.get('post'):
+        rolled_back = 0
+        for operation in operations:
+            try:
+                operation.rollback()
+            except PublishException as e:
+                modeladmin.message_user(request, force_unicode(e), level=messages.ERROR)
+                continue
+            rolled_back += 1
+            modeladmin.log_change(request, operation, "Rolled back")
+        if rolled_back:
+            modeladmin.message_user(request, _("Successfully rolled back %(count)d %(items)s.") % {
+                "count": rolled_back, "items": model_ngettext(modeladmin.opts, rolled_back)
+            })
+        # Return None to display the change list page again.
+        return None
+
+    context = {
+        "title": _("Are you sure?"),
+        "objects_name": force_unicode(opts.verbose_name_plural),
+        "operations": operations,
+        'queryset': queryset,
+        "opts": opts,
+        "app_label": app_label,
+        'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+    }
+
+    # Display the confirmation page
+    return render(request, [
+        "admin/%s/%s/rollback_selected_confirmation.html" % (app_label, opts.object_name.lower()),
+        "admin/%s/rollback_selected_confirmation.html" % app_label,
+        "admin/rollback_selected_confirmation.html"
+    ], context)
+
+
 publish_selected.short_description = "Publish selected %(verbose_name_plural)s"
 unpublish_selected.short_description = "Unpublish selected %(verbose_name_plural)s"
+add_to_release.short_description = "Add selected %(verbose_name_plural)s to a release"
+publish_release.short_description = "Publish selected %(verbose_name_plural)s"
+rollback_selected.short_description = "Roll back selected %(verbose_name_plural)s"
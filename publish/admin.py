@@ -5,8 +5,9 @@ from django.http import Http404, HttpResponseRedirect
 from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse as reverse_url
 
-from .models import Publishable
-from .actions import publish_selected, unpublish_selected, delete_selected, undelete_selected
+from .models import Publishable, PublishJob, PublishOperation, PublishSchedule, Release, ReleaseItem
+from .actions import publish_selected, unpublish_selected, delete_selected, undelete_selected, \
+    add_to_release, publish_release, rollback_selected
 
 from publish.filters import register_filters
 register_filters()
@@ -56,11 +57,13 @@ def attach_filtered_formfields(admin_class):
 
 class PublishableAdmin(admin.ModelAdmin):
 
-    actions = [publish_selected, unpublish_selected, delete_selected, undelete_selected]
+    actions = [publish_selected, unpublish_selected, delete_selected, undelete_selected, add_to_release]
     change_form_template = 'admin/publish_change_form.html'
     publish_confirmation_template = None
     unpublish_confirmation_template = None
     deleted_form_template = None
+    # queue a PublishJob (for the publish_worker command) rather than publishing during the request
+    publish_in_background = False
 
     list_display = ['__unicode__', 'publish_state']
     list_filter = ['publish_state']
@@ -178,3 +181,88 @@ class PublishableTabularInline(admin.TabularInline):
 # add in extra methods
 for admin_class in [PublishableAdmin, PublishableStackedInline, PublishableTabularInline]:
     attach_filtered_formfields(admin_class)
+
+
+class PublishJobAdmin(admin.ModelAdmin):
+    # read-only, so it can be used to check on the progress of jobs
+    list_display = ['__unicode__', 'state', 'user', 'created', 'started', 'finished']
+    list_filter = ['state']
+    readonly_fields = ['description', 'state', 'queue_position', 'object_count', 'user', 'worker', 'attempts',
+                       'created', 'started', 'heartbeat', 'finished', 'duration', 'error']
+    fields = readonly_fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        pass
+
+
+admin.site.register(PublishJob, PublishJobAdmin)
+
+
+class ReleaseItemInline(admin.TabularInline):
+    # drafts can be taken out of a release here, but are added with the add_to_release action
+    model = ReleaseItem
+    fields = readonly_fields = ['content_type', 'object_id', '__unicode__']
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+class ReleaseAdmin(admin.ModelAdmin):
+    list_display = ['name', 'state', 'item_count', 'user', 'created', 'published']
+    list_filter = ['state']
+    readonly_fields = ['state', 'user', 'created', 'published']
+    inlines = [ReleaseItemInline]
+    actions = [publish_release]
+
+    def item_count(self, obj):
+        return obj.items.count()
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.user = request.user
+        super(ReleaseAdmin, self).save_model(request, obj, form, change)
+
+    def save_formset(self, request, form, formset, change):
+        super(ReleaseAdmin, self).save_formset(request, form, formset, change)
+        if formset.deleted_objects:
+            form.instance._forget_plan()
+
+
+admin.site.register(Release, ReleaseAdmin)
+
+
+class PublishScheduleAdmin(admin.ModelAdmin):
+    # drafts are scheduled with Publishable.publish_at/unpublish_at
+    list_display = ['__unicode__', 'action', 'due', 'failed']
+    list_filter = ['action', 'failed']
+    readonly_fields = ['content_type', 'object_id', 'action', 'failed', 'error']
+    fields = readonly_fields[:3] + ['due'] + readonly_fields[3:]
+
+    def has_add_permission(self, request):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        # saving a failed entry (e.g. with a new due time) gives it another go
+        obj.failed, obj.error = False, ''
+        super(PublishScheduleAdmin, self).save_model(request, obj, form, change)
+
+
+admin.site.register(PublishSchedule, PublishScheduleAdmin)
+
+
+class PublishOperationAdmin(admin.ModelAdmin):
+    # operations are only recorded when PUBLISH_HISTORY is True
+    list_display = ['__unicode__', 'user', 'created', 'rolled_back']
+    list_filter = ['created', 'rolled_back']
+    readonly_fields = ['description', 'user', 'created', 'rolled_back']
+    actions = [rollback_selected]
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(PublishOperation, PublishOperationAdmin)
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class PublishConfig(AppConfig):
+    name = 'publish'
+
+    def ready(self):
+        from . import checks  # noqa (registers the checks)
+        from .models import Publishable
+        # work out how to publish each model up front
+        for model in self.apps.get_models():
+            if issubclass(model, Publishable):
+                model._get_copy_plan()
@@ -0,0 +1,617 @@
+from django.db import connections, router
+from django.db.models.deletion import Collector
+from django.db.models import Case, F, Q, Value, When
+
+from .cache import invalidate
+from .history import current_operation, record_collected, record_created, record_deletion, record_rows, recording
+from .models import Publishable, PublishGeneration, send_publish_batch
+from .plan import PlanNode
+from .signals import pre_publish_batch, post_publish_batch
+
+
+def _public_pk(ref):
+    if isinstance(ref, PlanNode):
+        return ref.public.pk
+    return ref
+
+
+def _batches(items, batch_size):
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def _param_batches(groups, using):
+    # batches of (key, [value, ...]) pairs where the keys and
+    # values together will fit in the parameters of one query
+    limit = max(1, connections[using].ops.bulk_batch_size(
+        [None], [None] * sum(1 + len(values) for key, values in groups)))
+    batch, size = [], 0
+    for key, values in groups:
+        if batch and size + 1 + len(values) > limit:
+            yield batch
+            batch, size = [], 0
+        batch.append((key, values))
+        size += 1 + len(values)
+    if batch:
+        yield batch
+
+
+def _update_batch_size(using, fields, objs, constants=0):
+    # each object contributes a primary key and a value to every CASE
+    # expression, plus one entry in the WHERE ... IN (...) clause - on
+    # top of any constants (values set the same for every object)
+    connection = connections[using]
+    params = [None] * (2 * len(fields) + 1)
+    batch_size = connection.ops.bulk_batch_size(params, objs)
+    # (features.max_query_params only exists from Django 2.0, before
+    # which SQLite's limit was the only one bulk_batch_size knew about)
+    max_params = getattr(connection.features, 'max_query_params', None)
+    if max_params is None and connection.vendor == 'sqlite':
+        max_params = 999
+    if max_params is not None:
+        batch_size = min(batch_size, (max_params - constants) // len(params))
+    return max(1, batch_size)
+
+
+def bulk_update(model, objs, fields, using=None, raw=False):
+    '''
+    update the given fields of objs using a single UPDATE statement
+    per batch (building a CASE expression keyed on primary key for
+    each field).  fields should be a list of model field instances.
+
+    the values are prepared as save() would (so auto_now fields are set),
+    unless raw is True, when they are written just as they are
+    '''
+    objs = list(objs)
+    if not objs or not fields:
+        return
+    using = using or router.db_for_write(model)
+    manager = model._base_manager.db_manager(using)
+    for batch in _batches(objs, _update_batch_size(using, fields, objs)):
+        updates = {}
+        for field in fields:
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname) if raw else field.pre_save(obj, False),
+                                                output_field=field))
+                     for obj in batch]
+            updates[field.name] = Case(*whens, default=F(field.attname), output_field=field)
+        manager.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+
+
+def _deferred_public(model, pk, using):
+    values = []
+    for field in model._meta.concrete_fields:
+        if field.primary_key:
+            values.append(pk)
+        elif field.name == 'is_public':
+            values.append(True)
+    return model.from_db(using, [model._meta.pk.attname, 'is_public'], values)
+
+
+def insert_publics_from_drafts(model, draft_pks, using=None):
+    '''
+    create public versions of the given drafts with INSERT ... SELECT, so the
+    field values never leave the database.  only for models whose fields can
+    be copied as they are (see CopyPlan.copy_in_database).
+
+    returns a dict of draft pk -> public pk
+    '''
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    copied = set(copy_field.field.name for copy_field in model._get_copy_plan().fields)
+
+    columns, values, params = [], [], []
+    for field in opts.concrete_fields:
+        if field.primary_key:
+            continue
+        columns.append(qn(field.column))
+        if field.name in copied:
+            values.append(qn(field.column))
+            continue
+        if field.name == 'public':
+            # temporarily point each new public row back at it's
+            # draft so we can find out which primary key it was given
+            values.append(qn(opts.pk.column))
+            continue
+        if field.name == 'is_public':
+            value = True
+        elif field.name == 'publish_state':
+            value = Publishable.PUBLISH_DEFAULT
+        else:
+            value = field.get_default()
+        # (escaped, as the IN (...) placeholders are added later)
+        values.append('%%s')
+        params.append(field.get_db_prep_save(value, connection))
+
+    sql = 'INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s IN (%%s)' % (
+        qn(opts.db_table), ', '.join(columns), ', '.join(values), qn(opts.db_table), qn(opts.pk.column))
+    manager = model._base_manager.db_manager(using)
+    created = {}
+    with connection.cursor() as cursor:
+        for batch in _batches(draft_pks, max(1, connection.ops.bulk_batch_size([None], params + draft_pks))):
+            cursor.execute(sql % ', '.join(['%s'] * len(batch)), params + list(batch))
+            created.update(manager.filter(is_public=True, public__in=batch).order_by().values_list('public', 'pk'))
+            manager.filter(is_public=True, public__in=batch).update(public=None)
+    return created
+
+
+def update_publics_from_drafts(model, fields, pairs, using=None):
+    '''
+    copy fields from drafts to their existing public versions with one UPDATE
+    (per batch) that reads from the drafts, so the values never leave the
+    database.  pairs are (draft pk, public pk)
+    '''
+    if not fields or not pairs:
+        return
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    opts = model._meta
+    table, pk, public = qn(opts.db_table), qn(opts.pk.column), qn(opts.get_field('public').column)
+    draft = qn('publish_draft')
+
+    if connection.vendor == 'postgresql':
+        sql = 'UPDATE %s SET %s FROM %s AS %s WHERE %s.%s = %s.%s AND %s.%s IN (%%s)' % (
+            table, ', '.join('%s = %s.%s' % (qn(field.column), draft, qn(field.column)) for field in fields),
+            table, draft, draft, public, table, pk, draft, pk)
+    elif connection.vendor == 'mysql':
+        sql = 'UPDATE %s INNER JOIN %s AS %s ON %s.%s = %s.%s SET %s WHERE %s.%s IN (%%s)' % (
+            table, table, draft, draft, public, table, pk,
+            ', '.join('%s.%s = %s.%s' % (table, qn(field.column), draft, qn(field.column)) for field in fields),
+            draft, pk)
+    else:
+        sql = 'UPDATE %s SET %s WHERE %s IN (%%s)' % (table, ', '.join(
+            '%s = (SELECT %s.%s FROM %s AS %s WHERE %s.%s = %s.%s)' % (
+                qn(field.column), draft, qn(field.column), table, draft, draft, public, table, pk)
+            for field in fields), pk)
+
+    # the first two select by the draft's pk, the
+    # correlated subqueries by the public one
+    by_draft = connection.vendor in ('postgresql', 'mysql')
+    pks = [draft_pk if by_draft else public_pk for draft_pk, public_pk in pairs]
+    with connection.cursor() as cursor:
+        for batch in _batches(pks, max(1, connection.ops.bulk_batch_size([None], pks))):
+            cursor.execute(sql % ', '.join(['%s'] * len(batch)), list(batch))
+
+
+def _through_fields(field):
+    through = field.rel.through
+    source = through._meta.get_field(field.m2m_field_name()).attname
+    target = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    return through, source, target
+
+
+def _is_symmetrical(field):
+    return getattr(field.rel, 'symmetrical', False) and field.rel.to == field.model
+
+
+def through_pairs(field, source_pks, using=None):
+    '''
+    the (source pk, target pk) pairs in the through table of the many-to-many
+    field for all of source_pks - with one query (per batch)
+    '''
+    through, source, target = _through_fields(field)
+    source_pks = list(source_pks)
+    if not source_pks:
+        return []
+    using = using or router.db_for_read(through)
+    manager = through._base_manager.db_manager(using)
+    pairs = []
+    for batch in _batches(source_pks, max(1, connections[using].ops.bulk_batch_size([None], source_pks))):
+        pairs.extend(manager.filter(**{'%s__in' % source: batch}).order_by().values_list(source, target))
+    return pairs
+
+
+def sync_many_to_many(field, targets, using=None):
+    '''
+    make the many-to-many field contain exactly the given targets, a dict
+    of source pk -> [target pk, ...].
+
+    The through table is read once (per batch) for all of the sources and
+    only the rows that differ are deleted and inserted - so nothing is
+    written when nothing has changed.  Note that, unlike add() and remove(),
+    this does not send m2m_changed.
+    '''
+    through, source, target = _through_fields(field)
+    sources = list(targets)
+    if not sources:
+        return
+    using = using or router.db_for_write(through)
+    manager = through._base_manager.db_manager(using)
+
+    wanted = set((pk, target_pk) for pk in sources for target_pk in targets[pk])
+    symmetrical = _is_symmetrical(field)
+    if symmetrical:
+        # add() keeps both directions in step for these, so do the same
+        wanted |= set((target_pk, pk) for pk, target_pk in wanted)
+
+    stale = []
+    params = [None, None] if symmetrical else [None]
+    for batch in _batches(sources, max(1, connections[using].ops.bulk_batch_size(params, sources))):
+        query = Q(**{'%s__in' % source: batch})
+        if symmetrical:
+            query |= Q(**{'%s__in' % target: batch})
+        for pk, source_pk, target_pk in manager.filter(query).order_by().values_list('pk', source, target):
+            if (source_pk, target_pk) in wanted:
+                wanted.discard((source_pk, target_pk))
+            else:
+                stale.append(pk)
+
+    for batch in _batches(stale, max(1, connections[using].ops.bulk_batch_size([None], stale))):
+        manager.filter(pk__in=batch).delete()
+    if wanted:
+        manager.bulk_create([through(**{source: source_pk, target: target_pk})
+                             for source_pk, target_pk in sorted(wanted)])
+
+
+class BulkPublisher(object):
+    '''
+    execute a PublishPlan.
+
+    The public rows are written a model at a time: new public rows with
+    bulk_create, existing ones with bulk_update and the drafts are then
+    updated to point at them with a handful of UPDATE statements.
+
+    Drafts are written in "levels" (see PublishPlan.sort), so that any
+    publishable foreign key targets that do not have a public version yet
+    are created before the models that refer to them.  Foreign keys that
+    form a cycle are filled in afterwards, with one UPDATE per field.
+    '''
+
+    def __init__(self, plan, using=None):
+        self.plan = plan
+        self.using = using
+        # (model, pk) -> public instance for foreign keys with publish functions
+        self._foreign_key_publics = {}
+        # (node, copy field) for deferred foreign keys left empty by _copy_fields
+        self._deferred = []
+
+    def execute(self):
+        # should be called inside a transaction (see PublishPlan.execute)
+        plan, using = self.plan, self.using
+        with recording(u'Publish %d objects' % (len(plan.nodes) + len(plan.deletions)), using=using):
+            self._execute(plan, using)
+
+    def _execute(self, plan, using):
+        changed = [node.instance for node in plan.nodes if not node.unchanged]
+        deleted = [instance for instance, parent in plan.deletions]
+        send_publish_batch(pre_publish_batch, changed, deleted, using=using)
+
+        for node in plan.nodes:
+            if not node.unchanged:
+                node.instance._pre_publish(False, plan.all_published)
+
+        self._load_publics(using)
+        self._record_pre_images(using)
+        self._load_foreign_key_publics(using)
+        self._write_publics(using)
+        self._record_created(using)
+        self._write_deferred_foreign_keys(using)
+        self._mark_unchanged(using)
+        self._publish_many_to_many(using)
+        self._delete_reverse_orphans(using)
+        self._publish_deletions(using)
+
+        if changed or deleted:
+            PublishGeneration.bump(set(instance.__class__ for instance in changed + deleted), using=using)
+
+        for node in plan.nodes:
+            if not node.unchanged:
+                node.instance._post_publish(False, plan.all_published)
+        send_publish_batch(post_publish_batch, changed, deleted, using=using)
+
+    def _by_model(self, nodes):
+        by_model = {}
+        for node in nodes:
+            by_model.setdefault(node.instance.__class__, []).append(node)
+        return by_model
+
+    def _load_publics(self, using):
+        with_public = [node for node in self.plan.nodes if node.had_public]
+        for model, nodes in self._by_model(with_public).items():
+            publics = model._base_manager.db_manager(using)
+            copy_plan = model._get_copy_plan()
+            if copy_plan.track_changes or copy_plan.copy_in_database:
+                # we only ever set fields on these (or copy them in the database),
+                # so don't load the columns (e.g. big text fields) until we need to
+                publics = publics.only(model._meta.pk.name)
+            publics = publics.in_bulk([node.public_id for node in nodes])
+            for node in nodes:
+                node.public = publics[node.public_id]
+
+    def _record_pre_images(self, using):
+        # the drafts and public rows as they were before publishing (see history.py)
+        if current_operation() is None:
+            return
+        for model, nodes in self._by_model(self.plan.nodes).items():
+            record_rows(model, [node.instance.pk for node in nodes] +
+                        [node.public_id for node in nodes if node.had_public], using=using)
+
+    def _record_created(self, using):
+        if current_operation() is None:
+            return
+        created = [node for node in self.plan.nodes if node.write and not node.had_public]
+        for model, nodes in self._by_model(created).items():
+            record_created(model, [node.public.pk for node in nodes], using=using)
+
+    def _load_foreign_key_publics(self, using):
+        # publish functions for foreign keys expect to be given an
+        # instance (rather than just an id) so load them all up front
+        pks_by_model = {}
+        for node in self.plan.nodes:
+            if not node.write:
+                continue
+            for copy_field in node.instance._get_copy_plan().foreign_keys:
+                target = node.foreign_keys[copy_field.field.name]
+                if copy_field.publish_function is not None and target is not None \
+                        and not isinstance(target, PlanNode):
+                    pks_by_model.setdefault(copy_field.field.rel.to, set()).add(target)
+
+        for model, pks in pks_by_model.items():
+            for pk, public in model._base_manager.db_manager(using).in_bulk(list(pks)).items():
+                self._foreign_key_publics[(model, pk)] = public
+
+    def _write_publics(self, using):
+        levels = {}
+        for node in self.plan.nodes:
+            if node.write:
+                levels.setdefault(node.level, []).append(node)
+
+        for level in sorted(levels):
+            for model, nodes in self._by_model(levels[level]).items():
+                if model._meta.parents:
+                    # bulk_create can't handle multi-table inheritance
+                    self._save_publics(nodes)
+                else:
+                    self._bulk_save_publics(model, nodes, using)
+
+    def _write_deferred_foreign_keys(self, using):
+        by_field = {}
+        for node, copy_field in self._deferred:
+            target = node.foreign_keys[copy_field.field.name]
+            (copy_field.publish_function or setattr)(node.public, copy_field.field.name, target.public)
+            by_field.setdefault((node.instance.__class__, copy_field.field), []).append(node.public)
+        for (model, field), publics in by_field.items():
+            bulk_update(model, publics, [field], using=using)
+
+    def _fields_to_copy(self, node):
+        copy_plan = node.instance._get_copy_plan()
+        if node.had_public:
+            return copy_plan.fields_to_copy(node.instance._get_changed_fields())
+        return copy_plan.fields
+
+    def _copy_fields(self, node):
+        instance = node.instance
+        if node.public is None:
+            node.public = instance.__class__(is_public=True)
+        public = node.public
+
+        copied = []
+        for copy_field in self._fields_to_copy(node):
+            field = copy_field.field
+            copied.append(field)
+            publish_function = copy_field.publish_function
+            if copy_field.publishable:
+                target = node.foreign_keys[field.name]
+                if field.name in node.deferred:
+                    # target hasn't been written yet
+                    setattr(public, field.attname, None)
+                    self._deferred.append((node, copy_field))
+                    continue
+                if isinstance(target, PlanNode):
+                    value = target.public
+                elif publish_function is None:
+                    # no need to load the public instance just to copy it's id
+                    setattr(public, field.attname, target)
+                    continue
+                else:
+                    value = self._foreign_key_publics.get((field.rel.to, target))
+            else:
+                value = getattr(instance, field.name)
+            (publish_function or setattr)(public, field.name, value)
+
+        if node.fingerprint is not None:
+            setattr(public, Publishable.FINGERPRINT, node.fingerprint)
+            setattr(instance, Publishable.FINGERPRINT, node.fingerprint)
+            copied.append(instance._meta.get_field(Publishable.FINGERPRINT))
+        return copied
+
+    def _save_publics(self, nodes):
+        for node in nodes:
+            copied = self._copy_fields(node)
+            instance = node.instance
+            copy_plan = instance._get_copy_plan()
+            if node.had_public and copy_plan.track_changes:
+                node.public.save(update_fields=[field.name for field in copied])
+            else:
+                node.public.save()
+            instance.public = node.public
+            instance.publish_state = Publishable.PUBLISH_DEFAULT
+            if copy_plan.track_changes:
+                setattr(instance, Publishable.CHANGED_FIELDS, u'')
+            instance.save(mark_changed=False)
+
+    def _bulk_save_publics(self, model, nodes, using):
+        if model._get_copy_plan().copy_in_database:
+            self._copy_publics_in_database(model, nodes, using)
+        else:
+            self._copy_publics(model, nodes, using)
+        # neither way sends post_save
+        invalidate(model, [node.public.pk for node in nodes if node.had_public], using=using)
+        self._flip_drafts(model, nodes, using)
+
+    def _copy_publics(self, model, nodes, using):
+        manager = model._base_manager.db_manager(using)
+        connection = connections[using]
+
+        # existing public rows are grouped by which fields need copying
+        existing, new = {}, []
+        for node in nodes:
+            fields = tuple(self._copy_fields(node))
+            if node.had_public:
+                existing.setdefault(fields, []).append(node)
+            else:
+                new.append(node)
+
+        for fields, group in existing.items():
+            bulk_update(model, [node.public for node in group], fields, using=using)
+
+        if new:
+            if not connection.features.can_return_ids_from_bulk_insert:
+                # temporarily point each new public row back at it's draft
+                # so we can find out which primary key it was given
+                for node in new:
+                    node.public.public_id = node.instance.pk
+            manager.bulk_create([node.public for node in new])
+
+            missing = [node for node in new if node.public.pk is None]
+            if missing:
+                created = dict(manager.filter(is_public=True, public__in=[node.instance.pk for node in missing])
+                                      .order_by().values_list('public', 'pk'))
+                for node in missing:
+                    node.public.pk = created[node.instance.pk]
+                    node.public.public_id = None
+                    node.public._state.adding = False
+                    node.public._state.db = using
+                manager.filter(pk__in=[node.public.pk for node in missing]).update(public=None)
+
+    def _copy_publics_in_database(self, model, nodes, using):
+        copy_plan = model._get_copy_plan()
+        existing, new = {}, []
+        for node in nodes:
+            if node.had_public:
+                fields = tuple(copy_field.field for copy_field in self._fields_to_copy(node))
+                existing.setdefault(fields, []).append(node)
+            else:
+                new.append(node)
+
+        for fields, group in existing.items():
+            update_publics_from_drafts(model, fields, [(node.instance.pk, node.public.pk) for node in group],
+                                       using=using)
+
+        if new:
+            created = insert_publics_from_drafts(model, [node.instance.pk for node in new], using=using)
+            for node in new:
+                # none of the fields are loaded, so they are read
+                # from the database if they are needed
+                node.public = _deferred_public(model, created[node.instance.pk], using)
+
+        if copy_plan.fingerprint:
+            for node in nodes:
+                setattr(node.public, Publishable.FINGERPRINT, node.fingerprint)
+            bulk_update(model, [node.public for node in nodes], [model._meta.get_field(Publishable.FINGERPRINT)],
+                        using=using)
+        for node in nodes:
+            if node.fingerprint is not None:
+                setattr(node.instance, Publishable.FINGERPRINT, node.fingerprint)
+
+    def _flip_drafts(self, model, nodes, using):
+        # flip the drafts over to being published
+        manager = model._base_manager.db_manager(using)
+        copy_plan = model._get_copy_plan()
+        track_changes, fingerprint = copy_plan.track_changes, copy_plan.fingerprint
+        # (publish_state and publish_changed_fields are the same for every draft)
+        batch_size = _update_batch_size(using, [None, None] if fingerprint else [None], nodes,
+                                        constants=2 if track_changes else 1)
+        for batch in _batches(nodes, batch_size):
+            whens = [When(pk=node.instance.pk, then=Value(node.public.pk)) for node in batch]
+            updates = {
+                'publish_state': Publishable.PUBLISH_DEFAULT,
+                'public': Case(*whens, default=F('public'), output_field=model._meta.get_field('public')),
+            }
+            if track_changes:
+                updates[Publishable.CHANGED_FIELDS] = u''
+            if fingerprint:
+                whens = [When(pk=node.instance.pk, then=Value(node.fingerprint)) for node in batch]
+                updates[Publishable.FINGERPRINT] = Case(*whens, default=F(Publishable.FINGERPRINT),
+                                                        output_field=model._meta.get_field(Publishable.FINGERPRINT))
+            manager.filter(pk__in=[node.instance.pk for node in batch]).update(**updates)
+
+        for node in nodes:
+            node.instance.public = node.public
+            node.instance.publish_state = Publishable.PUBLISH_DEFAULT
+            if track_changes:
+                setattr(node.instance, Publishable.CHANGED_FIELDS, u'')
+
+    def _mark_unchanged(self, using):
+        # drafts that were saved without really being changed
+        # just need to be marked as published again
+        unchanged = [node for node in self.plan.nodes if node.unchanged]
+        for model, nodes in self._by_model(unchanged).items():
+            updates = {'publish_state': Publishable.PUBLISH_DEFAULT}
+            if model._get_copy_plan().track_changes:
+                updates[Publishable.CHANGED_FIELDS] = u''
+            manager = model._base_manager.db_manager(using)
+            for batch in _batches(nodes, max(1, connections[using].ops.bulk_batch_size([None], nodes))):
+                manager.filter(pk__in=[node.instance.pk for node in batch]).update(**updates)
+            for node in nodes:
+                for name, value in updates.items():
+                    setattr(node.instance, name, value)
+
+    def _publish_many_to_many(self, using):
+        # gather up every public object's targets so each field
+        # only needs syncing once
+        by_through = {}
+        for node in self.plan.nodes:
+            opts = node.instance._meta
+            for name, targets in node.many_to_many:
+                field = opts.get_field(name)
+                field, wanted = by_through.setdefault(field.rel.through, (field, {}))
+                wanted[node.public.pk] = [_public_pk(target) for target in targets if target is not None]
+
+        for field, wanted in by_through.values():
+            sync_many_to_many(field, wanted, using=using)
+
+    def _delete_reverse_orphans(self, using):
+        # public children that are no longer children of the draft
+        by_relation = {}
+        for node in self.plan.nodes:
+            if not node.had_public:
+                continue
+            copy_reverses = dict((copy_reverse.name, copy_reverse)
+                                 for copy_reverse in node.instance._get_copy_plan().reverse)
+            for name, children in node.reverse:
+                related = copy_reverses[name].related
+                by_relation.setdefault(related, []).append(
+                    (node.public.pk, [_public_pk(child) for child in children]))
+
+        for related, parents in by_relation.items():
+            field = related.field
+            manager = field.model._base_manager.db_manager(using)
+            for batch in _param_batches(parents, using):
+                kept = [pk for parent_pk, public_ids in batch for pk in public_ids]
+                orphans = manager.filter(**{'%s__in' % field.attname: [parent_pk for parent_pk, public_ids in batch]})
+                if kept:
+                    orphans = orphans.exclude(pk__in=kept)
+                # a normal (collected) delete, so cascades and signals still happen
+                record_deletion(orphans, using=using)
+                orphans.delete()
+
+    def _publish_deletions(self, using):
+        # the drafts and their public versions are all deleted together,
+        # using one collector so any cascades are gathered in bulk too
+        deletions, all_published = self.plan.deletions, self.plan.all_published
+        if not deletions:
+            return
+
+        for instance, parent in deletions:
+            instance._pre_publish(False, all_published, deleted=True)
+
+        pks_by_model = {}
+        for instance, parent in deletions:
+            pks = pks_by_model.setdefault(instance.__class__, [])
+            pks.append(instance.pk)
+            if instance.public_id is not None:
+                pks.append(instance.public_id)
+
+        collector = Collector(using=using)
+        for model, pks in pks_by_model.items():
+            manager = model._base_manager.db_manager(using)
+            for batch in _batches(pks, max(1, connections[using].ops.bulk_batch_size([None], pks))):
+                collector.collect(manager.filter(pk__in=batch))
+        record_collected(collector)
+        collector.delete()
+
+        for instance, parent in deletions:
+            instance._post_publish(False, all_published, deleted=True)
@@ -0,0 +1,119 @@
+'''
+a read-through cache of published objects, for models that list the fields
+they are looked up by in PublishMeta.publish_cache_lookups (see
+PublishableManager.get_published).
+
+each published object is cached under it's primary key, along with an
+index from each lookup to that primary key.  only the primary key entries
+are invalidated (whenever a public object is saved or deleted) - an index
+entry that is out of date is spotted when the object it points at no
+longer matches the lookup.
+'''
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import force_unicode
+
+
+def _get_cache():
+    return caches[getattr(settings, 'PUBLISH_CACHE', DEFAULT_CACHE_ALIAS)]
+
+
+def _model_key(model):
+    opts = model._meta
+    return 'publish:%s.%s' % (opts.app_label, opts.model_name)
+
+
+def _object_key(model, pk):
+    return '%s:pk:%s' % (_model_key(model), force_unicode(pk))
+
+
+def _lookup_key(model, name, value):
+    value = hashlib.md5(force_unicode(value).encode('utf-8')).hexdigest()
+    return '%s:%s:%s' % (_model_key(model), name, value)
+
+
+def _lookup_name(model, lookup):
+    if len(lookup) != 1:
+        return None
+    name = lookup.keys()[0]
+    if name == model._meta.pk.name:
+        name = 'pk'
+    if name not in model._get_copy_plan().cache_lookups:
+        return None
+    return name
+
+
+def _matches(instance, name, value):
+    if name == 'pk':
+        return force_unicode(instance.pk) == force_unicode(value)
+    return force_unicode(getattr(instance, name)) == force_unicode(value)
+
+
+def get_published(queryset, **lookup):
+    '''
+    get the published object matching lookup (a single field listed in the
+    model's publish_cache_lookups), from the cache if possible.
+
+    any other lookup is just passed on to get()
+    '''
+    model = queryset.model
+    queryset = queryset.published()
+    name = _lookup_name(model, lookup)
+    if name is None:
+        return queryset.get(**lookup)
+
+    value = lookup.values()[0]
+    cache = _get_cache()
+    if name == 'pk':
+        lookup_key, pk = None, value
+    else:
+        lookup_key = _lookup_key(model, name, value)
+        pk = cache.get(lookup_key)
+    if pk is not None:
+        instance = cache.get(_object_key(model, pk))
+        if instance is not None and _matches(instance, name, value):
+            return instance
+
+    instance = queryset.get(**{name: value})
+    timeout = getattr(settings, 'PUBLISH_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    entries = {_object_key(model, instance.pk): instance}
+    if lookup_key is not None:
+        entries[lookup_key] = instance.pk
+    cache.set_many(entries, timeout)
+    return instance
+
+
+def invalidate(model, pks, using=None):
+    '''
+    remove the published objects with the given primary keys from the cache,
+    both now and (in case they are read again before then) once the current
+    transaction has been committed
+    '''
+    if not model._get_copy_plan().cache_lookups:
+        return
+    keys = [_object_key(model, pk) for pk in pks]
+    if not keys:
+        return
+    _get_cache().delete_many(keys)
+    transaction.on_commit(lambda: _get_cache().delete_many(keys), using=using)
+
+
+def _invalidate_instance(sender, instance, **kw):
+    if instance.is_public and instance.pk is not None:
+        invalidate(sender, [instance.pk], using=instance._state.db)
+
+
+def connect_signals(model):
+    '''
+    invalidate the public objects of model whenever they are saved or deleted.
+
+    listening for post_delete also stops Django from "fast" deleting them (which
+    would bypass the signal), so cascades and queryset deletes are covered too
+    '''
+    post_save.connect(_invalidate_instance, sender=model, dispatch_uid='publish_cache_save')
+    post_delete.connect(_invalidate_instance, sender=model, dispatch_uid='publish_cache_delete')
@@ -0,0 +1,74 @@
+from django.apps import apps
+from django.core import checks
+from django.db import connections, router
+
+from .indexes import get_publish_indexes
+
+
+def _publishable_models(app_configs):
+    from .models import Publishable
+    if app_configs is None:
+        models = apps.get_models()
+    else:
+        models = [model for app_config in app_configs for model in app_config.get_models()]
+    return [model for model in models if issubclass(model, Publishable)]
+
+
+def _is_indexed(model, name):
+    opts = model._meta
+    if name == 'pk':
+        return True
+    field = opts.get_field(name)
+    if field.db_index or field.unique:
+        return True
+    return any(index.fields[:1] == [name] for index in opts.indexes)
+
+
+@checks.register(checks.Tags.models)
+def check_cached_lookups_indexed(app_configs=None, **kw):
+    '''
+    fields published objects are looked up by should be indexed
+    '''
+    errors = []
+    for model in _publishable_models(app_configs):
+        for name in model.PublishMeta.cache_lookups():
+            if not _is_indexed(model, name):
+                errors.append(checks.Warning(
+                    "'%s' is in publish_cache_lookups, but is not indexed." % name,
+                    hint="Add it to publish_public_index_fields (or publish_public_unique_fields) in PublishMeta.",
+                    obj=model,
+                    id='publish.W001',
+                ))
+    return errors
+
+
+@checks.register(checks.Tags.database)
+def check_publish_indexes_exist(app_configs=None, **kw):
+    '''
+    the indexes PublishMeta asks for should be in the database (they will
+    be missing from tables that were created before they were asked for)
+    '''
+    errors = []
+    for model in _publishable_models(app_configs):
+        expected = get_publish_indexes(model)
+        if not expected or not model._meta.managed:
+            continue
+        connection = connections[router.db_for_write(model)]
+        with connection.cursor() as cursor:
+            if model._meta.db_table not in connection.introspection.table_names(cursor):
+                continue
+            existing = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        for index in expected:
+            if index.name not in existing:
+                errors.append(checks.Warning(
+                    "Index '%s' on %s is missing from the database." % (index.name, ', '.join(index.fields)),
+                    hint='Create it with: %s' % _create_sql(connection, model, index),
+                    obj=model,
+                    id='publish.W002',
+                ))
+    return errors
+
+
+def _create_sql(connection, model, index):
+    with connection.schema_editor(collect_sql=True, atomic=False) as schema_editor:
+        return index.create_sql(model, schema_editor)
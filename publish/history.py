@@ -0,0 +1,346 @@
+'''
+a history of what publishing has done, so that it can be undone.
+
+when the PUBLISH_HISTORY setting is True each publish is recorded as a
+PublishOperation, holding a pre-image of every row it touched - the row's
+values (and, for public rows, what their many-to-many fields contained)
+from just before they were changed, or a note that the row didn't exist
+yet.  rolling an operation back restores those pre-images in bulk, a
+model at a time, without walking the drafts again.
+'''
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.db.models import Model
+from django.db.models.deletion import Collector
+from django.utils import timezone
+from django.utils.encoding import force_unicode
+
+_local = threading.local()
+
+# the fields of a draft that publishing changes
+_DRAFT_FIELDS = ('public', 'publish_state', 'publish_changed_fields', 'publish_fingerprint')
+
+
+def _batches(items, using):
+    # items in batches small enough for a pk__in=... query
+    batch_size = max(1, connections[using].ops.bulk_batch_size([None], items))
+    for i in range(0, len(items), batch_size):
+        yield items[i:i + batch_size]
+
+
+def current_operation():
+    '''
+    the PublishOperation being recorded, or None
+    '''
+    return getattr(_local, 'operation', None)
+
+
+@contextmanager
+def recording(description='', user=None, using=None):
+    '''
+    record everything published until the end of the block as one
+    PublishOperation (or as part of the one already being recorded).
+    nothing is recorded unless PUBLISH_HISTORY is True.
+
+    description can also be a function returning it, so it is only
+    worked out when a new operation is started
+    '''
+    operation = current_operation()
+    if operation is not None:
+        saved = operation.pk is not None
+        try:
+            yield operation
+        except Exception:
+            if not saved:
+                # it was saved in a transaction that is (probably) being rolled back
+                operation.pk = None
+                operation._recorded, operation._partial = set(), set()
+            raise
+        return
+    if not getattr(settings, 'PUBLISH_HISTORY', False):
+        yield None
+        return
+    from .models import PublishOperation
+    # (only saved once there is something to record)
+    if callable(description):
+        description = description()
+    operation = PublishOperation(description=force_unicode(description)[:255], user=user)
+    operation._using = using
+    # (and which of those only hold what publishing changes on a draft)
+    operation._recorded, operation._partial = set(), set()
+    _local.operation = operation
+    try:
+        yield operation
+    finally:
+        _local.operation = None
+
+
+def _key(model, pk):
+    return (model._meta.concrete_model, force_unicode(pk))
+
+
+def _new_pre_images(operation, model, pks, using):
+    # the pks that haven't already been recorded (the first pre-image is the one we want)
+    if operation.pk is None:
+        operation.save(using=operation._using or using)
+    pks = [pk for pk in pks if _key(model, pk) not in operation._recorded]
+    operation._recorded.update(_key(model, pk) for pk in pks)
+    return pks
+
+
+def _save_pre_images(operation, model, pre_images, using):
+    from django.contrib.contenttypes.models import ContentType
+    from .models import PublishPreImage
+    content_type = ContentType.objects.db_manager(using).get_for_model(model, for_concrete_model=True)
+    PublishPreImage._default_manager.db_manager(using).bulk_create([
+        PublishPreImage(operation=operation, content_type=content_type, object_id=force_unicode(pk),
+                        existed=data is not None,
+                        data='' if data is None else json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':')))
+        for pk, data in pre_images])
+
+
+def _capture(model, pks, using, partial=False):
+    # pk -> {'fields': {attname: value}, 'm2m': {name: [target pk, ...]}}
+    # when partial, drafts only get the fields rolling back restores on them
+    # (marked with 'partial': True, as they can't be recreated from that)
+    from .bulk import through_pairs
+    from .models import Publishable
+    fields = model._meta.concrete_fields
+    attnames = [field.attname for field in fields]
+    pk_attname = model._meta.pk.attname
+    rows = OrderedDict()
+    manager = model._base_manager.db_manager(using)
+    if partial and issubclass(model, Publishable):
+        draft_attnames = [field.attname for field in fields
+                          if field.primary_key or field.name == 'is_public' or field.name in _DRAFT_FIELDS]
+        querysets = [(manager.filter(is_public=True), attnames, {}),
+                     (manager.filter(is_public=False), draft_attnames, {'partial': True})]
+    else:
+        querysets = [(manager.all(), attnames, {})]
+    for batch in _batches(pks, using):
+        for queryset, names, extra in querysets:
+            for values in queryset.filter(pk__in=batch).values_list(*names):
+                row = dict(zip(names, values))
+                rows[row[pk_attname]] = dict(extra, fields=row)
+
+    if issubclass(model, Publishable):
+        # only the public rows' many-to-many fields are changed by publishing
+        public_pks = [pk for pk, data in rows.items() if data['fields'].get('is_public')]
+        for copy_m2m in model._get_copy_plan().many_to_many:
+            name = copy_m2m.field.name
+            for pk in public_pks:
+                rows[pk].setdefault('m2m', {})[name] = []
+            for source_pk, target_pk in through_pairs(copy_m2m.field, public_pks, using=using):
+                rows[source_pk]['m2m'][name].append(target_pk)
+    return rows
+
+
+def _complete_pre_images(operation, model, pks, using):
+    # the drafts with the given pks are about to be deleted, so their partial
+    # pre-images need the rest of the row (which publishing didn't change)
+    from django.contrib.contenttypes.models import ContentType
+    from .models import PublishPreImage
+    content_type = ContentType.objects.db_manager(using).get_for_model(model, for_concrete_model=True)
+    rows = _capture(model, pks, using)
+    pre_images = PublishPreImage._default_manager.using(using).filter(operation=operation, content_type=content_type)
+    for batch in _batches([force_unicode(pk) for pk in rows], using):
+        for pre_image in pre_images.filter(object_id__in=batch):
+            data = json.loads(pre_image.data)
+            row = rows[model._meta.pk.to_python(pre_image.object_id)]
+            row['fields'].update(data['fields'])
+            pre_image.data = json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':'))
+            pre_image.save(update_fields=['data'])
+    operation._partial.difference_update(_key(model, pk) for pk in pks)
+
+
+def record_rows(model, pks, using=None, deleting=False):
+    '''
+    record pre-images of the rows of model with the given primary keys,
+    before they are changed (or deleted, if deleting is True - drafts
+    that are only changed just need what publishing changes on them)
+    '''
+    from .models import Publishable
+    operation = current_operation()
+    if operation is None:
+        return
+    using = using or router.db_for_write(model)
+    pks = [pk for pk in pks if pk is not None]
+    if deleting:
+        partial = [pk for pk in pks if _key(model, pk) in operation._partial]
+        if partial:
+            _complete_pre_images(operation, model, partial, using)
+    pks = _new_pre_images(operation, model, pks, using)
+    if pks:
+        rows = _capture(model, pks, using, partial=not deleting)
+        if not deleting and issubclass(model, Publishable):
+            operation._partial.update(_key(model, pk) for pk, data in rows.items() if data.get('partial'))
+        _save_pre_images(operation, model, rows.items(), using)
+
+
+def record_created(model, pks, using=None):
+    '''
+    record that the rows of model with the given primary keys have just been
+    created (so rolling back deletes them)
+    '''
+    operation = current_operation()
+    if operation is None:
+        return
+    using = using or router.db_for_write(model)
+    pks = _new_pre_images(operation, model, pks, using)
+    if pks:
+        _save_pre_images(operation, model, [(pk, None) for pk in pks], using)
+
+
+def record_collected(collector):
+    '''
+    record pre-images of everything a deletion Collector is
+    about to delete (or update), including any cascades
+    '''
+    if current_operation() is None:
+        return
+    using = collector.using
+    for model, instances in collector.data.items():
+        record_rows(model, [instance.pk for instance in instances], using=using, deleting=True)
+    for queryset in collector.fast_deletes:
+        record_rows(queryset.model, list(queryset.values_list('pk', flat=True)), using=using, deleting=True)
+    for model, updates in collector.field_updates.items():
+        for (field, value), instances in updates.items():
+            record_rows(model, [instance.pk for instance in instances], using=using)
+
+
+def record_deletion(objs, using=None):
+    '''
+    record pre-images of objs (a queryset or list of instances) and
+    anything deleting them would cascade to, before they are deleted
+    '''
+    if current_operation() is None:
+        return
+    objs = list(objs)
+    if not objs:
+        return
+    collector = Collector(using=using or router.db_for_write(objs[0].__class__, instance=objs[0]))
+    collector.collect(objs)
+    record_collected(collector)
+
+
+def _restore(model, rows, using):
+    # put rows (pk -> pre-image data) back the way they were
+    from .bulk import bulk_update, sync_many_to_many
+    from .cache import invalidate
+    from .models import Publishable, _has_pre_save
+    opts = model._meta
+    fields = opts.concrete_fields
+    instances = []
+    for pk, data in rows.items():
+        values = data['fields']
+        instances.append(model(**dict((field.attname, field.to_python(values.get(field.attname)))
+                                      for field in fields)))
+
+    manager = model._base_manager.db_manager(using)
+    pks = [instance.pk for instance in instances]
+    existing = set()
+    for batch in _batches(pks, using):
+        existing.update(manager.filter(pk__in=batch).values_list('pk', flat=True))
+
+    # drafts that are still there only get back what publishing changed on
+    # them (so any edits made since are kept), everything else is restored
+    # (apart from drafts deleted since, which there isn't enough to recreate)
+    whole, drafts, missing = [], [], []
+    for instance, data in zip(instances, rows.values()):
+        if instance.pk not in existing:
+            if not data.get('partial'):
+                missing.append(instance)
+        elif issubclass(model, Publishable) and not instance.is_public:
+            drafts.append(instance)
+        else:
+            whole.append(instance)
+    draft_fields = [field for field in fields if field.name in _DRAFT_FIELDS]
+
+    if opts.parents:
+        # bulk_create can't handle multi-table inheritance
+        for instance in whole + missing:
+            Model.save(instance, using=using)
+        for instance in drafts:
+            Model.save(instance, using=using, update_fields=[field.name for field in draft_fields])
+    else:
+        # (raw, so auto_now fields and the like get their old values back too)
+        bulk_update(model, whole, [field for field in fields if not field.primary_key], using=using, raw=True)
+        bulk_update(model, drafts, draft_fields, using=using, raw=True)
+        manager.bulk_create(missing)
+        bulk_update(model, missing, [field for field in fields if _has_pre_save(field)], using=using, raw=True)
+
+    m2m = OrderedDict()
+    for instance, data in zip(instances, rows.values()):
+        for name, targets in data.get('m2m', {}).items():
+            m2m.setdefault(name, {})[instance.pk] = targets
+    for name, targets in m2m.items():
+        sync_many_to_many(opts.get_field(name), targets, using=using)
+    if issubclass(model, Publishable):
+        invalidate(model, [instance.pk for instance in instances if instance.is_public], using=using)
+
+
+def _delete_created(model, pks, using):
+    from .models import Publishable
+    manager = model._base_manager.db_manager(using)
+    if issubclass(model, Publishable):
+        # make sure no draft still points at them (which would delete it too)
+        manager.filter(public__in=pks).update(public=None, publish_state=Publishable.PUBLISH_CHANGED)
+    for batch in _batches(pks, using):
+        manager.filter(pk__in=batch).delete()
+
+
+def rollback(operation_id, using=None):
+    '''
+    put every row the PublishOperation with id operation_id touched back the way it
+    was before - in bulk, a model at a time - and return the operation.
+
+    raises PublishException if it has already been rolled back, or if a later
+    operation (that hasn't been rolled back) touched any of the same rows
+    '''
+    from .models import Publishable, PublishException, PublishGeneration, PublishOperation, PublishPreImage
+    using = using or router.db_for_write(PublishOperation)
+    with transaction.atomic(using=using):
+        operation = PublishOperation._default_manager.using(using).select_for_update().get(pk=operation_id)
+        if operation.rolled_back is not None:
+            raise PublishException("%s has already been rolled back" % force_unicode(operation))
+        pre_images = list(operation.pre_images.select_related('content_type').order_by('id'))
+
+        later = PublishPreImage._default_manager.using(using).filter(
+            operation__gt=operation.pk, operation__rolled_back__isnull=True)
+        by_content_type = OrderedDict()
+        for pre_image in pre_images:
+            by_content_type.setdefault(pre_image.content_type_id, []).append(pre_image.object_id)
+        for content_type_id, object_ids in by_content_type.items():
+            for batch in _batches(object_ids, using):
+                if later.filter(content_type=content_type_id, object_id__in=batch).exists():
+                    raise PublishException("Later publishes changed the same objects as %s, "
+                                           "they need to be rolled back first" % force_unicode(operation))
+
+        # (a model at a time, in the reverse of the order they were first recorded)
+        restore, created = OrderedDict(), OrderedDict()
+        for pre_image in reversed(pre_images):
+            model = pre_image.content_type.model_class()
+            if model is None:
+                continue
+            pk = model._meta.pk.to_python(pre_image.object_id)
+            if pre_image.existed:
+                restore.setdefault(model, OrderedDict())[pk] = json.loads(pre_image.data)
+            else:
+                created.setdefault(model, []).append(pk)
+
+        for model, rows in restore.items():
+            _restore(model, rows, using)
+        for model, pks in created.items():
+            _delete_created(model, pks, using)
+
+        PublishGeneration.bump([model for model in list(restore) + list(created) if issubclass(model, Publishable)],
+                               using=using)
+        operation.rolled_back = timezone.now()
+        operation.save(update_fields=['rolled_back'])
+    return operation
@@ -0,0 +1,73 @@
+'''
+indexes for the queries Publishable models make (see Publishable.Q_*),
+added to a model's Meta.indexes when it's PublishMeta asks for them:
+
+    class PublishMeta(Publishable.PublishMeta):
+        publish_indexes = True
+        publish_public_index_fields = ['title']
+        publish_public_unique_fields = ['slug']
+'''
+from django.db import models
+
+# databases that support "CREATE INDEX ... WHERE ..."
+PARTIAL_INDEX_VENDORS = ('postgresql', 'sqlite')
+
+
+class PublishIndex(models.Index):
+    '''
+    an index of just the public rows (or, if the database doesn't support partial
+    indexes, an index that starts with is_public).  if unique is True the fields
+    must be unique amongst the public rows - this can only be enforced by databases
+    that support partial indexes.
+    '''
+    suffix = 'pub'
+
+    def __init__(self, fields=[], name=None, unique=False):
+        self.unique = unique
+        if unique:
+            self.suffix = 'unq'
+        super(PublishIndex, self).__init__(fields=fields, name=name)
+
+    def create_sql(self, model, schema_editor, using=''):
+        values = self.get_sql_create_template_values(model, schema_editor, using)
+        is_public = schema_editor.quote_name(model._meta.get_field('is_public').column)
+        if schema_editor.connection.vendor not in PARTIAL_INDEX_VENDORS:
+            values['columns'] = '%s, %s' % (is_public, values['columns'])
+            return schema_editor.sql_create_index % values
+        values['unique'] = ' UNIQUE' if self.unique else ''
+        values['condition'] = '%s = %s' % (is_public, schema_editor.quote_value(True))
+        return 'CREATE%(unique)s INDEX %(name)s ON %(table)s%(using)s (%(columns)s)%(extra)s WHERE %(condition)s' % values
+
+    def deconstruct(self):
+        path, args, kwargs = super(PublishIndex, self).deconstruct()
+        if self.unique:
+            kwargs['unique'] = True
+        return path, args, kwargs
+
+    def __repr__(self):
+        return "<%s: fields='%s'%s>" % (self.__class__.__name__, ', '.join(self.fields),
+                                        ' unique' if self.unique else '')
+
+
+def get_publish_indexes(model):
+    '''
+    the indexes model's PublishMeta asks for
+    '''
+    meta = model.PublishMeta
+    local_fields = set(field.name for field in model._meta.local_fields)
+    unique_fields = [name for name in meta.public_unique_fields() if name in local_fields]
+    index_fields = [name for name in meta.public_index_fields() if name in local_fields and name not in unique_fields]
+    if not (getattr(meta, 'publish_indexes', False) or index_fields or unique_fields):
+        return []
+    if 'is_public' not in local_fields:
+        # (multi-table inheritance) is_public is in another table
+        return []
+
+    # for changed(), draft(), deleted() etc
+    indexes = [models.Index(fields=['is_public', 'publish_state'])]
+    # lookups on the public site
+    indexes.extend(PublishIndex(fields=[name]) for name in index_fields)
+    indexes.extend(PublishIndex(fields=[name], unique=True) for name in unique_fields)
+    for index in indexes:
+        index.set_name_with_model(model)
+    return indexes
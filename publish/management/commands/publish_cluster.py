@@ -0,0 +1,61 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from publish.indexes import get_publish_indexes
+from publish.models import Publishable
+
+
+class Command(BaseCommand):
+    help = ('Rewrite the tables of Publishable models (that ask for publish_indexes) in (is_public, '
+            'publish_state) order, using CLUSTER, so the public rows are next to each other.  WARNING: each table '
+            'is locked (ACCESS EXCLUSIVE, blocking reads as well as writes) for the whole of its rewrite.  The '
+            'ordering is not maintained - later writes gradually undo it - so re-run this periodically, during '
+            'quiet periods.  PostgreSQL only.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', metavar='app_label.ModelName',
+                            help='Only cluster these models.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='The database to cluster the tables in (default "default").')
+        parser.add_argument('--sql', action='store_true', default=False,
+                            help='Just print the SQL, rather than running it.')
+
+    def get_models(self, labels):
+        if labels:
+            try:
+                models = [apps.get_model(label) for label in labels]
+            except (LookupError, ValueError) as e:
+                raise CommandError(str(e))
+        else:
+            models = apps.get_models()
+        return [model for model in models if issubclass(model, Publishable)]
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'postgresql':
+            # (the statements wouldn't mean anything to other databases, even just printed)
+            raise CommandError('publish_cluster only works with PostgreSQL.')
+
+        quote_name = connection.ops.quote_name
+        statements = []
+        for model in self.get_models(options['models']):
+            # the (is_public, publish_state) index
+            indexes = [index for index in get_publish_indexes(model) if index.fields[:1] == ['is_public']]
+            if not indexes:
+                continue
+            table = quote_name(model._meta.db_table)
+            statements.append('CLUSTER %s USING %s' % (table, quote_name(indexes[0].name)))
+            statements.append('ANALYZE %s' % table)
+
+        if options['sql']:
+            for statement in statements:
+                self.stdout.write('%s;' % statement)
+            return
+
+        verbosity = int(options.get('verbosity', 1))
+        with connection.cursor() as cursor:
+            for statement in statements:
+                if verbosity > 1:
+                    self.stdout.write(statement)
+                cursor.execute(statement)
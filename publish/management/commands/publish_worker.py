@@ -0,0 +1,41 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from publish.models import PublishJob
+
+
+class Command(BaseCommand):
+    help = 'Run queued publish jobs.  Several workers can be run at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Run any waiting jobs and then exit, rather than waiting for more.')
+        parser.add_argument('--sleep', type=float, default=5,
+                            help='Seconds to wait between checking for new jobs (default 5).')
+        parser.add_argument('--name', default='%s:%d' % (socket.gethostname(), os.getpid()),
+                            help='Name to record against the jobs this worker runs.')
+        parser.add_argument('--timeout', type=float, default=None,
+                            help='Seconds without a heartbeat after which a running job is assumed to have died '
+                                 'with its worker and is queued again (default the PUBLISH_JOB_TIMEOUT setting, '
+                                 'or 5 minutes).')
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        while True:
+            job = PublishJob.claim(worker=options['name'], timeout=options['timeout'])
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            if verbosity:
+                self.stdout.write('Publishing "%s"...' % job)
+            if job.run():
+                if verbosity:
+                    self.stdout.write('Published "%s" in %s' % (job, job.duration()))
+            else:
+                self.stderr.write('Failed to publish "%s":\n%s' % (job, job.error))
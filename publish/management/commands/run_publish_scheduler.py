@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from publish.models import PublishSchedule
+
+
+class Command(BaseCommand):
+    help = 'Publish and unpublish drafts when they are scheduled to be.  Several schedulers can be run at once.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Run anything that is due and then exit, rather than waiting for more.')
+        parser.add_argument('--sleep', type=float, default=30,
+                            help='Seconds to wait between checking for due drafts (default 30).')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='How many due drafts to claim (and publish in one go) at a time (default 100).')
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        while True:
+            count = PublishSchedule.run_due(batch_size=options['batch_size'])
+            if count:
+                if verbosity:
+                    self.stdout.write('Ran %d scheduled publish%s' % (count, '' if count == 1 else 'es'))
+                continue
+            if options['once']:
+                break
+            time.sleep(options['sleep'])
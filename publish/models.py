@@ -1,11 +1,28 @@
+import hashlib
+import logging
+import threading
+import traceback
+from collections import namedtuple, OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import connections, models, router, transaction, DatabaseError, IntegrityError
 from django.db.models.base import ModelBase
 from django.db.models.fields.related import RelatedField
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save
 from django.db.models.query import QuerySet, Q
+from django.utils import timezone
+from django.utils.encoding import force_unicode
 
-from .signals import pre_publish, post_publish
-from .utils import NestedSet
+from .cache import connect_signals as connect_cache_signals, _get_cache, _invalidate_instance
+from .history import record_created, record_deletion, record_rows, recording
+from .indexes import get_publish_indexes
+from .routers import PUBLISHED_HINT, record_publish
+from .signals import pre_publish, post_publish, pre_publish_batch, post_publish_batch, send_post_publish
+from .utils import NestedSet, Return, run_steps
 
 
 # this takes some inspiration from the publisher stuff in
@@ -21,14 +38,232 @@ except NameError:  # Python 3, basestring causes NameError
     stringtype = str
 
 
+# compiled CopyPlan for each Publishable model
+_copy_plans = {}
+
+logger = logging.getLogger('publish')
+
+
 class PublishException(Exception):
     pass
 
 
+def _group_by_model(instances):
+    grouped = OrderedDict()
+    for instance in instances:
+        grouped.setdefault(instance.__class__, []).append(instance)
+    return grouped
+
+
+def _bump_generations(instances, using=None):
+    if instances:
+        PublishGeneration.bump(set(instance.__class__ for instance in instances), using=using)
+
+
+def _published_changes(all_published):
+    # everything in all_published apart from drafts that were skipped
+    # because they hadn't really changed (see Publishable._is_unchanged)
+    return [instance for instance in all_published if not getattr(instance, '_publish_unchanged', False)]
+
+
+def _func(method):
+    # the function behind a method
+    return getattr(method, '__func__', method)
+
+
+def _called(function, kwargs):
+    # steps (for run_steps) that just call function
+    yield Return(function(**kwargs))
+
+
+def _split_published(all_published):
+    # (changed, deleted) instances, for send_publish_batch
+    changed, deleted = [], []
+    for instance in _published_changes(all_published):
+        if instance.publish_state == Publishable.PUBLISH_DELETE:
+            deleted.append(instance)
+        else:
+            changed.append(instance)
+    return changed, deleted
+
+
+def send_publish_batch(signal, changed, deleted, using=None):
+    '''
+    send pre_publish_batch or post_publish_batch for the given
+    changed and deleted instances
+    '''
+    changed, deleted = _group_by_model(changed), _group_by_model(deleted)
+    if signal is post_publish_batch:
+        send_post_publish(signal, sender=Publishable, using=using, changed=changed, deleted=deleted)
+    else:
+        signal.send(sender=Publishable, changed=changed, deleted=deleted)
+
+
 class UnpublishException(Exception):
     pass
 
 
+# how to copy each field of a model to it's public version
+# publish_function is None when the value can just be set
+CopyField = namedtuple('CopyField', ['field', 'publish_function', 'publishable'])
+CopyManyToMany = namedtuple('CopyManyToMany', ['field', 'publishable'])
+CopyReverse = namedtuple('CopyReverse', ['name', 'related', 'multiple'])
+
+
+class ChangedFieldsField(models.TextField):
+    '''
+    records, on a draft, the names of the fields that have been changed since
+    it was last published - so that publishing only needs to copy those.
+
+    to use it add one called publish_changed_fields to a Publishable model.
+    None means we don't know what has changed (so everything is copied).
+    '''
+
+    def __init__(self, *arg, **kw):
+        kw.setdefault('null', True)
+        kw.setdefault('blank', True)
+        kw.setdefault('editable', False)
+        super(ChangedFieldsField, self).__init__(*arg, **kw)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(ChangedFieldsField, self).deconstruct()
+        for key, default in (('null', True), ('blank', True), ('editable', False)):
+            if key not in kwargs:
+                kwargs[key] = not default
+            elif kwargs[key] == default:
+                del kwargs[key]
+        return name, path, args, kwargs
+
+
+class FingerprintField(models.CharField):
+    '''
+    a hash of the content (fields and many-to-many membership) of a draft
+    when it was last published, kept on both the draft and it's public
+    version - so publishing a draft that hasn't really changed can be skipped.
+
+    to use it add one called publish_fingerprint to a Publishable model.
+    '''
+
+    def __init__(self, *arg, **kw):
+        kw.setdefault('max_length', 40)
+        kw.setdefault('null', True)
+        kw.setdefault('blank', True)
+        kw.setdefault('editable', False)
+        super(FingerprintField, self).__init__(*arg, **kw)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(FingerprintField, self).deconstruct()
+        for key, default in (('null', True), ('blank', True), ('editable', False)):
+            if key not in kwargs:
+                kwargs[key] = not default
+            elif kwargs[key] == default:
+                del kwargs[key]
+        if kwargs.get('max_length') == 40:
+            del kwargs['max_length']
+        return name, path, args, kwargs
+
+
+def _has_save_receivers(model):
+    # whether anything (other than our own cache invalidation, which bulk
+    # publishing does itself) listens for instances of model being saved
+    return any(receiver is not _invalidate_instance
+               for signal in (pre_save, post_save) for receiver in signal._live_receivers(model))
+
+
+def _has_pre_save(field):
+    # whether saving can change the field's value (which copying in the database would skip)
+    if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+        return True
+    if isinstance(field, (models.DateField, models.TimeField)):
+        return False
+    return _func(type(field).pre_save) is not _func(models.Field.pre_save)
+
+
+class CopyPlan(namedtuple('CopyPlan', ['fields', 'foreign_keys', 'many_to_many', 'reverse', 'deletion_reverse',
+                                       'track_changes', 'fingerprint', 'cache_lookups', 'copy_in_database'])):
+    '''
+    everything needed to copy a model to it's public version, worked
+    out once per model (from it's fields and PublishMeta), so we are
+    not repeatedly walking the class hierarchy while publishing.
+
+    fields - the fields to copy (in order)
+    foreign_keys - the fields that refer to Publishable models
+    many_to_many - many-to-many fields to copy
+    reverse - reverse relations to publish along with the model
+    deletion_reverse - reverse relations to follow when publishing deletions
+    track_changes - whether drafts record which fields have changed
+    fingerprint - whether drafts (and public versions) have a fingerprint
+    cache_lookups - the lookups get_published will cache the public versions for
+    copy_in_database - whether the fields can be copied by the database (without
+                       loading them), as none need publishing, publish functions
+                       or to be worked out when saved (e.g. auto_now)
+    '''
+
+    @classmethod
+    def compile(cls, model):
+        meta = model.PublishMeta
+        excluded_fields = set(meta.excluded_fields())
+        reverse_fields_to_publish = meta.reverse_fields_to_publish()
+
+        fields = []
+        for field in model._meta.fields:
+            if field.name in excluded_fields:
+                continue
+            publish_function = meta.find_publish_function(field.name, None)
+            publishable = isinstance(field, RelatedField) and issubclass(field.rel.to, Publishable)
+            fields.append(CopyField(field, publish_function, publishable))
+
+        many_to_many = []
+        for field in model._meta.many_to_many:
+            if field.name in excluded_fields:
+                continue
+            through_model = model._get_through_model(field)
+            if through_model and issubclass(through_model, Publishable):
+                # m2m via through table will be dealt with as a reverse relation
+                reverse_name = model._get_through_reverse_name(field, through_model)
+                if reverse_name:
+                    reverse_fields_to_publish.append(reverse_name)
+                continue
+            many_to_many.append(CopyManyToMany(field, issubclass(field.rel.to, Publishable)))
+
+        reverse, deletion_reverse = [], []
+        for related in model._get_all_related_objects():
+            name = related.get_accessor_name()
+            if not issubclass(related.related_model, Publishable) or name in excluded_fields:
+                continue
+            copy_reverse = CopyReverse(name, related, related.field.rel.multiple)
+            deletion_reverse.append(copy_reverse)
+            if name in reverse_fields_to_publish:
+                reverse.append(copy_reverse)
+
+        track_changes = any(isinstance(field, ChangedFieldsField) and field.name == Publishable.CHANGED_FIELDS
+                            for field in model._meta.fields)
+        fingerprint = any(isinstance(field, FingerprintField) and field.name == Publishable.FINGERPRINT
+                          for field in model._meta.fields)
+
+        cache_lookups = tuple('pk' if name == model._meta.pk.name else name for name in meta.cache_lookups())
+
+        copy_in_database = not model._meta.parents and isinstance(model._meta.pk, models.AutoField) and \
+            not any(f.publishable or f.publish_function is not None or _has_pre_save(f.field) for f in fields)
+
+        return cls(tuple(fields), tuple(f for f in fields if f.publishable), tuple(many_to_many),
+                   tuple(reverse), tuple(deletion_reverse), track_changes, fingerprint, cache_lookups,
+                   copy_in_database)
+
+    def fields_to_copy(self, changed_fields):
+        '''
+        the fields that need copying to a public version that already exists,
+        given the names of the fields that have changed (or None if unknown).
+
+        publishable foreign keys and fields with publish functions are always
+        copied, as their public values don't only depend on the draft
+        '''
+        if changed_fields is None or not self.track_changes:
+            return self.fields
+        return tuple(f for f in self.fields
+                     if f.field.name in changed_fields or f.publishable or f.publish_function is not None)
+
+
 class PublishableQuerySet(QuerySet):
     def changed(self):
         '''all draft objects that have not been published yet'''
@@ -46,15 +281,63 @@ class PublishableQuerySet(QuerySet):
         return self.filter(Publishable.Q_DRAFT | Publishable.Q_DELETED)
 
     def published(self):
-        '''all public/published objects'''
-        return self.filter(Publishable.Q_PUBLISHED)
+        '''
+        all public/published objects - read from PUBLISH_READ_DATABASE
+        when using the PublishedReadRouter
+        '''
+        clone = self.filter(Publishable.Q_PUBLISHED)
+        # copied, as clones share their hints
+        clone._hints = dict(clone._hints, **{PUBLISHED_HINT: True})
+        return clone
 
-    def publish(self, all_published=None):
-        '''publish all models in this queryset'''
-        if all_published is None:
-            all_published = NestedSet()
-        for p in self:
-            p.publish(all_published=all_published)
+    def publish(self, all_published=None, processes=None):
+        '''
+        publish all models in this queryset, writing the public
+        copies in bulk rather than one at a time.
+
+        if processes is given the independent parts are published in
+        parallel (see PublishPlan.execute_parallel) and a PublishReport
+        is returned
+        '''
+        from .plan import PublishPlan
+        plan = PublishPlan.build(self, all_published=all_published)
+        if processes is not None:
+            return plan.execute_parallel(processes=processes, check_state=False)
+        using = self._db or router.db_for_write(self.model)
+        plan.execute(check_state=False, using=using)
+
+    def publish_deletions(self, all_published=None):
+        '''
+        publish the deletion of all the drafts in this queryset that are marked for
+        deletion (along with any of their children that are also marked) in bulk
+        '''
+        return self.deleted().publish(all_published=all_published)
+
+    def unpublish(self):
+        '''
+        unpublish all the drafts in this queryset in bulk (much like
+        Publishable.unpublish), returning how many were unpublished
+        '''
+        model = self.model
+        using = self._db or router.db_for_write(model)
+        drafts = self.filter(is_public=False, public__isnull=False)
+        with transaction.atomic(using=using):
+            pairs = list(drafts.select_for_update().values_list('pk', 'public'))
+            if not pairs:
+                return 0
+            publics = model._base_manager.using(using).filter(pk__in=[public_pk for pk, public_pk in pairs])
+            with recording(u'Unpublish %d objects' % len(pairs), using=using):
+                record_rows(model, [pk for pk, public_pk in pairs], using=using)
+                record_deletion(publics, using=using)
+                updates = {'public': None, 'publish_state': Publishable.PUBLISH_CHANGED}
+                if model._get_copy_plan().track_changes:
+                    # there's no public copy to compare with anymore
+                    updates[Publishable.CHANGED_FIELDS] = None
+                model._base_manager.using(using).filter(pk__in=[pk for pk, public_pk in pairs]).update(**updates)
+                # (a regular delete, so cascades and signals still happen)
+                publics.delete()
+            PublishGeneration.bump([model], using=using)
+        return len(pairs)
 
     def delete(self, mark_for_deletion=True):
         '''
@@ -91,6 +374,14 @@ class PublishableManager(models.Manager):
         '''all public/published objects'''
         return self.get_query_set().published()
 
+    def get_published(self, **lookup):
+        '''
+        get a published object, using the cache for
+        lookups listed in PublishMeta.publish_cache_lookups
+        '''
+        from .cache import get_published
+        return get_published(self.get_query_set(), **lookup)
+
 
 class PublishableBase(ModelBase):
     def __new__(cls, name, bases, attrs):
@@ -103,6 +394,13 @@ class PublishableBase(ModelBase):
         opts.permissions = tuple(opts.permissions) + ((code, name),)
         opts.get_publish_permission = lambda: code
 
+        publish_meta = getattr(new_class, 'PublishMeta', None)
+        if not opts.abstract and publish_meta is not None:
+            if publish_meta.cache_lookups():
+                connect_cache_signals(new_class)
+            names = set(index.name for index in opts.indexes)
+            opts.indexes.extend(index for index in get_publish_indexes(new_class) if index.name not in names)
+
         return new_class
 
 
@@ -115,6 +413,10 @@ class Publishable(models.Model):
 
     PUBLISH_CHOICES = ((PUBLISH_DEFAULT, 'Published'), (PUBLISH_CHANGED, 'Changed'), (PUBLISH_DELETE, 'To be deleted'))
 
+    # names of the (optional) ChangedFieldsField and FingerprintField
+    CHANGED_FIELDS = 'publish_changed_fields'
+    FINGERPRINT = 'publish_fingerprint'
+
     # make these available here so can easily re-use them in other code
     Q_PUBLISHED = Q(is_public=True)
     Q_DRAFT = Q(is_public=False) & ~Q(publish_state=PUBLISH_DELETE)
@@ -131,9 +433,14 @@ class Publishable(models.Model):
         abstract = True
 
     class PublishMeta(object):
-        publish_exclude_fields = ['id', 'is_public', 'publish_state', 'public', 'draft']
+        publish_exclude_fields = ['id', 'is_public', 'publish_state', 'public', 'draft', 'publish_changed_fields',
+                                  'publish_fingerprint']
         publish_reverse_fields = []
         publish_functions = {}
+        publish_cache_lookups = []
+        publish_indexes = False
+        publish_public_index_fields = []
+        publish_public_unique_fields = []
 
         @classmethod
         def _combined_fields(cls, field_name):
@@ -150,6 +457,18 @@ class Publishable(models.Model):
         def reverse_fields_to_publish(cls):
             return cls._combined_fields('publish_reverse_fields')
 
+        @classmethod
+        def cache_lookups(cls):
+            return cls._combined_fields('publish_cache_lookups')
+
+        @classmethod
+        def public_index_fields(cls):
+            return cls._combined_fields('publish_public_index_fields')
+
+        @classmethod
+        def public_unique_fields(cls):
+            return cls._combined_fields('publish_public_unique_fields')
+
         @classmethod
         def find_publish_function(cls, field_name, default_function):
             '''
@@ -175,13 +494,109 @@ class Publishable(models.Model):
                 return get_absolute_url()
         return None
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Publishable, cls).from_db(db, field_names, values)
+        if cls._get_copy_plan().track_changes:
+            instance._remember_loaded_values()
+        return instance
+
+    def _remember_loaded_values(self):
+        self._loaded_values = dict((field.attname, getattr(self, field.attname))
+                                   for field in self._meta.concrete_fields
+                                   if field.attname in self.__dict__)
+
+    def _get_changed_fields(self):
+        '''
+        names of the fields recorded as changed since this draft was last
+        published, or None if that isn't known
+        '''
+        if not self._get_copy_plan().track_changes:
+            return None
+        changed_fields = getattr(self, Publishable.CHANGED_FIELDS)
+        if changed_fields is None:
+            return None
+        return set(changed_fields.split())
+
+    def _record_changed_fields(self, update_fields=None):
+        loaded_values = getattr(self, '_loaded_values', None)
+        changed_fields = self._get_changed_fields()
+        if self._state.adding or loaded_values is None or changed_fields is None:
+            # no way of telling what has changed
+            setattr(self, Publishable.CHANGED_FIELDS, None)
+            return
+
+        for copy_field in self._get_copy_plan().fields:
+            field = copy_field.field
+            if update_fields is not None and field.name not in update_fields:
+                continue
+            attname = field.attname
+            if attname not in self.__dict__:
+                # deferred and never set, so can't have changed
+                continue
+            if attname not in loaded_values or getattr(self, attname) != loaded_values[attname]:
+                changed_fields.add(field.name)
+        setattr(self, Publishable.CHANGED_FIELDS, u' '.join(sorted(changed_fields)))
+
+    def _get_fingerprint(self, many_to_many):
+        '''
+        hash the values of the fields that get published, along with
+        many_to_many (a dict of field name -> target primary keys)
+        '''
+        fingerprint = hashlib.sha1()
+        for copy_field in self._get_copy_plan().fields:
+            field = copy_field.field
+            value = getattr(self, field.attname)
+            value = u'\x00' if value is None else force_unicode(value)
+            fingerprint.update((u'%s:%d:%s\n' % (field.name, len(value), value)).encode('utf-8'))
+        for name in sorted(many_to_many):
+            targets = u','.join(sorted(force_unicode(pk) for pk in many_to_many[name]))
+            fingerprint.update((u'%s:%s\n' % (name, targets)).encode('utf-8'))
+        return fingerprint.hexdigest()
+
+    def _get_many_to_many_pks(self):
+        from .bulk import through_pairs
+        return dict((copy_m2m.field.name, [target for pk, target in through_pairs(copy_m2m.field, [self.pk],
+                                                                                   using=self._state.db)])
+                    for copy_m2m in self._get_copy_plan().many_to_many)
+
+    def _is_unchanged(self, fingerprint):
+        '''
+        is this draft exactly as it was when it was last published?
+        '''
+        return self.public_id is not None and fingerprint is not None and \
+            fingerprint == getattr(self, Publishable.FINGERPRINT)
+
+    def _reload_changed_fields(self, using):
+        # what is recorded in the database now (another copy of this draft may
+        # have been saved since it was loaded), locked until the end of the transaction
+        stored = list(self.__class__._base_manager.using(using).select_for_update().filter(pk=self.pk)
+                      .values_list(Publishable.CHANGED_FIELDS, flat=True))
+        if stored:
+            setattr(self, Publishable.CHANGED_FIELDS, stored[0])
+
     def save(self, mark_changed=True, *arg, **kw):
+        track_changes = self._get_copy_plan().track_changes
         if not self.is_public and mark_changed:
             if self.publish_state == Publishable.PUBLISH_DELETE:
                 raise PublishException("Attempting to save model marked for deletion")
             self.publish_state = Publishable.PUBLISH_CHANGED
+            if track_changes:
+                using = kw.get('using') or router.db_for_write(self.__class__, instance=self)
+                with transaction.atomic(using=using):
+                    if not self._state.adding and self.pk is not None:
+                        self._reload_changed_fields(using)
+                    update_fields = kw.get('update_fields')
+                    self._record_changed_fields(update_fields)
+                    if update_fields is not None:
+                        kw['update_fields'] = list(update_fields) + ['publish_state', Publishable.CHANGED_FIELDS]
+                    super(Publishable, self).save(*arg, **kw)
+                self._remember_loaded_values()
+                return
 
         super(Publishable, self).save(*arg, **kw)
+        if track_changes:
+            self._remember_loaded_values()
 
     def delete(self, mark_for_deletion=True):
         if self.public and mark_for_deletion:
@@ -205,7 +620,10 @@ class Publishable(models.Model):
             # got published (in case it was indirectly published elsewhere)
             sender = self.__class__
             instance = all_published.original(self)
-            post_publish.send(sender=sender, instance=instance, deleted=deleted)
+            # deleted instances have already lost their pk
+            key = (sender, instance.pk) if instance.pk is not None else None
+            send_post_publish(post_publish, sender=sender, using=instance._state.db,
+                              key=key, instance=instance, deleted=deleted)
 
     def publish(self, dry_run=False, all_published=None, parent=None):
         '''
@@ -215,16 +633,37 @@ class Publishable(models.Model):
         public models will be examined to see if they need deleting
         and deleted if so.
         '''
-        if self.is_public:
-            raise PublishException("Cannot publish public model - publish should be called from draft model")
-        if self.pk is None:
-            raise PublishException("Please save model before publishing")
+        self._check_can_publish()
 
-        if self.publish_state == Publishable.PUBLISH_DELETE:
-            self.publish_deletions(dry_run=dry_run, all_published=all_published, parent=parent)
-            return None
-        else:
-            return self.publish_changes(dry_run=dry_run, all_published=all_published, parent=parent)
+        with self._recording(all_published):
+            if all_published is None and not dry_run and \
+                    (pre_publish_batch.has_listeners() or post_publish_batch.has_listeners()):
+                return self._publish_with_batch_signals(parent)
+
+            if self.publish_state == Publishable.PUBLISH_DELETE:
+                self.publish_deletions(dry_run=dry_run, all_published=all_published, parent=parent)
+                return None
+            else:
+                return self.publish_changes(dry_run=dry_run, all_published=all_published, parent=parent)
+
+    def _recording(self, all_published, verb=u'Publish'):
+        # only the top level publish starts a new operation (see history.py)
+        if all_published is None:
+            return recording(lambda: u'%s %s' % (verb, force_unicode(self)), using=self._state.db)
+        return recording()
+
+    def _publish_with_batch_signals(self, parent=None):
+        if pre_publish_batch.has_listeners():
+            # need to know what will be published up front
+            planned = NestedSet()
+            self.publish(dry_run=True, all_published=planned, parent=parent)
+            send_publish_batch(pre_publish_batch, *_split_published(planned), using=self._state.db)
+
+        all_published = NestedSet()
+        public_version = self.publish(all_published=all_published, parent=parent)
+        _bump_generations(_published_changes(all_published), using=self._state.db)
+        send_publish_batch(post_publish_batch, *_split_published(all_published), using=self._state.db)
+        return public_version
 
     def unpublish(self, dry_run=False):
         '''
@@ -240,11 +679,34 @@ class Publishable(models.Model):
         public_model = self.public
 
         if public_model and not dry_run:
-            self.public = None
-            self.save()
-            public_model.delete(mark_for_deletion=False)
+            with self._recording(None, verb=u'Unpublish'):
+                record_rows(self.__class__, [self.pk], using=self._state.db)
+                record_deletion([public_model], using=self._state.db)
+                self.public = None
+                self.save()
+                public_model.delete(mark_for_deletion=False)
+            _bump_generations([self], using=self._state.db)
         return public_model
 
+    def publish_at(self, when):
+        '''
+        publish this draft at when (a datetime), using the run_publish_scheduler
+        management command.  replaces any publish already scheduled for it
+        '''
+        PublishSchedule.schedule(self, PublishSchedule.PUBLISH, when)
+
+    def unpublish_at(self, when):
+        '''
+        unpublish this draft at when (a datetime), like publish_at
+        '''
+        PublishSchedule.schedule(self, PublishSchedule.UNPUBLISH, when)
+
+    def cancel_scheduled(self, action=None):
+        '''
+        cancel any scheduled publish or unpublish (or both, if action is None)
+        '''
+        PublishSchedule.cancel(self, action)
+
     def _get_public_or_publish(self, *arg, **kw):
         # only publish if we don't yet have an id for the
         # public model
@@ -252,7 +714,57 @@ class Publishable(models.Model):
             return self.public
         return self.publish(*arg, **kw)
 
-    def _get_through_model(self, field_object):
+    def _check_can_publish(self):
+        if self.is_public:
+            raise PublishException("Cannot publish public model - publish should be called from draft model")
+        if self.pk is None:
+            raise PublishException("Please save model before publishing")
+
+    def _publish_steps(self, name, **kwargs):
+        '''
+        the steps (for run_steps) of calling publish or publish_deletions on
+        this model from within the steps of another.  if the model overrides
+        any of the publish methods they are just called instead
+        '''
+        if self._overrides_publish():
+            return _called(getattr(self, name), kwargs)
+        if name == 'publish_deletions':
+            return self._publish_deletions_steps(**kwargs)
+        self._check_can_publish()
+        if self.publish_state == Publishable.PUBLISH_DELETE:
+            return self._publish_deletions_steps(**kwargs)
+        return self._publish_changes_steps(**kwargs)
+
+    @classmethod
+    def _overrides_publish(cls):
+        # whether the model customises publishing
+        return any(_func(getattr(cls, method)) is not _func(getattr(Publishable, method))
+                   for method in ('publish', 'publish_changes', 'publish_deletions'))
+
+    @classmethod
+    def _publishes_per_instance(cls):
+        # whether the model can't be published in bulk - as it customises publishing,
+        # overrides save or something listens for it being saved (bulk publishing
+        # writes the rows without calling save or sending pre_save and post_save)
+        return cls._overrides_publish() or _func(cls.save) is not _func(Publishable.save) or \
+            _has_save_receivers(cls)
+
+    def _get_public_or_publish_steps(self, **kwargs):
+        if self.public:
+            public = self.public
+        else:
+            public = yield self._publish_steps('publish', **kwargs)
+        yield Return(public)
+
+    @classmethod
+    def _get_copy_plan(cls):
+        copy_plan = _copy_plans.get(cls)
+        if copy_plan is None:
+            copy_plan = _copy_plans[cls] = CopyPlan.compile(cls)
+        return copy_plan
+
+    @classmethod
+    def _get_through_model(cls, field_object):
         '''
         Get the "through" model associated with this field.
         Need to handle things differently for Django1.1 vs Django1.2
@@ -266,13 +778,46 @@ class Publishable(models.Model):
             return through
         return None
 
+    @classmethod
+    def _get_through_reverse_name(cls, field_object, through_model):
+        '''
+        Get the name of the reverse relation from this model to
+        a (publishable) "through" model, so it can be published
+        as a regular reverse relation
+        '''
+        # this will be db name (e.g. with _id on end)
+        m2m_reverse_name = field_object.m2m_reverse_name()
+        for reverse_field in through_model._meta.fields:
+            if reverse_field.column == m2m_reverse_name:
+                related_field = getattr(through_model, reverse_field.name).field
+                return related_field.rel.get_accessor_name()
+        return None
+
+    def _sync_many_to_many(self, name, public_objs):
+        '''
+        make the many-to-many field called name (on this public model)
+        contain exactly public_objs (instances or primary keys)
+        '''
+        from .bulk import sync_many_to_many
+        public_pks = [getattr(p, 'pk', p) for p in public_objs]
+        sync_many_to_many(self._meta.get_field(name), {self.pk: public_pks}, using=self._state.db)
+
+    def _get_reverse_items(self, copy_reverse):
+        if copy_reverse.multiple:
+            return list(getattr(self, copy_reverse.name).all())
+        try:
+            return [getattr(self, copy_reverse.name)]
+        except ObjectDoesNotExist:
+            return []
+
     def _changes_need_publishing(self):
-        return self.publish_state == Publishable.PUBLISH_CHANGED or not self.public
+        return self.publish_state == Publishable.PUBLISH_CHANGED or self.public_id is None
 
-    def _get_all_related_objects(self):
+    @classmethod
+    def _get_all_related_objects(cls):
         # The following mimics the deprecated Options.get_all_related_objects
         return [
-            f for f in self._meta.get_fields()
+            f for f in cls._meta.get_fields()
             if (f.one_to_many or f.one_to_one)
                and f.auto_created and not f.concrete
         ]
@@ -285,158 +830,781 @@ class Publishable(models.Model):
         the all_published value one can therefore get information about what other models
         would be affected by this function
         '''
+        with self._recording(all_published):
+            return run_steps(self._publish_changes_steps(dry_run=dry_run, all_published=all_published,
+                                                         parent=parent))
 
+    def _publish_changes_steps(self, dry_run=False, all_published=None, parent=None):
+        # publish_changes as steps for run_steps, which yield the steps of the related
+        # models to publish rather than calling them (so we can go as deep as we like)
         assert not self.is_public, "Cannot publish public model - publish should be called from draft model"
         assert self.pk is not None, "Please save model before publishing"
 
         # avoid mutual recursion
-        if all_published is None:
+        top_level = all_published is None
+        if top_level:
             all_published = NestedSet()
 
         if self in all_published:
-            return all_published.original(self).public
+            yield Return(all_published.original(self).public)
+            return
 
         all_published.add(self, parent=parent)
+        if not dry_run:
+            record_rows(self.__class__, [self.pk, self.public_id], using=self._state.db)
+
+        copy_plan = self._get_copy_plan()
+        changes_need_publishing = self._changes_need_publishing()
 
-        self._pre_publish(dry_run, all_published)
+        fingerprint = None
+        if changes_need_publishing and copy_plan.fingerprint:
+            fingerprint = self._get_fingerprint(self._get_many_to_many_pks())
+        # saved, but not actually changed since it was last published
+        unchanged = self._is_unchanged(fingerprint)
+        self._publish_unchanged = unchanged
+
+        if not unchanged:
+            self._pre_publish(dry_run, all_published)
 
         public_version = self.public
         if not public_version:
             public_version = self.__class__(is_public=True)
 
-        excluded_fields = self.PublishMeta.excluded_fields()
-        reverse_fields_to_publish = self.PublishMeta.reverse_fields_to_publish()
+        if unchanged:
+            if not dry_run:
+                self.publish_state = Publishable.PUBLISH_DEFAULT
+                if copy_plan.track_changes:
+                    setattr(self, Publishable.CHANGED_FIELDS, u'')
+                self.save(mark_changed=False)
+        elif changes_need_publishing:
+            had_public = public_version.pk is not None
+            if had_public:
+                fields_to_copy = copy_plan.fields_to_copy(self._get_changed_fields())
+            else:
+                fields_to_copy = copy_plan.fields
 
-        if self._changes_need_publishing():
             # copy over regular fields
-            for field in self._meta.fields:
-                if field.name in excluded_fields:
-                    continue
-
-                value = getattr(self, field.name)
-                if isinstance(field, RelatedField):
-                    related = field.rel.to
-                    if issubclass(related, Publishable):
-                        if value is not None:
-                            value = value._get_public_or_publish(dry_run=dry_run, all_published=all_published,
-                                                                 parent=self)
+            deferred = []
+            for copy_field in fields_to_copy:
+                name = copy_field.field.name
+                value = getattr(self, name)
+                if copy_field.publishable and value is not None:
+                    target = all_published.original(value)
+                    value = yield value._get_public_or_publish_steps(dry_run=dry_run, all_published=all_published,
+                                                                     parent=self)
+                    if value is None and not dry_run and target.publish_state != Publishable.PUBLISH_DELETE:
+                        # target is still being published (we are in a cycle of
+                        # foreign keys) so fill this in once it has been
+                        if not copy_field.field.null:
+                            raise PublishException("%s can't be published, as it is in a cycle of foreign keys "
+                                                   "that can't be null" % force_unicode(self))
+                        setattr(public_version, copy_field.field.attname, None)
+                        deferred.append((target, copy_field))
+                        continue
 
                 if not dry_run:
-                    publish_function = self.PublishMeta.find_publish_function(field.name, setattr)
-                    publish_function(public_version, field.name, value)
+                    publish_function = copy_field.publish_function or setattr
+                    publish_function(public_version, name, value)
 
             # save the public version and update
             # state so we know everything is up-to-date
             if not dry_run:
-                public_version.save()
+                update_fields = [copy_field.field.name for copy_field in fields_to_copy]
+                if fingerprint is not None:
+                    setattr(public_version, Publishable.FINGERPRINT, fingerprint)
+                    setattr(self, Publishable.FINGERPRINT, fingerprint)
+                    update_fields.append(Publishable.FINGERPRINT)
+                if had_public and fields_to_copy is not copy_plan.fields:
+                    public_version.save(update_fields=update_fields)
+                else:
+                    public_version.save()
+                    if not had_public:
+                        record_created(self.__class__, [public_version.pk], using=self._state.db)
                 self.public = public_version
                 self.publish_state = Publishable.PUBLISH_DEFAULT
+                if copy_plan.track_changes:
+                    setattr(self, Publishable.CHANGED_FIELDS, u'')
                 self.save(mark_changed=False)
 
+                for target, copy_field in deferred:
+                    target._publish_referrers = getattr(target, '_publish_referrers', []) + \
+                        [(public_version, copy_field)]
+                # fill in the foreign keys that were waiting for us
+                for referrer, copy_field in getattr(self, '_publish_referrers', []):
+                    (copy_field.publish_function or setattr)(referrer, copy_field.field.name, public_version)
+                    referrer.save(update_fields=[copy_field.field.name])
+                self._publish_referrers = []
+
         # copy over many-to-many fields
-        for field in self._meta.many_to_many:
-            name = field.name
-            if name in excluded_fields:
-                continue
+        for copy_m2m in copy_plan.many_to_many:
+            name = copy_m2m.field.name
+            public_objs = list(getattr(self, name).all())
 
-            m2m_manager = getattr(self, name)
-            public_objs = list(m2m_manager.all())
-
-            field_object = self._meta.get_field(name)
-            through_model = self._get_through_model(field_object)
-            if through_model:
-                # see if we can work out which reverse relationship this is
-                # see if we are using our own "through" table or not
-                if issubclass(through_model, Publishable):
-                    # this will be db name (e.g. with _id on end)
-                    m2m_reverse_name = field_object.m2m_reverse_name()
-                    for reverse_field in through_model._meta.fields:
-                        if reverse_field.column == m2m_reverse_name:
-                            related_name = reverse_field.name
-                            related_field = getattr(through_model, related_name).field
-                            reverse_name = related_field.rel.get_accessor_name()
-                            reverse_fields_to_publish.append(reverse_name)
-                            break
-                    continue  # m2m via through table won't be dealt with here
-
-            related = field_object.rel.to
-            if issubclass(related, Publishable):
-                public_objs = [p._get_public_or_publish(dry_run=dry_run, all_published=all_published, parent=self) for p
-                               in public_objs]
+            if copy_m2m.publishable:
+                draft_objs, public_objs = public_objs, []
+                for p in draft_objs:
+                    p = yield p._get_public_or_publish_steps(dry_run=dry_run, all_published=all_published, parent=self)
+                    public_objs.append(p)
 
             if not dry_run:
-                public_m2m_manager = getattr(public_version, name)
-
-                old_objs = public_m2m_manager.exclude(pk__in=[p.pk for p in public_objs])
-                public_m2m_manager.remove(*old_objs)
-                public_m2m_manager.add(*public_objs)
+                public_version._sync_many_to_many(name, public_objs)
 
-        related_objects = self._get_all_related_objects()
         # one-to-many and one-to-one reverse relations
-        for obj in related_objects:
-            if issubclass(obj.model, Publishable):
-                name = obj.get_accessor_name()
-                if name in excluded_fields:
-                    continue
-                if name not in reverse_fields_to_publish:
-                    continue
-                if obj.field.rel.multiple:
-                    related_items = getattr(self, name).all()
-                else:
-                    try:
-                        related_items = [getattr(self, name)]
-                    except (obj.model.DoesNotExist, ObjectDoesNotExist):
-                        related_items = []
+        # (including m2m via "through" tables)
+        for copy_reverse in copy_plan.reverse:
+            related_items = self._get_reverse_items(copy_reverse)
 
-                for related_item in related_items:
-                    related_item.publish(dry_run=dry_run, all_published=all_published, parent=self)
+            for related_item in related_items:
+                yield related_item._publish_steps('publish', dry_run=dry_run, all_published=all_published,
+                                                  parent=self)
 
-                # make sure we tidy up anything that needs deleting
-                if self.public and not dry_run:
-                    if obj.field.rel.multiple:
-                        public_ids = [r.public_id for r in related_items]
-                        deleted_items = getattr(self.public, name).exclude(pk__in=public_ids)
-                        deleted_items.delete(mark_for_deletion=False)
+            # make sure we tidy up anything that needs deleting
+            if self.public and not dry_run and copy_reverse.multiple:
+                public_ids = [r.public_id for r in related_items]
+                deleted_items = getattr(self.public, copy_reverse.name).exclude(pk__in=public_ids)
+                record_deletion(deleted_items, using=self._state.db)
+                deleted_items.delete(mark_for_deletion=False)
 
-        self._post_publish(dry_run, all_published)
+        if not unchanged:
+            self._post_publish(dry_run, all_published)
 
-        return public_version
+        if top_level and not dry_run:
+            _bump_generations(_published_changes(all_published), using=self._state.db)
+
+        yield Return(public_version)
 
     def publish_deletions(self, all_published=None, parent=None, dry_run=False):
         '''
         actually delete models that have been marked for deletion
         '''
+        with self._recording(all_published):
+            run_steps(self._publish_deletions_steps(all_published=all_published, parent=parent, dry_run=dry_run))
+
+    def _publish_deletions_steps(self, all_published=None, parent=None, dry_run=False):
+        # publish_deletions as steps for run_steps
         if self.publish_state != Publishable.PUBLISH_DELETE:
             return
 
-        if all_published is None:
+        top_level = all_published is None
+        if top_level:
             all_published = NestedSet()
 
         if self in all_published:
             return
 
         all_published.add(self, parent=parent)
+        self._publish_unchanged = False
 
         self._pre_publish(dry_run, all_published, deleted=True)
 
-        related_objects = self._get_all_related_objects()
-        for related in related_objects:
-            if not issubclass(related.model, Publishable):
-                continue
-            name = related.get_accessor_name()
-            if name in self.PublishMeta.excluded_fields():
-                continue
-            try:
-                instances = getattr(self, name).all()
-            except AttributeError:
-                instances = [getattr(self, name)]
-            for instance in instances:
-                instance.publish_deletions(all_published=all_published, parent=self, dry_run=dry_run)
+        for copy_reverse in self._get_copy_plan().deletion_reverse:
+            for instance in self._get_reverse_items(copy_reverse):
+                yield instance._publish_steps('publish_deletions', all_published=all_published, parent=self,
+                                              dry_run=dry_run)
 
         if not dry_run:
             public = self.public
+            record_deletion([self] + ([public] if public else []), using=self._state.db)
             self.delete(mark_for_deletion=False)
             if public:
                 public.delete(mark_for_deletion=False)
 
         self._post_publish(dry_run, all_published, deleted=True)
+
+        if top_level and not dry_run:
+            _bump_generations(_published_changes(all_published), using=self._state.db)
+
+
+class _JobHeartbeat(threading.Thread):
+    # keeps a running job's heartbeat up to date while it is being published
+
+    def __init__(self, job, interval):
+        super(_JobHeartbeat, self).__init__(name='publish job %s heartbeat' % job.pk)
+        self.daemon = True
+        self.job, self.interval = job, interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    if not self.job.beat():
+                        # another worker has taken it over
+                        return
+                except DatabaseError:
+                    # (e.g. SQLite being locked by the publish) try again next time
+                    pass
+        finally:
+            # this thread's own connection
+            connections.close_all()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class PublishJob(models.Model):
+    '''
+    a (signed and serialized) PublishPlan waiting to be executed in the
+    background by the publish_worker management command.
+    '''
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATE_CHOICES = ((PENDING, 'Waiting'), (RUNNING, 'Publishing'), (DONE, 'Published'), (FAILED, 'Failed'))
+
+    plan = models.TextField(editable=False)
+    description = models.CharField(max_length=255, blank=True, editable=False)
+    object_count = models.PositiveIntegerField(default=0, editable=False)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=PENDING, editable=False, db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, editable=False,
+                             on_delete=models.SET_NULL)
+    worker = models.CharField(max_length=255, blank=True, editable=False)
+    # how many times it has been claimed (see expire)
+    attempts = models.PositiveIntegerField(default=0, editable=False)
+    error = models.TextField(blank=True, editable=False)
+    created = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+    started = models.DateTimeField(null=True, blank=True, editable=False)
+    # last time the worker running the job said it was still going (see beat)
+    heartbeat = models.DateTimeField(null=True, blank=True, editable=False)
+    finished = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-created', '-id']
+
+    def __unicode__(self):
+        return self.description or u'Publish job %s' % self.pk
+
+    def _owned(self):
+        # the job, as long as it is still being run by our worker
+        return PublishJob._default_manager.db_manager(router.db_for_write(PublishJob)).filter(
+            pk=self.pk, state=PublishJob.RUNNING, worker=self.worker)
+
+    @classmethod
+    def enqueue(cls, plan, user=None, description=''):
+        '''
+        queue up plan (a PublishPlan) to be published in the background
+        '''
+        return cls._default_manager.create(plan=plan.dumps(), object_count=len(plan), user=user,
+                                           description=description[:255])
+
+    def beat(self, now=None):
+        '''
+        record that the job is still being run (by it's worker), so it isn't
+        expired.  returns False if the job has been taken over since
+        '''
+        self.heartbeat = now or timezone.now()
+        return bool(self._owned().update(heartbeat=self.heartbeat))
+
+    @classmethod
+    def expire(cls, timeout=None, now=None):
+        '''
+        put running jobs that haven't had a heartbeat for timeout seconds (the
+        PUBLISH_JOB_TIMEOUT setting, 5 minutes by default) - presumably because
+        their worker died - back in the queue.  jobs that have already been
+        claimed PUBLISH_JOB_ATTEMPTS (3) times are failed instead.  returns
+        how many jobs were expired
+        '''
+        if timeout is None:
+            timeout = getattr(settings, 'PUBLISH_JOB_TIMEOUT', 300)
+        attempts = getattr(settings, 'PUBLISH_JOB_ATTEMPTS', 3)
+        now = now or timezone.now()
+        expired = cls._default_manager.db_manager(router.db_for_write(cls)).filter(
+            state=cls.RUNNING, heartbeat__lt=now - timedelta(seconds=timeout))
+        failed = expired.filter(attempts__gte=attempts).update(
+            state=cls.FAILED, finished=now, error='Timed out after %d attempts' % attempts)
+        requeued = expired.filter(attempts__lt=attempts).update(state=cls.PENDING, started=None, worker='')
+        return failed + requeued
+
+    @classmethod
+    def claim(cls, worker='', timeout=None):
+        '''
+        claim the oldest waiting job for worker, returning None if there
+        are no jobs waiting.  several workers can claim jobs at once and
+        each job will only ever be claimed by one of them.
+
+        jobs that haven't had a heartbeat for timeout seconds are put
+        back in the queue first (see expire)
+        '''
+        using = router.db_for_write(cls)
+        manager = cls._default_manager.db_manager(using)
+        cls.expire(timeout)
+        while True:
+            with transaction.atomic(using=using):
+                waiting = manager.filter(state=cls.PENDING).order_by('created', 'id')
+                if connections[using].features.has_select_for_update_skip_locked:
+                    # don't wait for jobs other workers are claiming
+                    waiting = waiting.select_for_update(skip_locked=True)
+                job = waiting.first()
+                if job is None:
+                    return None
+                started = timezone.now()
+                # only one worker can move the job out of PENDING,
+                # even if the database doesn't lock rows
+                claimed = manager.filter(pk=job.pk, state=cls.PENDING).update(
+                    state=cls.RUNNING, started=started, heartbeat=started, worker=worker,
+                    attempts=F('attempts') + 1)
+            if claimed:
+                job.state, job.started, job.heartbeat, job.worker = cls.RUNNING, started, started, worker
+                job.attempts += 1
+                return job
+
+    def run(self, heartbeat=None):
+        '''
+        execute the job's plan, recording whether it worked or not.  the job's
+        heartbeat is kept up every heartbeat seconds (the PUBLISH_JOB_HEARTBEAT
+        setting, 30 by default) while it runs
+        '''
+        from .plan import PublishPlan
+        if heartbeat is None:
+            heartbeat = getattr(settings, 'PUBLISH_JOB_HEARTBEAT', 30)
+        beating = _JobHeartbeat(self, heartbeat)
+        beating.start()
+        try:
+            plan = PublishPlan.loads(self.plan)
+            with recording(self.description or u'Publish job %s' % self.pk, user=self.user):
+                plan.execute()
+        except Exception:
+            beating.stop()
+            self._finish(PublishJob.FAILED, error=traceback.format_exc())
+            return False
+        beating.stop()
+        self._log_publication(plan)
+        self._finish(PublishJob.DONE)
+        return True
+
+    def _finish(self, state, error=''):
+        # a failure is only recorded if our worker still has the job (otherwise it
+        # was expired and it's up to whoever has it now), but it having been
+        # published always is - anyone else running it will find their plan stale
+        self.state, self.error, self.finished = state, error, timezone.now()
+        if state == PublishJob.DONE:
+            jobs = PublishJob._default_manager.db_manager(router.db_for_write(PublishJob)).filter(pk=self.pk)
+        else:
+            jobs = self._owned()
+        return bool(jobs.update(state=self.state, error=self.error, finished=self.finished))
+
+    def _log_publication(self, plan):
+        # log each object as published by whoever queued the job, much
+        # like the admin action does when publishing straight away
+        from django.apps import apps
+        if self.user_id is None or not apps.is_installed('django.contrib.admin'):
+            return
+        from django.contrib.admin.models import LogEntry, CHANGE
+        from django.contrib.contenttypes.models import ContentType
+        for instance in plan.all_published:
+            if isinstance(instance, Publishable):
+                LogEntry.objects.log_action(self.user_id, ContentType.objects.get_for_model(instance).pk,
+                                            instance.pk, force_unicode(instance), CHANGE, 'Published')
+
+    def queue_position(self):
+        '''
+        how many jobs will be run before this one (None once it has started)
+        '''
+        if self.state != PublishJob.PENDING:
+            return None
+        return PublishJob._default_manager.filter(
+            Q(created__lt=self.created) | Q(created=self.created, id__lt=self.id), state=PublishJob.PENDING).count()
+
+    def duration(self):
+        if self.started is None:
+            return None
+        return (self.finished or timezone.now()) - self.started
+
+
+class Release(models.Model):
+    '''
+    drafts (of any Publishable models) gathered up to be published all at
+    once - in a single transaction - when the release is published
+    '''
+
+    OPEN = 'open'
+    PUBLISHED = 'published'
+
+    STATE_CHOICES = ((OPEN, 'Open'), (PUBLISHED, 'Published'))
+
+    name = models.CharField(max_length=255)
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default=OPEN, editable=False, db_index=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, editable=False,
+                             on_delete=models.SET_NULL)
+    # the (signed and serialized) PublishPlan worked out by prepare()
+    plan = models.TextField(blank=True, editable=False)
+    created = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+    published = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-created', '-id']
+
+    def __unicode__(self):
+        return self.name
+
+    def _check_open(self):
+        if self.state != Release.OPEN:
+            raise PublishException("%s has already been published" % force_unicode(self))
+
+    def _forget_plan(self):
+        # the drafts in the release have changed
+        if self.plan:
+            self.plan = ''
+            self.save(update_fields=['plan'])
+
+    def add(self, *drafts):
+        '''
+        add drafts to the release
+        '''
+        from django.contrib.contenttypes.models import ContentType
+        self._check_open()
+        for draft in drafts:
+            if draft.is_public:
+                raise PublishException("Cannot add public model to a release - add the draft model instead")
+            if draft.pk is None:
+                raise PublishException("Please save model before adding it to a release")
+            ReleaseItem._default_manager.get_or_create(release=self,
+                                                       content_type=ContentType.objects.get_for_model(draft),
+                                                       object_id=force_unicode(draft.pk))
+        self._forget_plan()
+
+    def remove(self, *drafts):
+        '''
+        take drafts out of the release
+        '''
+        from django.contrib.contenttypes.models import ContentType
+        self._check_open()
+        for draft in drafts:
+            self.items.filter(content_type=ContentType.objects.get_for_model(draft),
+                              object_id=force_unicode(draft.pk)).delete()
+        self._forget_plan()
+
+    def drafts(self):
+        '''
+        the drafts in the release (that still exist), in the order they were added
+        '''
+        from django.contrib.contenttypes.models import ContentType
+        items = list(self.items.order_by('id').values_list('content_type', 'object_id'))
+        by_model = {}
+        for content_type_id, object_id in items:
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model is not None:
+                by_model.setdefault(model, []).append(model._meta.pk.to_python(object_id))
+
+        drafts = {}
+        for model, pks in by_model.items():
+            for draft in model._base_manager.filter(pk__in=pks, is_public=False):
+                drafts[(ContentType.objects.get_for_model(model).pk, force_unicode(draft.pk))] = draft
+        return [drafts[item] for item in items if item in drafts]
+
+    def build_plan(self):
+        '''
+        work out what publishing the release would do (a PublishPlan of all
+        of it's drafts merged together), e.g. to preview it
+        '''
+        from .plan import PublishPlan
+        return PublishPlan.build(self.drafts())
+
+    def prepare(self):
+        '''
+        work out (and keep) the release's plan ahead of time, so there is less
+        to do when it is published
+        '''
+        self._check_open()
+        plan = self.build_plan()
+        self.plan = plan.dumps()
+        self.save(update_fields=['plan'])
+        return plan
+
+    def publish(self, plan=None):
+        '''
+        publish everything in the release in one transaction - using plan (e.g.
+        one built to preview the release) or the plan from prepare(), unless any
+        of the drafts have changed since then.  returns the plan that was executed
+        '''
+        from django.core.signing import BadSignature
+        from .plan import PublishPlan, StalePlanException
+        using = router.db_for_write(Release, instance=self)
+        with transaction.atomic(using=using):
+            # (only one of us gets to publish it)
+            release = Release._default_manager.using(using).select_for_update().get(pk=self.pk)
+            release._check_open()
+            if plan is not None:
+                try:
+                    plan.check_state(using=using)
+                except StalePlanException:
+                    plan = None
+            if plan is None and release.plan:
+                try:
+                    plan = PublishPlan.loads(release.plan)
+                    plan.check_state(using=using)
+                except (BadSignature, StalePlanException):
+                    plan = None
+            if plan is None:
+                plan = self.build_plan()
+            with recording(u'Release %s' % self.name, using=using):
+                plan.execute(check_state=False, using=using)
+
+            self.state, self.published = Release.PUBLISHED, timezone.now()
+            self.save(update_fields=['state', 'published'])
+        return plan
+
+
+class ReleaseItem(models.Model):
+    '''
+    a draft in a Release
+    '''
+    release = models.ForeignKey(Release, related_name='items', on_delete=models.CASCADE)
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = [('release', 'content_type', 'object_id')]
+
+    def __unicode__(self):
+        draft = self.draft
+        if draft is None:
+            return u'%s %s' % (self.content_type, self.object_id)
+        return force_unicode(draft)
+
+    @property
+    def draft(self):
+        model = self.content_type.model_class()
+        if model is None:
+            return None
+        return model._base_manager.filter(pk=self.object_id).first()
+
+
+class PublishSchedule(models.Model):
+    '''
+    a draft that is due to be published (or unpublished) at a given time, by
+    the run_publish_scheduler management command (see Publishable.publish_at).
+
+    entries are deleted once they have been run, so the table only holds
+    what is still to come, and due entries are found with an index on
+    (failed, due) - rather than by looking at every Publishable model
+    '''
+
+    PUBLISH = 'publish'
+    UNPUBLISH = 'unpublish'
+
+    ACTION_CHOICES = ((PUBLISH, 'Publish'), (UNPUBLISH, 'Unpublish'))
+
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    due = models.DateTimeField()
+    # entries that went wrong are kept (with the error) but not run again
+    failed = models.BooleanField(default=False, editable=False)
+    error = models.TextField(blank=True, editable=False)
+
+    class Meta:
+        ordering = ['due', 'id']
+        unique_together = [('content_type', 'object_id', 'action')]
+        indexes = [models.Index(fields=['failed', 'due'], name='publish_schedule_due')]
+
+    def __unicode__(self):
+        return u'%s %s %s at %s' % (self.get_action_display(), self.content_type, self.object_id, self.due)
+
+    @classmethod
+    def _lookup(cls, draft):
+        from django.contrib.contenttypes.models import ContentType
+        return dict(content_type=ContentType.objects.get_for_model(draft), object_id=force_unicode(draft.pk))
+
+    @classmethod
+    def schedule(cls, draft, action, when):
+        '''
+        (un)publish draft at when, replacing any time it was already due to be
+        '''
+        if draft.is_public:
+            raise PublishException("Cannot schedule public model - schedule the draft model instead")
+        if draft.pk is None:
+            raise PublishException("Please save model before scheduling it")
+        entry, created = cls._default_manager.update_or_create(
+            action=action, defaults=dict(due=when, failed=False, error=''), **cls._lookup(draft))
+        return entry
+
+    @classmethod
+    def cancel(cls, draft, action=None):
+        entries = cls._default_manager.filter(**cls._lookup(draft))
+        if action is not None:
+            entries = entries.filter(action=action)
+        entries.delete()
+
+    @classmethod
+    def due_entries(cls, now=None):
+        '''
+        the entries that should have been run by now (oldest first)
+        '''
+        return cls._default_manager.filter(failed=False, due__lte=now or timezone.now()).order_by('due')
+
+    @classmethod
+    def run_due(cls, now=None, batch_size=100):
+        '''
+        claim a batch of due entries and run them - publishing (or unpublishing) each
+        model's drafts in bulk, in one transaction.  returns how many were run, 0 once
+        nothing is due.  several schedulers can run at once, where the database can
+        skip locked rows each entry will only be claimed by one of them
+        '''
+        using = router.db_for_write(cls)
+        features = connections[using].features
+        with transaction.atomic(using=using):
+            due = cls.due_entries(now).using(using)
+            if features.has_select_for_update:
+                due = due.select_for_update(skip_locked=features.has_select_for_update_skip_locked)
+            entries = list(due[:batch_size])
+            if not entries:
+                return 0
+
+            failed = []
+            try:
+                with transaction.atomic(using=using):
+                    cls._run(entries, using)
+            except Exception:
+                # find out which ones are to blame, running the rest again
+                for entry in entries:
+                    try:
+                        with transaction.atomic(using=using):
+                            cls._run([entry], using)
+                    except Exception:
+                        logger.exception('Failed to %s %s', entry.action, entry)
+                        entry.failed, entry.error = True, traceback.format_exc()
+                        entry.save(update_fields=['failed', 'error'])
+                        failed.append(entry.pk)
+            cls._default_manager.using(using).filter(pk__in=[entry.pk for entry in entries
+                                                             if entry.pk not in failed]).delete()
+        return len(entries)
+
+    @classmethod
+    def _run(cls, entries, using):
+        from django.contrib.contenttypes.models import ContentType
+        by_model = OrderedDict()
+        for entry in entries:
+            model = ContentType.objects.get_for_id(entry.content_type_id).model_class()
+            if model is not None:
+                pk = model._meta.pk.to_python(entry.object_id)
+                by_model.setdefault((model, entry.action), []).append(pk)
+        with recording(u'Scheduled publishing', using=using):
+            for (model, action), pks in by_model.items():
+                drafts = PublishableQuerySet(model, using=using).filter(pk__in=pks, is_public=False)
+                if action == cls.UNPUBLISH:
+                    drafts.unpublish()
+                else:
+                    drafts.publish()
+
+
+class PublishOperation(models.Model):
+    '''
+    one publish (or unpublish, or release etc), recorded when the
+    PUBLISH_HISTORY setting is True so that it can be rolled back -
+    see history.py
+    '''
+    description = models.CharField(max_length=255, blank=True, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, editable=False,
+                             on_delete=models.SET_NULL)
+    created = models.DateTimeField(default=timezone.now, editable=False, db_index=True)
+    rolled_back = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-created', '-id']
+
+    def __unicode__(self):
+        return self.description or u'Publish operation %s' % self.pk
+
+    def rollback(self):
+        '''
+        put everything this operation changed back the way it was (see history.rollback)
+        '''
+        from .history import rollback
+        operation = rollback(self.pk, using=router.db_for_write(PublishOperation, instance=self))
+        self.rolled_back = operation.rolled_back
+        return self
+
+
+class PublishPreImage(models.Model):
+    '''
+    a row as it was before a PublishOperation changed it, or (when existed
+    is False) a row that it created
+    '''
+    operation = models.ForeignKey(PublishOperation, related_name='pre_images', on_delete=models.CASCADE)
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE)
+    object_id = models.CharField(max_length=255)
+    existed = models.BooleanField(default=True)
+    # the row's values (and many-to-many targets) as JSON
+    data = models.TextField(blank=True)
+
+    class Meta:
+        index_together = [('content_type', 'object_id')]
+
+    def __unicode__(self):
+        return u'%s %s' % (self.content_type, self.object_id)
+
+
+class PublishGeneration(models.Model):
+    '''
+    a counter that goes up every time something is published, both for
+    everything (the row with an empty label) and for each model.
+
+    handy as a cache version, or for ETag and Last-Modified headers
+    '''
+    label = models.CharField(max_length=255, unique=True, blank=True, editable=False)
+    generation = models.BigIntegerField(default=0, editable=False)
+    modified = models.DateTimeField(default=timezone.now, editable=False)
+
+    def __unicode__(self):
+        return u'%s: %s' % (self.label or u'(all)', self.generation)
+
+    @staticmethod
+    def _label(model):
+        if model is None:
+            return u''
+        return model._meta.concrete_model._meta.label_lower
+
+    @staticmethod
+    def _cache_key(label):
+        return 'publish:generation:%s' % label
+
+    @classmethod
+    def bump(cls, models, using=None):
+        '''
+        add one to the global generation and that of each of the given models
+        '''
+        labels = sorted(set([u''] + [cls._label(model) for model in models]))
+        if using is None:
+            using = router.db_for_write(cls)
+        manager = cls._default_manager.db_manager(using)
+        modified = timezone.now()
+        with transaction.atomic(using=using, savepoint=False):
+            updated = manager.filter(label__in=labels).update(generation=F('generation') + 1, modified=modified)
+            if updated != len(labels):
+                existing = set(manager.filter(label__in=labels).values_list('label', flat=True))
+                for label in labels:
+                    if label in existing:
+                        continue
+                    try:
+                        with transaction.atomic(using=using):
+                            manager.create(label=label, generation=1, modified=modified)
+                    except IntegrityError:
+                        # created by someone else in the meantime
+                        manager.filter(label=label).update(generation=F('generation') + 1, modified=modified)
+
+        record_publish()
+        keys = [cls._cache_key(label) for label in labels]
+        _get_cache().delete_many(keys)
+        transaction.on_commit(lambda: _get_cache().delete_many(keys), using=using)
+
+    @classmethod
+    def current(cls, model=None):
+        '''
+        the (generation, modified) of model, or of everything if model is None
+        - (0, None) if nothing has been published yet
+        '''
+        label = cls._label(model)
+        cache = _get_cache()
+        key = cls._cache_key(label)
+        current = cache.get(key)
+        if current is None:
+            current = cls._default_manager.filter(label=label).values_list('generation', 'modified').first()
+            if current is None:
+                current = (0, None)
+            cache.set(key, current, getattr(settings, 'PUBLISH_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+        return tuple(current)
@@ -0,0 +1,868 @@
+import multiprocessing
+import traceback
+
+from django.apps import apps
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, router, transaction
+from django.utils.encoding import force_unicode
+from django.db.models import prefetch_related_objects
+
+from .history import recording
+from .models import Publishable, PublishException, PublishGeneration, _split_published, send_publish_batch
+from .signals import pre_publish_batch, post_publish_batch
+from .utils import NestedSet, Return, run_steps
+
+
+class StalePlanException(PublishException):
+    '''
+    the drafts in a plan have changed since the plan was made
+    '''
+    pass
+
+
+def _key(instance):
+    return (instance._meta.concrete_model, instance.pk)
+
+
+def _version(instance, many_to_many, reverse):
+    # a hash of everything publishing instance depends on - the fields that get
+    # published (including foreign keys), along with many_to_many and reverse
+    # (dicts of name -> target or child primary keys)
+    related = dict(many_to_many)
+    related.update(('reverse:%s' % name, pks) for name, pks in reverse.items())
+    return instance._get_fingerprint(related)
+
+
+def _current_versions(model, instances, using):
+    '''
+    the versions (see _version) of instances as they are in the database now,
+    reading the many-to-many targets and reverse children in bulk
+    '''
+    from .bulk import through_pairs
+    copy_plan = model._get_copy_plan()
+    pks = [instance.pk for instance in instances]
+    many_to_many = dict((pk, {}) for pk in pks)
+    for copy_m2m in copy_plan.many_to_many:
+        name = copy_m2m.field.name
+        for pk in pks:
+            many_to_many[pk][name] = []
+        for pk, target_pk in through_pairs(copy_m2m.field, pks, using=using):
+            many_to_many[pk][name].append(target_pk)
+
+    reverse = dict((pk, {}) for pk in pks)
+    for copy_reverse in copy_plan.reverse:
+        field = copy_reverse.related.field
+        parents = dict((getattr(instance, field.target_field.attname), instance.pk) for instance in instances)
+        for pk in pks:
+            reverse[pk][copy_reverse.name] = []
+        # (the same manager the reverse accessor uses)
+        manager = field.model._default_manager if copy_reverse.multiple else field.model._base_manager
+        children = manager.using(using).filter(**{'%s__in' % field.attname: list(parents)})
+        for parent, child_pk in children.values_list(field.attname, 'pk'):
+            reverse[parents[parent]][copy_reverse.name].append(child_pk)
+
+    return dict((instance.pk, _version(instance, many_to_many[instance.pk], reverse[instance.pk]))
+                for instance in instances)
+
+
+def _prefetch_foreign_key(field, instances):
+    '''
+    load (and cache) the value of the foreign key field for all of instances
+    with one query, returning the newly loaded targets
+    '''
+    cache_name = field.get_cache_name()
+    target_attname = field.target_field.attname
+    referrers = {}
+    for instance in instances:
+        value = getattr(instance, field.attname)
+        if value is not None and not hasattr(instance, cache_name):
+            referrers.setdefault(value, []).append(instance)
+    if not referrers:
+        return []
+
+    targets = field.rel.to._base_manager.using(instances[0]._state.db)
+    targets = targets.filter(**{'%s__in' % target_attname: list(referrers)})
+    loaded = []
+    for target in targets:
+        loaded.append(target)
+        for instance in referrers[getattr(target, target_attname)]:
+            setattr(instance, cache_name, target)
+    return loaded
+
+
+class PlanNode(object):
+    '''
+    a single draft that is going to be published, along with how to
+    resolve it's publishable foreign keys, many-to-many targets and
+    reverse relations once the public rows actually exist.
+
+    References to other objects are either another PlanNode (when
+    the public row will be created as part of the plan) or a primary key.
+    '''
+
+    def __init__(self, instance, parent=None):
+        self.instance = instance
+        self.parent = parent
+        # state of the draft when the plan was made
+        self.publish_state = instance.publish_state
+        self.public_id = instance.public_id
+        self.write = False
+        # saved, but the same as when it was last published
+        self.unchanged = False
+        self.fingerprint = None
+        # a hash of the draft's fields and relations when the plan was dumped (see check_state)
+        self.version = None
+        # where it comes in the order the public rows are written (see PublishPlan.sort)
+        self.level = 0
+        self.public = None
+        # field name -> reference
+        self.foreign_keys = {}
+        # names of foreign keys to other nodes that aren't waited for (see PublishPlan.sort)
+        self.deferred = set()
+        # (field name, [reference, ...])
+        self.many_to_many = []
+        # (accessor name, [reference to public child, ...])
+        self.reverse = []
+
+    @property
+    def had_public(self):
+        return self.public_id is not None
+
+
+class PublishReport(object):
+    '''
+    the merged results of executing a plan's components in parallel
+    '''
+
+    def __init__(self):
+        self.components = 0
+        self.published = 0
+        # (description of component, traceback)
+        self.errors = []
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def add(self, description, published, error):
+        self.components += 1
+        self.published += published
+        if error is not None:
+            self.errors.append((description, error))
+
+
+# shared by the workers when only one of them can write at a time
+_write_lock = None
+
+
+def _init_worker(write_lock=None):
+    global _write_lock
+    import django
+    if not apps.ready:
+        django.setup()
+    _write_lock = write_lock
+
+
+def _execute_component(args):
+    # runs in a worker process, with it's own database connection
+    signed, check_state = args
+    try:
+        plan = PublishPlan.loads(signed)
+        if _write_lock is None:
+            plan.execute(check_state=check_state)
+        else:
+            with _write_lock:
+                plan.execute(check_state=check_state)
+        return len(plan), None
+    except Exception:
+        return 0, traceback.format_exc()
+    finally:
+        connections.close_all()
+
+
+class _PlanSerializer(object):
+    def dumps(self, obj):
+        return DjangoJSONEncoder(separators=(',', ':')).encode(obj).encode('latin-1')
+
+    def loads(self, data):
+        return signing.JSONSerializer().loads(data)
+
+
+class PublishPlan(object):
+    '''
+    everything that publishing a set of drafts would do, worked out up
+    front without writing anything to the database (much like a dry run
+    of Publishable.publish).
+
+    A plan can be shown to the user (via all_published), signed and
+    serialized with dumps() and then executed later on - without having
+    to walk the graph of related objects again.
+
+    If any of the models in the plan override publish, publish_changes,
+    publish_deletions or save (or have pre_save or post_save receivers) the plan
+    can't be executed in bulk, as that would skip them - so the roots are
+    published one at a time instead (per_instance).
+    '''
+
+    salt = 'publish.plan'
+
+    def __init__(self, all_published=None):
+        if all_published is None:
+            all_published = NestedSet()
+        self.all_published = all_published
+        self.roots = []
+        self.nodes = []
+        self.deletions = []
+        # whether to publish each root with Publishable.publish
+        self.per_instance = False
+        self._nodes = {}
+        # (model, field name, pk) -> draft many-to-many targets
+        self._many_to_many = {}
+        # drafts that _prefetch has already dealt with
+        self._prefetched = set()
+
+    @classmethod
+    def build(cls, instances, all_published=None):
+        plan = cls(all_published=all_published)
+        plan.add(instances)
+        return plan
+
+    def add(self, instances, parent=None):
+        instances = list(instances)
+        self._prefetch(instances)
+        for instance in instances:
+            self._check_can_publish(instance)
+        # deletions (and their cascades) can all be gathered up in one go
+        self._add_deletions([instance for instance in instances
+                             if instance.publish_state == Publishable.PUBLISH_DELETE and
+                             not instance._publishes_per_instance()], parent)
+        for instance in instances:
+            self.roots.append(instance)
+            self._visit(instance, parent)
+        self.sort()
+        return self
+
+    def __len__(self):
+        return len(self.all_published)
+
+    def _waits_for(self, node):
+        # (foreign key name, node) for the nodes that need to be written before node
+        return [(name, target) for name, target in sorted(node.foreign_keys.items())
+                if isinstance(target, PlanNode) and name not in node.deferred]
+
+    def sort(self):
+        '''
+        work out the order the public rows need to be written in - giving each
+        node a level, so that the targets of it's foreign keys are all written
+        at an earlier level (a topological sort).
+
+        where drafts refer to each other in a cycle one of the foreign keys is
+        deferred: left empty when the rows are first written and then filled in
+        with a single UPDATE once they all exist.  so no row is written more
+        than twice, however the drafts refer to each other
+        '''
+        while not self._defer_cycles():
+            pass
+
+        # Kahn's algorithm, from the nodes that don't need to wait for anything
+        referrers = dict((id(node), []) for node in self.nodes)
+        waiting = {}
+        for node in self.nodes:
+            node.level = 0
+            targets = self._waits_for(node)
+            waiting[id(node)] = len(targets)
+            for name, target in targets:
+                referrers[id(target)].append(node)
+        ready = [node for node in self.nodes if not waiting[id(node)]]
+        while ready:
+            target = ready.pop()
+            for node in referrers[id(target)]:
+                node.level = max(node.level, target.level + 1)
+                waiting[id(node)] -= 1
+                if not waiting[id(node)]:
+                    ready.append(node)
+
+    def _defer_cycles(self):
+        '''
+        defer a foreign key in each cycle, using a depth first search for foreign
+        keys that point back at a node we are still following the foreign keys of.
+
+        returns False if the search needs to start over (when a foreign key other
+        than the one that closed the cycle had to be deferred)
+        '''
+        done = set()
+        for start in self.nodes:
+            if id(start) in done:
+                continue
+            # (node, it's remaining foreign keys, name of the foreign key that led to it)
+            path = [(start, iter(self._waits_for(start)), None)]
+            on_path = set([id(start)])
+            while path:
+                node, targets, _ = path[-1]
+                for name, target in targets:
+                    if id(target) in on_path:
+                        cycle, i = [(node, name)], len(path) - 1
+                        while path[i][0] is not target:
+                            cycle.append((path[i - 1][0], path[i][2]))
+                            i -= 1
+                        if not self._defer_foreign_key(cycle):
+                            return False
+                    elif id(target) not in done:
+                        path.append((target, iter(self._waits_for(target)), name))
+                        on_path.add(id(target))
+                        break
+                else:
+                    path.pop()
+                    on_path.discard(id(node))
+                    done.add(id(node))
+        return True
+
+    def _defer_foreign_key(self, cycle):
+        # defer one of the (nullable) foreign keys in cycle - a list of (node,
+        # foreign key name), starting with the one that closes it
+        for node, name in cycle:
+            if node.instance._meta.get_field(name).null:
+                node.deferred.add(name)
+                return (node, name) == cycle[0]
+        raise PublishException("%s can't be published, as it is in a cycle of foreign keys that can't be null" %
+                               force_unicode(cycle[0][0].instance))
+
+    def _prefetch(self, instances):
+        '''
+        load everything we are going to need to visit instances - and the
+        reverse children that are published along with them, and their
+        children and so on - in bulk
+        '''
+        instances = [instance for instance in instances if _key(instance) not in self._prefetched]
+        while instances:
+            self._prefetched.update(_key(instance) for instance in instances)
+            instances = list(instances) + self._prefetch_foreign_keys(instances)
+            loaded = self._prefetch_many_to_many(instances) + self._prefetch_reverse(instances)
+            instances = [instance for instance in loaded if _key(instance) not in self._prefetched]
+
+    def _prefetch_reverse(self, instances):
+        '''
+        load the reverse children (from publish_reverse_fields) of instances
+        with one query per relation, returning the children
+        '''
+        by_model = {}
+        for instance in instances:
+            if instance.publish_state != Publishable.PUBLISH_DELETE and instance not in self.all_published:
+                by_model.setdefault(instance.__class__, []).append(instance)
+
+        children = []
+        for model, group in by_model.items():
+            copy_plan = model._get_copy_plan()
+            if not copy_plan.reverse:
+                continue
+            prefetch_related_objects(group, *[copy_reverse.name for copy_reverse in copy_plan.reverse])
+            for instance in group:
+                for copy_reverse in copy_plan.reverse:
+                    children.extend(instance._get_reverse_items(copy_reverse))
+        return children
+
+    def _prefetch_foreign_keys(self, instances):
+        '''
+        load the drafts that any publishable foreign keys of instances refer
+        to (and then the drafts they refer to and so on) in bulk, rather
+        than one at a time as we walk the graph.  returns the drafts
+        that were loaded.
+        '''
+        followed = []
+        seen = set(_key(instance) for instance in instances)
+        while instances:
+            by_model = {}
+            for instance in instances:
+                if instance._changes_need_publishing():
+                    by_model.setdefault(instance.__class__, []).append(instance)
+
+            instances = []
+            for model, group in by_model.items():
+                for copy_field in model._get_copy_plan().foreign_keys:
+                    instances.extend(_prefetch_foreign_key(copy_field.field, group))
+
+            # we only need to follow targets that are going to be published
+            # (and only once, as they may refer to each other in a cycle)
+            instances = [instance for instance in instances
+                         if instance.public_id is None and _key(instance) not in seen]
+            seen.update(_key(instance) for instance in instances)
+            followed.extend(instances)
+        return followed
+
+    def _prefetch_many_to_many(self, instances):
+        '''
+        read the through table pairs for the many-to-many fields of instances
+        with one query per field (and load any publishable targets with one
+        more), rather than a query per instance and field.  returns the
+        targets that will need publishing.
+        '''
+        from .bulk import through_pairs
+
+        by_model = {}
+        for instance in instances:
+            if instance.publish_state != Publishable.PUBLISH_DELETE and instance not in self.all_published:
+                by_model.setdefault(instance.__class__, []).append(instance)
+
+        unpublished = []
+        for model, group in by_model.items():
+            for copy_m2m in model._get_copy_plan().many_to_many:
+                field = copy_m2m.field
+                name = field.name
+                pks = set(instance.pk for instance in group if (model, name, instance.pk) not in self._many_to_many)
+                if not pks:
+                    continue
+                targets = dict((pk, []) for pk in pks)
+                pairs = through_pairs(field, pks, using=group[0]._state.db)
+                for pk, target_pk in pairs:
+                    targets[pk].append(target_pk)
+
+                if copy_m2m.publishable and pairs:
+                    # keep to the order the related manager would give us
+                    loaded = field.rel.to._base_manager.using(group[0]._state.db)
+                    loaded = list(loaded.filter(pk__in=set(target_pk for pk, target_pk in pairs)))
+                    order = dict((target.pk, i) for i, target in enumerate(loaded))
+                    by_pk = dict((target.pk, target) for target in loaded)
+                    unpublished.extend(target for target in loaded if target.public_id is None)
+                    for pk in pks:
+                        targets[pk] = [by_pk[target_pk] for target_pk
+                                       in sorted(targets[pk], key=order.__getitem__)]
+
+                for pk in pks:
+                    self._many_to_many[(model, name, pk)] = targets[pk]
+        return unpublished
+
+    def _get_many_to_many(self, instance, copy_m2m):
+        key = (instance.__class__, copy_m2m.field.name, instance.pk)
+        if key not in self._many_to_many:
+            self._prefetch_many_to_many([instance])
+        return self._many_to_many.pop(key)
+
+    def _check_can_publish(self, instance):
+        if instance.is_public:
+            raise PublishException("Cannot publish public model - publish should be called from draft model")
+        if instance.pk is None:
+            raise PublishException("Please save model before publishing")
+
+    def _visit(self, instance, parent=None):
+        return run_steps(self._visit_steps(instance, parent))
+
+    def _visit_steps(self, instance, parent=None):
+        # mirrors Publishable.publish (as steps for run_steps, so
+        # we aren't limited by the recursion limit)
+        self._check_can_publish(instance)
+        if instance._publishes_per_instance():
+            # only it's own publish knows what it will do
+            self.per_instance = True
+            if instance not in self.all_published:
+                instance.publish(dry_run=True, all_published=self.all_published, parent=parent)
+            node = None
+        elif instance.publish_state == Publishable.PUBLISH_DELETE:
+            self._add_deletions([instance], parent)
+            node = None
+        else:
+            node = yield self._visit_changes_steps(instance, parent)
+        yield Return(node)
+
+    def _add_deletions(self, instances, parent=None):
+        '''
+        record the deletion of instances (drafts marked for deletion) along
+        with any of their children that are also marked for deletion (much
+        like Publishable.publish_deletions) - gathering them a level at a
+        time, rather than one instance at a time.
+
+        nothing is deleted until the changes have been written
+        '''
+        level = [(instance, parent) for instance in instances]
+        while level:
+            by_model = {}
+            for instance, parent in level:
+                if instance in self.all_published:
+                    continue
+                if instance._publishes_per_instance():
+                    self.per_instance = True
+                self.all_published.add(instance, parent=parent)
+                self.deletions.append((instance, parent))
+                by_model.setdefault(instance.__class__, []).append(instance)
+
+            level = []
+            for model, group in by_model.items():
+                for copy_reverse in model._get_copy_plan().deletion_reverse:
+                    field = copy_reverse.related.field
+                    parents = dict((getattr(instance, field.target_field.attname), instance) for instance in group)
+                    children = field.model._base_manager.using(group[0]._state.db).filter(**{
+                        '%s__in' % field.attname: list(parents),
+                        'publish_state': Publishable.PUBLISH_DELETE,
+                    })
+                    level.extend((child, parents[getattr(child, field.attname)]) for child in children)
+
+    def _resolve_steps(self, value, parent):
+        # mirrors Publishable._get_public_or_publish
+        if value.public_id is not None:
+            resolved = value.public_id
+        elif value in self.all_published:
+            node = self._nodes.get(_key(value))
+            if node is None:
+                # published before we started
+                resolved = self.all_published.original(value).public_id
+            else:
+                # (possibly still resolving it's own foreign keys - a cycle, see sort)
+                resolved = node
+        else:
+            resolved = yield self._visit_steps(value, parent)
+        yield Return(resolved)
+
+    def _visit_changes_steps(self, instance, parent):
+        if instance in self.all_published:
+            resolved = yield self._resolve_steps(instance, parent)
+            yield Return(resolved)
+            return
+
+        self.all_published.add(instance, parent=parent)
+        node = PlanNode(instance, parent)
+        self._nodes[_key(instance)] = node
+        self.nodes.append(node)
+
+        copy_plan = instance._get_copy_plan()
+        many_to_many = [(copy_m2m, self._get_many_to_many(instance, copy_m2m))
+                        for copy_m2m in copy_plan.many_to_many]
+
+        node.write = instance._changes_need_publishing()
+        if node.write and copy_plan.fingerprint:
+            node.fingerprint = instance._get_fingerprint(dict(
+                (copy_m2m.field.name, [getattr(target, 'pk', target) for target in targets])
+                for copy_m2m, targets in many_to_many))
+            if instance._is_unchanged(node.fingerprint):
+                node.write, node.unchanged = False, True
+        instance._publish_unchanged = node.unchanged
+        if node.write:
+            for copy_field in copy_plan.foreign_keys:
+                name = copy_field.field.name
+                value = getattr(instance, name)
+                if value is not None:
+                    value = yield self._resolve_steps(value, instance)
+                node.foreign_keys[name] = value
+
+        for copy_m2m, targets in many_to_many:
+            if copy_m2m.publishable:
+                self._prefetch(targets)
+                resolved = []
+                for target in targets:
+                    target = yield self._resolve_steps(target, instance)
+                    resolved.append(target)
+                targets = resolved
+            node.many_to_many.append((copy_m2m.field.name, targets))
+
+        for copy_reverse in copy_plan.reverse:
+            related_items = instance._get_reverse_items(copy_reverse)
+            self._prefetch(related_items)
+
+            for related_item in related_items:
+                yield self._visit_steps(related_item, instance)
+
+            if copy_reverse.multiple:
+                # remember what will be left, so anything else can be tidied up
+                public_children = []
+                for related_item in related_items:
+                    related_node = self._nodes.get(_key(related_item))
+                    if related_node is not None and not related_node.had_public:
+                        public_children.append(related_node)
+                    else:
+                        public_children.append(related_item.public_id)
+                node.reverse.append((copy_reverse.name, public_children))
+
+        yield Return(node)
+
+    def execute(self, check_state=True, using=None):
+        '''
+        actually publish everything in the plan.
+
+        if check_state is True (the default) a StalePlanException will be
+        raised if any of the drafts have been changed since the plan was made
+        '''
+        from .bulk import BulkPublisher
+        if using is None:
+            using = self._db_for_write()
+        with transaction.atomic(using=using):
+            if check_state:
+                self.check_state(using=using)
+            if self.per_instance:
+                self._execute_per_instance(using)
+            else:
+                BulkPublisher(self, using=using).execute()
+
+    def _execute_per_instance(self, using):
+        # just as publishing each root with Publishable.publish
+        # would, but with one set of batch signals
+        send_publish_batch(pre_publish_batch, *_split_published(self.all_published), using=using)
+        all_published = NestedSet()
+        with recording(u'Publish %d objects' % len(self.all_published), using=using):
+            for root in self.roots:
+                root.publish(all_published=all_published)
+        changed, deleted = _split_published(all_published)
+        if changed or deleted:
+            PublishGeneration.bump(set(instance.__class__ for instance in changed + deleted), using=using)
+        send_publish_batch(post_publish_batch, changed, deleted, using=using)
+
+    def components(self):
+        '''
+        split this plan into plans for it's independent parts - groups of
+        drafts that don't refer to (or contain) each other - which can be
+        executed separately
+        '''
+        parents = {}
+
+        def find(key):
+            parents.setdefault(key, key)
+            while parents[key] != key:
+                parents[key] = parents[parents[key]]
+                key = parents[key]
+            return key
+
+        def union(a, b):
+            parents[find(_key(a))] = find(_key(b))
+
+        for item, parent in self.all_published.items_and_parents():
+            find(_key(item))
+            if parent is not None:
+                union(item, parent)
+        for node in self.nodes:
+            refs = list(node.foreign_keys.values())
+            for name, targets in node.many_to_many + node.reverse:
+                refs.extend(targets)
+            for ref in refs:
+                if isinstance(ref, PlanNode):
+                    union(node.instance, ref.instance)
+
+        plans = {}
+        for item, parent in self.all_published.items_and_parents():
+            root = find(_key(item))
+            if root not in plans:
+                plans[root] = self.__class__()
+                plans[root].per_instance = self.per_instance
+            plans[root].all_published.add(item, parent=parent)
+        for root in self.roots:
+            if _key(root) in parents:
+                plans[find(_key(root))].roots.append(root)
+        for node in self.nodes:
+            plan = plans[find(_key(node.instance))]
+            plan.nodes.append(node)
+            plan._nodes[_key(node.instance)] = node
+        for instance, parent in self.deletions:
+            plans[find(_key(instance))].deletions.append((instance, parent))
+        return [plan for plan in plans.values()
+                if plan.nodes or plan.deletions or (plan.per_instance and plan.roots)]
+
+    def execute_parallel(self, processes=None, check_state=True):
+        '''
+        execute each of the plan's components in it's own transaction, using
+        a pool of processes (each with it's own database connection).
+        returns a PublishReport - a failure in one component won't stop
+        the others being published.
+
+        falls back to executing the components one at a time when processes
+        is 1, when already inside a transaction or with an in-memory database
+        '''
+        using = self._db_for_write()
+        report = PublishReport()
+        components = self.components()
+
+        if processes == 1 or len(components) < 2 or not self._can_use_processes(using):
+            results = [self._execute_component(plan, check_state) for plan in components]
+        else:
+            work = [(plan.dumps(versions=check_state), check_state) for plan in components]
+            # sqlite locks the whole database for writing, so two transactions
+            # upgrading to a write at once would just fail with "database is locked"
+            write_lock = multiprocessing.Lock() if connections[using].vendor == 'sqlite' else None
+            # the workers must not share our connections
+            connections.close_all()
+            pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(write_lock,))
+            try:
+                results = pool.map(_execute_component, work)
+            finally:
+                pool.close()
+                pool.join()
+
+        for plan, (published, error) in zip(components, results):
+            report.add(u', '.join(force_unicode(root) for root in plan.roots) or u'deletions', published, error)
+        return report
+
+    def _can_use_processes(self, using):
+        if using is None:
+            return False
+        connection = connections[using]
+        if connection.in_atomic_block:
+            # the workers can't take part in our transaction
+            return False
+        # other processes can't see an in-memory sqlite database
+        return not getattr(connection, 'is_in_memory_db', lambda: False)()
+
+    def _execute_component(self, plan, check_state):
+        try:
+            plan.execute(check_state=check_state)
+            return len(plan), None
+        except Exception:
+            return 0, traceback.format_exc()
+
+    def _db_for_write(self):
+        for instance, parent in self.all_published.items_and_parents():
+            return router.db_for_write(instance.__class__, instance=instance)
+        return None
+
+    def check_state(self, using=None):
+        '''
+        make sure none of the drafts in the plan have changed (or been
+        published) since the plan was made - locking them as we go.
+
+        as well as their state, the drafts of a plan that has been dumped
+        (and so may have been kept for a while) have their fields, many-to-many
+        targets and reverse children compared with what they were when it was
+        dumped, as what the plan does with them depends on all of those
+        '''
+        expected, versions = {}, {}
+        for node in self.nodes:
+            expected[_key(node.instance)] = (node.publish_state, node.public_id)
+            if node.version is not None:
+                versions[_key(node.instance)] = node.version
+        for instance, parent in self.deletions:
+            expected[_key(instance)] = (Publishable.PUBLISH_DELETE, instance.public_id)
+
+        by_model = {}
+        for model, pk in expected:
+            by_model.setdefault(model, []).append(pk)
+
+        for model, pks in by_model.items():
+            current = model._base_manager.using(using).select_for_update().in_bulk(pks)
+            for pk in pks:
+                instance = current.get(pk)
+                if instance is None or (instance.publish_state, instance.public_id) != expected[(model, pk)]:
+                    self._stale(model, pk)
+
+            versioned = [current[pk] for pk in pks if (model, pk) in versions]
+            if versioned:
+                for pk, version in _current_versions(model, versioned, using).items():
+                    if version != versions[(model, pk)]:
+                        self._stale(model, pk)
+
+    def _stale(self, model, pk):
+        raise StalePlanException("%s %s has changed since publishing was planned" % (model._meta.verbose_name, pk))
+
+    def _dump_ref(self, ref, node_indexes):
+        if isinstance(ref, PlanNode):
+            return [node_indexes[id(ref)]]
+        return ref
+
+    def _add_versions(self):
+        # worked out in bulk from the database, rather than as the plan is
+        # built, so that doesn't have to load every field of every draft
+        by_model = {}
+        for node in self.nodes:
+            if node.version is None:
+                by_model.setdefault(node.instance.__class__, []).append(node)
+        for model, nodes in by_model.items():
+            using = nodes[0].instance._state.db
+            current = model._base_manager.using(using).in_bulk([node.instance.pk for node in nodes])
+            versions = _current_versions(model, list(current.values()), using)
+            for node in nodes:
+                node.version = versions.get(node.instance.pk)
+
+    def dumps(self, versions=True):
+        '''
+        sign and serialize this plan (e.g. to be put in a form).
+
+        versions - whether to record the drafts' versions, so check_state
+                   can tell if they change before the plan is executed
+        '''
+        if versions:
+            self._add_versions()
+        items, item_indexes = [], {}
+        for item, parent in self.all_published.items_and_parents():
+            item_indexes[_key(item)] = len(items)
+            items.append([item._meta.label, item.pk,
+                          None if parent is None else item_indexes[_key(parent)]])
+
+        node_indexes = dict((id(node), i) for i, node in enumerate(self.nodes))
+        dump_ref = lambda ref: self._dump_ref(ref, node_indexes)
+        nodes = []
+        for node in self.nodes:
+            nodes.append([
+                item_indexes[_key(node.instance)],
+                node.publish_state,
+                node.public_id,
+                node.write,
+                node.level,
+                node.unchanged,
+                node.fingerprint,
+                dict((name, dump_ref(ref)) for name, ref in node.foreign_keys.items()),
+                [[name, [dump_ref(ref) for ref in refs]] for name, refs in node.many_to_many],
+                [[name, [dump_ref(ref) for ref in refs]] for name, refs in node.reverse],
+                sorted(node.deferred),
+                node.version,
+            ])
+
+        data = {
+            'items': items,
+            'roots': [item_indexes[_key(root)] for root in self.roots if _key(root) in item_indexes],
+            'nodes': nodes,
+            'deletions': [[item_indexes[_key(instance)], instance.public_id] for instance, parent in self.deletions],
+            'per_instance': self.per_instance,
+        }
+        return signing.dumps(data, salt=self.salt, serializer=_PlanSerializer, compress=True)
+
+    @classmethod
+    def loads(cls, value):
+        '''
+        load a plan created with dumps().  raises BadSignature if the plan
+        has been tampered with and StalePlanException if any of the
+        objects in it no longer exist
+        '''
+        data = signing.loads(value, salt=cls.salt, serializer=_PlanSerializer)
+
+        by_model = {}
+        keys = []
+        for label, pk, parent in data['items']:
+            model = apps.get_model(label)
+            pk = model._meta.pk.to_python(pk)
+            keys.append((model, pk))
+            by_model.setdefault(model, []).append(pk)
+
+        instances = {}
+        for model, pks in by_model.items():
+            for pk, instance in model._base_manager.in_bulk(pks).items():
+                instances[(model, pk)] = instance
+
+        plan = cls()
+        items = []
+        for (model, pk), (label, _, parent) in zip(keys, data['items']):
+            instance = instances.get((model, pk))
+            if instance is None:
+                raise StalePlanException("%s %s no longer exists" % (model._meta.verbose_name, pk))
+            items.append(instance)
+            plan.all_published.add(instance, parent=None if parent is None else items[parent])
+
+        plan.roots = [items[i] for i in data['roots']]
+        plan.per_instance = data['per_instance']
+        for data_node in data['nodes']:
+            i, state, public_id, write, level, unchanged, fingerprint = data_node[:7]
+            node = PlanNode(items[i], parent=plan.all_published.parent(items[i]))
+            node.publish_state, node.public_id = state, public_id
+            node.write, node.level = write, level
+            node.unchanged, node.fingerprint = unchanged, fingerprint
+            plan.nodes.append(node)
+            plan._nodes[_key(node.instance)] = node
+
+        load_ref = lambda ref: plan.nodes[ref[0]] if isinstance(ref, list) else ref
+        for node, data_node in zip(plan.nodes, data['nodes']):
+            foreign_keys, many_to_many, reverse = data_node[7:10]
+            node.deferred = set(data_node[10])
+            node.version = data_node[11]
+            node.foreign_keys = dict((name, load_ref(ref)) for name, ref in foreign_keys.items())
+            node.many_to_many = [(name, [load_ref(ref) for ref in refs]) for name, refs in many_to_many]
+            node.reverse = [(name, [load_ref(ref) for ref in refs]) for name, refs in reverse]
+
+        for i, public_id in data['deletions']:
+            instance = items[i]
+            instance.public_id = public_id
+            instance.publish_state = Publishable.PUBLISH_DELETE
+            plan.deletions.append((instance, plan.all_published.parent(instance)))
+        return plan
@@ -0,0 +1,122 @@
+'''
+sends reads of published objects (PublishableQuerySet.published()) to a
+read only database (e.g. a replica), named by the PUBLISH_READ_DATABASE
+setting.  add PublishedReadRouter to DATABASE_ROUTERS and
+PublishedReadMiddleware to your middleware to use it.
+'''
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+try:
+    from django.utils.deprecation import MiddlewareMixin
+except ImportError:  # Django < 1.10
+    MiddlewareMixin = object
+
+
+# the hint PublishableQuerySet.published() gives the router
+PUBLISHED_HINT = 'publish_published'
+
+_local = threading.local()
+
+
+def get_read_database():
+    '''
+    the database published objects should be read from, or None
+    if they should be read from wherever everything else is
+    '''
+    if getattr(_local, 'pinned', 0) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        # (inside a transaction we want to see what it has written)
+        return None
+    return getattr(settings, 'PUBLISH_READ_DATABASE', None)
+
+
+@contextmanager
+def pinned_to_primary():
+    '''
+    read published objects from the primary database (rather
+    than PUBLISH_READ_DATABASE) until the end of the block
+    '''
+    _local.pinned = getattr(_local, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _local.pinned -= 1
+
+
+def record_publish():
+    # called whenever the publish generation goes up
+    _local.published = True
+
+
+class PublishedReadRouter(object):
+    '''
+    route reads of published objects to PUBLISH_READ_DATABASE,
+    leaving everything else to the other routers
+    '''
+
+    def db_for_read(self, model, **hints):
+        if hints.get(PUBLISHED_HINT):
+            return get_read_database()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the read database is a copy of the primary one, so objects read
+        # from it can be related to ones from the primary
+        read_database = getattr(settings, 'PUBLISH_READ_DATABASE', None)
+        if read_database is None:
+            return None
+        databases = set([DEFAULT_DB_ALIAS, read_database])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class PublishedReadMiddleware(MiddlewareMixin):
+    '''
+    after someone publishes something their following requests read published
+    objects from the primary database, until the read database has caught up
+    (it's global publish generation is at least the one they published) or
+    PUBLISH_READ_PIN_SECONDS have passed
+    '''
+    cookie_name = 'publish_generation'
+
+    def process_request(self, request):
+        _local.published = False
+        request._publish_pinned = request._publish_caught_up = False
+        read_database = getattr(settings, 'PUBLISH_READ_DATABASE', None)
+        generation = request.COOKIES.get(self.cookie_name)
+        if read_database is None or generation is None:
+            return None
+        from .models import PublishGeneration
+        try:
+            generation = int(generation)
+        except ValueError:
+            return None
+        replicated = PublishGeneration._default_manager.using(read_database).filter(label=u'') \
+            .values_list('generation', flat=True).first() or 0
+        if replicated < generation:
+            _local.pinned = getattr(_local, 'pinned', 0) + 1
+            request._publish_pinned = True
+        else:
+            request._publish_caught_up = True
+        return None
+
+    def process_response(self, request, response):
+        if getattr(request, '_publish_pinned', False):
+            _local.pinned -= 1
+            request._publish_pinned = False
+        read_database = getattr(settings, 'PUBLISH_READ_DATABASE', None)
+        if read_database is None:
+            return response
+        if getattr(_local, 'published', False):
+            from .models import PublishGeneration
+            _local.published = False
+            generation, modified = PublishGeneration.current()
+            response.set_cookie(self.cookie_name, str(generation),
+                                max_age=getattr(settings, 'PUBLISH_READ_PIN_SECONDS', 60))
+        elif getattr(request, '_publish_caught_up', False):
+            response.delete_cookie(self.cookie_name)
+        return response
@@ -1,6 +1,97 @@
+import logging
+import threading
+from functools import partial
+from multiprocessing.pool import ThreadPool
+
 import django.dispatch
+from django.conf import settings
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
 
 # instance is the instance being published, deleted is a boolean to indicate whether the instance
 # was being deleted (rather than changed)
 pre_publish = django.dispatch.Signal(providing_args=['instance', 'deleted'])
 post_publish = django.dispatch.Signal(providing_args=['instance', 'deleted'])
+
+# sent once for each publish operation (rather than for each instance), changed and deleted
+# are dicts of model class -> [instance, ...] of everything being published, so that
+# receivers can do their work in bulk
+pre_publish_batch = django.dispatch.Signal(providing_args=['changed', 'deleted'])
+post_publish_batch = django.dispatch.Signal(providing_args=['changed', 'deleted'])
+
+
+logger = logging.getLogger('publish')
+
+_local = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _on_commit_enabled():
+    return getattr(settings, 'PUBLISH_POST_PUBLISH_ON_COMMIT', False)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(getattr(settings, 'PUBLISH_POST_PUBLISH_THREADS'))
+        return _pool
+
+
+def _send_in_thread(signal, sender, kwargs):
+    try:
+        for receiver, response in signal.send_robust(sender=sender, **kwargs):
+            if isinstance(response, Exception):
+                logger.error('Error in %r receiver %r', signal, receiver, exc_info=(
+                    type(response), response, response.__traceback__))
+    finally:
+        # don't leave the connections opened by the receivers lying around
+        connections.close_all()
+
+
+class _OnCommitQueue(object):
+    '''
+    the post publish signals queued for one transaction, so that the
+    same instance is only sent once
+    '''
+
+    def __init__(self):
+        self.sent = set()
+
+    def send(self, signal, sender, key, kwargs):
+        if key is not None:
+            if key in self.sent:
+                return
+            self.sent.add(key)
+        if getattr(settings, 'PUBLISH_POST_PUBLISH_THREADS', 0):
+            _get_pool().apply_async(_send_in_thread, (signal, sender, kwargs))
+        else:
+            signal.send(sender=sender, **kwargs)
+
+
+def _get_on_commit_queue(using):
+    queues = getattr(_local, 'queues', None)
+    if queues is None:
+        queues = _local.queues = {}
+    queue = queues.get(using)
+    # nothing waiting for a commit means we are in a new transaction
+    # (or everything queued so far was rolled back)
+    if queue is None or not connections[using].run_on_commit:
+        queue = queues[using] = _OnCommitQueue()
+    return queue
+
+
+def send_post_publish(signal, sender, using=None, key=None, **kwargs):
+    '''
+    send post_publish or post_publish_batch - straight away, or once the current
+    transaction has been committed if PUBLISH_POST_PUBLISH_ON_COMMIT is set.
+
+    when sent on commit signals with the same key are only sent once
+    '''
+    if not _on_commit_enabled():
+        signal.send(sender=sender, **kwargs)
+        return
+    if using is None:
+        using = DEFAULT_DB_ALIAS
+    queue = _get_on_commit_queue(using)
+    transaction.on_commit(partial(queue.send, signal, sender, key, kwargs), using=using)
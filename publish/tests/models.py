@@ -1,6 +1,6 @@
 from django.db import models
 from datetime import datetime
-from publish.models import Publishable
+from publish.models import Publishable, ChangedFieldsField, FingerprintField
 
 
 class Site(models.Model):
@@ -16,10 +16,14 @@ class FlatPage(Publishable):
     template_name = models.CharField(max_length=70, blank=True)
     registration_required = models.BooleanField()
     sites = models.ManyToManyField(Site)
+    publish_changed_fields = ChangedFieldsField()
 
     class Meta:
         ordering = ['url']
 
+    class PublishMeta(Publishable.PublishMeta):
+        publish_public_unique_fields = ['url']
+
     def get_absolute_url(self):
         if self.is_public:
             return self.url
@@ -79,6 +83,7 @@ class Page(Publishable):
     authors = models.ManyToManyField(Author, blank=True)
     log = models.ManyToManyField(ChangeLog, blank=True)
     tags = models.ManyToManyField(Tag, through='PageTagOrder', blank=True)
+    publish_fingerprint = FingerprintField()
 
     class Meta:
         ordering = ['slug']
@@ -87,6 +92,7 @@ class Page(Publishable):
         publish_exclude_fields = ['log']
         publish_reverse_fields = ['pageblock_set']
         publish_functions = {'pub_date': update_pub_date}
+        publish_cache_lookups = ['pk', 'slug']
 
     def get_absolute_url(self):
         if not self.parent:
@@ -100,3 +106,34 @@ class PageTagOrder(Publishable):
     tagged_page = models.ForeignKey(Page)
     page_tag = models.ForeignKey(Tag)
     tag_order = models.IntegerField()
+
+
+class Note(Publishable):
+    # customises publishing, so is never published in bulk
+    page = models.ForeignKey(Page, blank=True, null=True)
+    text = models.CharField(max_length=100)
+
+    published = []
+
+    def publish_changes(self, dry_run=False, all_published=None, parent=None):
+        public = super(Note, self).publish_changes(dry_run=dry_run, all_published=all_published, parent=parent)
+        if not dry_run:
+            Note.published.append(self.pk)
+        return public
+
+
+class Review(Publishable):
+    # overrides save, so is never published in bulk
+    text = models.CharField(max_length=100)
+    saved_public = models.BooleanField(default=False)
+
+    def save(self, *arg, **kw):
+        if self.is_public:
+            self.saved_public = True
+        super(Review, self).save(*arg, **kw)
+
+
+class Event(Publishable):
+    title = models.CharField(max_length=100)
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
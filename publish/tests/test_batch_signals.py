@@ -0,0 +1,103 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from django.test import TransactionTestCase
+
+    from publish.models import Publishable, PublishGeneration
+    from publish.signals import post_publish, pre_publish_batch, post_publish_batch
+    from .models import Page, PageBlock, Author
+
+    class TestPublishBatchSignals(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishBatchSignals, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.child1 = Page.objects.create(parent=self.page1, slug='child1', title='Child 1')
+            self.block = PageBlock.objects.create(page=self.child1, content='block')
+            self.author = Author.objects.create(name='author')
+            self.child1.authors.add(self.author)
+            self.batches = []
+            pre_publish_batch.connect(self.pre_publish_batch_handler)
+            post_publish_batch.connect(self.post_publish_batch_handler)
+
+        def tearDown(self):
+            pre_publish_batch.disconnect(self.pre_publish_batch_handler)
+            post_publish_batch.disconnect(self.post_publish_batch_handler)
+            super(TestPublishBatchSignals, self).tearDown()
+
+        def pre_publish_batch_handler(self, sender, changed, deleted, **kw):
+            self.batches.append(('pre', self._sets(changed), self._sets(deleted)))
+
+        def post_publish_batch_handler(self, sender, changed, deleted, **kw):
+            for instances in changed.values():
+                for instance in instances:
+                    self.failUnless(instance.public)
+            self.batches.append(('post', self._sets(changed), self._sets(deleted)))
+
+        def _sets(self, grouped):
+            return dict((model, set(instances)) for model, instances in grouped.items())
+
+        def test_queryset_publish(self):
+            Page.objects.draft().publish()
+
+            expected = {Page: set([self.page1, self.child1]), PageBlock: set([self.block]),
+                        Author: set([self.author])}
+            self.failUnlessEqual([('pre', expected, {}), ('post', expected, {})], self.batches)
+
+        def test_publish(self):
+            Page.objects.get(id=self.child1.id).publish()
+
+            expected = {Page: set([self.page1, self.child1]), PageBlock: set([self.block]),
+                        Author: set([self.author])}
+            self.failUnlessEqual([('pre', expected, {}), ('post', expected, {})], self.batches)
+
+        def test_publish_deletions(self):
+            Page.objects.draft().publish()
+            self.batches = []
+            PageBlock.objects.get(id=self.block.id).delete()
+            Page.objects.get(id=self.child1.id).delete()
+
+            Page.objects.deleted().publish()
+
+            expected = {Page: set([self.child1]), PageBlock: set([self.block])}
+            self.failUnlessEqual([('pre', {}, expected), ('post', {}, expected)], self.batches)
+
+        def test_unchanged_not_in_batch(self):
+            Page.objects.draft().publish()
+            self.batches = []
+            # marked as changed, but the content is as it was published
+            Page.objects.filter(id=self.page1.id).update(publish_state=Publishable.PUBLISH_CHANGED)
+
+            Page.objects.filter(id=self.page1.id).publish()
+
+            self.failUnlessEqual([('pre', {}, {}), ('post', {}, {})], self.batches)
+
+        def test_unchanged_not_in_batch_publish(self):
+            Page.objects.draft().publish()
+            generation = PublishGeneration.current(Page)[0]
+            Page.objects.filter(id=self.page1.id).update(publish_state=Publishable.PUBLISH_CHANGED)
+            Page.objects.filter(id=self.page1.id).publish()
+            bulk_batches, self.batches = self.batches[2:], []
+            Page.objects.filter(id=self.page1.id).update(publish_state=Publishable.PUBLISH_CHANGED)
+
+            Page.objects.get(id=self.page1.id).publish()
+
+            # the same as publishing the queryset
+            self.failUnlessEqual(bulk_batches, self.batches)
+            self.failUnlessEqual([('pre', {}, {}), ('post', {}, {})], self.batches)
+            self.failUnlessEqual(generation, PublishGeneration.current(Page)[0])
+
+        def test_per_instance_signals_still_sent(self):
+            published = []
+
+            def post_publish_handler(sender, instance, deleted, **kw):
+                published.append(instance)
+
+            post_publish.connect(post_publish_handler, sender=Page)
+            try:
+                Page.objects.draft().publish()
+            finally:
+                post_publish.disconnect(post_publish_handler, sender=Page)
+
+            self.failUnlessEqual(set([self.page1, self.child1]), set(published))
+            self.failUnlessEqual(2, len(self.batches))
@@ -0,0 +1,94 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from django.core.cache import cache
+    from django.test import TransactionTestCase
+
+    from publish.models import Publishable
+    from .models import Page, PageBlock
+
+    class TestGetPublished(TransactionTestCase):
+
+        def setUp(self):
+            super(TestGetPublished, self).setUp()
+            cache.clear()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.page2 = Page.objects.create(slug='page2', title='page 2')
+            self.block = PageBlock.objects.create(page=self.page1, content='block')
+            Page.objects.draft().publish()
+            self.public1 = Page.objects.get(id=self.page1.id).public
+
+        def tearDown(self):
+            cache.clear()
+            super(TestGetPublished, self).tearDown()
+
+        def test_get_published_is_cached(self):
+            with self.assertNumQueries(1):
+                self.failUnlessEqual(self.public1, Page.objects.get_published(slug='page1'))
+            with self.assertNumQueries(0):
+                page = Page.objects.get_published(slug='page1')
+                self.failUnlessEqual(self.public1, page)
+                self.failUnlessEqual('page 1', page.title)
+                self.failUnlessEqual(self.public1, Page.objects.get_published(pk=self.public1.pk))
+                self.failUnlessEqual(self.public1, Page.objects.get_published(id=str(self.public1.pk)))
+
+        def test_only_published(self):
+            with self.assertRaises(Page.DoesNotExist):
+                Page.objects.get_published(pk=self.page1.pk)
+
+        def test_not_cached_lookup(self):
+            with self.assertNumQueries(1):
+                Page.objects.get_published(title='page 1')
+            with self.assertNumQueries(1):
+                Page.objects.get_published(title='page 1')
+
+        def test_does_not_exist(self):
+            with self.assertRaises(Page.DoesNotExist):
+                Page.objects.get_published(slug='missing')
+            Page.objects.create(slug='missing', title='missing').publish()
+            self.failUnlessEqual('missing', Page.objects.get_published(slug='missing').title)
+
+        def test_invalidated_by_publish(self):
+            Page.objects.get_published(slug='page1')
+            page1 = Page.objects.get(id=self.page1.id)
+            page1.title = 'new title'
+            page1.save()
+            page1.publish()
+            self.failUnlessEqual('new title', Page.objects.get_published(slug='page1').title)
+
+        def test_invalidated_by_bulk_publish(self):
+            Page.objects.get_published(slug='page1')
+            Page.objects.get_published(slug='page2')
+            Page.objects.filter(id=self.page1.id).update(title='new title', publish_state=Publishable.PUBLISH_CHANGED)
+            Page.objects.draft().publish()
+            with self.assertNumQueries(1):
+                self.failUnlessEqual('new title', Page.objects.get_published(slug='page1').title)
+            with self.assertNumQueries(0):
+                # still cached
+                self.failUnlessEqual('page 2', Page.objects.get_published(slug='page2').title)
+
+        def test_changed_lookup(self):
+            Page.objects.get_published(slug='page1')
+            page1 = Page.objects.get(id=self.page1.id)
+            page1.slug = 'renamed'
+            page1.save()
+            Page.objects.draft().publish()
+
+            with self.assertRaises(Page.DoesNotExist):
+                Page.objects.get_published(slug='page1')
+            self.failUnlessEqual(self.public1, Page.objects.get_published(slug='renamed'))
+
+        def test_invalidated_by_publish_deletions(self):
+            Page.objects.get_published(slug='page1')
+            PageBlock.objects.get(id=self.block.id).delete()
+            Page.objects.get(id=self.page1.id).delete()
+            Page.objects.deleted().publish()
+            with self.assertRaises(Page.DoesNotExist):
+                Page.objects.get_published(slug='page1')
+
+        def test_invalidated_by_unpublish(self):
+            Page.objects.get_published(pk=self.public1.pk)
+            PageBlock.objects.get(id=self.block.id).unpublish()
+            Page.objects.get(id=self.page1.id).unpublish()
+            with self.assertRaises(Page.DoesNotExist):
+                Page.objects.get_published(pk=self.public1.pk)
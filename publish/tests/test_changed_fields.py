@@ -0,0 +1,114 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from django.db import connection
+    from django.test import TransactionTestCase
+    from django.test.utils import CaptureQueriesContext
+
+    from publish.models import Publishable
+    from .models import FlatPage, Page
+
+    class TestChangedFields(TransactionTestCase):
+
+        def setUp(self):
+            super(TestChangedFields, self).setUp()
+            self.fp1 = FlatPage.objects.create(url='/fp1/', title='FP1', content='content 1',
+                                               enable_comments=False, registration_required=False)
+            self.fp2 = FlatPage.objects.create(url='/fp2/', title='FP2', content='content 2',
+                                               enable_comments=False, registration_required=False)
+
+        def _public_content(self, flatpage):
+            return FlatPage.objects.get(id=flatpage.id).public.content
+
+        def test_track_changes(self):
+            self.failUnless(FlatPage._get_copy_plan().track_changes)
+            self.failIf(Page._get_copy_plan().track_changes)
+
+        def test_unknown_until_published(self):
+            self.failUnlessEqual(None, self.fp1._get_changed_fields())
+            self.fp1.publish()
+            self.failUnlessEqual(set(), FlatPage.objects.get(id=self.fp1.id)._get_changed_fields())
+
+        def test_save_records_changed_fields(self):
+            self.fp1.publish()
+            fp1 = FlatPage.objects.get(id=self.fp1.id)
+            fp1.title = 'new title'
+            fp1.save()
+            self.failUnlessEqual(set(['title']), FlatPage.objects.get(id=self.fp1.id)._get_changed_fields())
+
+            fp1.content = 'new content'
+            fp1.save()
+            fp1 = FlatPage.objects.get(id=self.fp1.id)
+            self.failUnlessEqual(Publishable.PUBLISH_CHANGED, fp1.publish_state)
+            self.failUnlessEqual(set(['title', 'content']), fp1._get_changed_fields())
+
+        def test_save_update_fields(self):
+            self.fp1.publish()
+            fp1 = FlatPage.objects.get(id=self.fp1.id)
+            fp1.title, fp1.content = 'new title', 'new content'
+            fp1.save(update_fields=['title'])
+            fp1 = FlatPage.objects.get(id=self.fp1.id)
+            self.failUnlessEqual(set(['title']), fp1._get_changed_fields())
+            self.failUnlessEqual('content 1', fp1.content)
+
+        def test_save_copies_of_same_draft(self):
+            self.fp1.publish()
+            first = FlatPage.objects.get(id=self.fp1.id)
+            second = FlatPage.objects.get(id=self.fp1.id)
+            first.title = 'new title'
+            first.save(update_fields=['title'])
+            second.content = 'new content'
+            second.save(update_fields=['content'])
+            # neither loses what the other recorded
+            self.failUnlessEqual(set(['title', 'content']),
+                                 FlatPage.objects.get(id=self.fp1.id)._get_changed_fields())
+
+        def test_publish_only_copies_changed_fields(self):
+            self.fp1.publish()
+            fp1 = FlatPage.objects.get(id=self.fp1.id)
+            # so we can tell whether content gets copied again
+            FlatPage.objects.filter(id=fp1.public_id).update(content='public content')
+
+            fp1.title = 'new title'
+            fp1.save()
+            fp1.publish()
+
+            public = FlatPage.objects.get(id=fp1.public_id)
+            self.failUnlessEqual('new title', public.title)
+            self.failUnlessEqual('public content', public.content)
+            self.failUnlessEqual(set(), FlatPage.objects.get(id=fp1.id)._get_changed_fields())
+
+        def test_publish_queryset_only_copies_changed_fields(self):
+            FlatPage.objects.draft().publish()
+            for flatpage in FlatPage.objects.draft():
+                FlatPage.objects.filter(id=flatpage.public_id).update(content='public content')
+
+            fp1 = FlatPage.objects.get(id=self.fp1.id)
+            fp1.title = 'new title'
+            fp1.save()
+            fp2 = FlatPage.objects.get(id=self.fp2.id)
+            fp2.content = 'new content'
+            fp2.save()
+
+            with CaptureQueriesContext(connection) as context:
+                FlatPage.objects.draft().defer('content').publish()
+            selects = [query['sql'] for query in context.captured_queries if query['sql'].startswith('SELECT')]
+            # fp2's changed content is copied in the database, without loading it
+            self.failUnlessEqual(0, len([sql for sql in selects if '"content"' in sql]))
+
+            fp1 = FlatPage.objects.get(id=self.fp1.id)
+            fp2 = FlatPage.objects.get(id=self.fp2.id)
+            self.failUnlessEqual('new title', fp1.public.title)
+            self.failUnlessEqual('public content', fp1.public.content)
+            self.failUnlessEqual('new content', fp2.public.content)
+            self.failUnlessEqual(set(), fp1._get_changed_fields())
+
+        def test_unknown_changes_copy_everything(self):
+            self.fp1.publish()
+            FlatPage.objects.filter(id=self.fp1.id).update(publish_changed_fields=None,
+                                                            publish_state=Publishable.PUBLISH_CHANGED)
+            public_id = FlatPage.objects.get(id=self.fp1.id).public_id
+            FlatPage.objects.filter(id=public_id).update(content='public content')
+
+            FlatPage.objects.draft().publish()
+            self.failUnlessEqual('content 1', FlatPage.objects.get(id=public_id).content)
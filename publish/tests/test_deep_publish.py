@@ -0,0 +1,72 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    import os
+    import sys
+    import time
+    import unittest
+
+    from django.test import TransactionTestCase
+
+    from publish.utils import NestedSet
+    from .models import Page
+
+    def _create_chain(depth):
+        # pages 1..depth, each the parent of the next
+        Page.objects.bulk_create(Page(pk=i, parent_id=i - 1 or None, slug='page%d' % i, title='Page %d' % i)
+                                 for i in range(1, depth + 1))
+        return Page.objects.get(pk=depth)
+
+    def _nesting_depth(nested_items):
+        depth = 0
+        while nested_items:
+            depth += 1
+            nested_items = nested_items[1] if len(nested_items) > 1 else None
+        return depth
+
+    class TestDeepPublish(TransactionTestCase):
+        # deeper than we could go if publishing were recursive
+        depth = sys.getrecursionlimit() + 100
+
+        def setUp(self):
+            super(TestDeepPublish, self).setUp()
+            self.leaf = _create_chain(self.depth)
+
+        def _check_published(self):
+            self.failUnlessEqual(self.depth, Page.objects.published().count())
+            public_leaf = Page.objects.get(pk=self.depth).public
+            public_parent = Page.objects.get(pk=self.depth - 1).public
+            self.failUnlessEqual(public_parent.pk, public_leaf.parent_id)
+            self.failUnlessEqual(None, Page.objects.get(pk=1).public.parent_id)
+
+        def test_publish(self):
+            self.leaf.publish()
+            self._check_published()
+
+        def test_publish_queryset(self):
+            Page.objects.filter(pk=self.leaf.pk).publish()
+            self._check_published()
+
+        def test_dry_run_nesting(self):
+            all_published = NestedSet()
+            self.leaf.publish(dry_run=True, all_published=all_published)
+            self.failUnlessEqual(self.depth, len(all_published))
+            self.failUnlessEqual(self.depth, _nesting_depth(all_published.nested_items()))
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+    @unittest.skipUnless(os.environ.get('PUBLISH_BENCHMARK'), 'set PUBLISH_BENCHMARK=1 to run benchmarks')
+    class BenchmarkDeepPublish(TransactionTestCase):
+        depth = 50000
+
+        def _time(self, description, publish):
+            leaf = _create_chain(self.depth)
+            started = time.time()
+            publish(leaf)
+            sys.stderr.write('\n%s a %d deep chain: %.2fs ' % (description, self.depth, time.time() - started))
+            self.failUnlessEqual(self.depth, Page.objects.published().count())
+
+        def test_publish(self):
+            self._time('publish()', lambda leaf: leaf.publish())
+
+        def test_publish_queryset(self):
+            self._time('QuerySet.publish()', lambda leaf: Page.objects.filter(pk=leaf.pk).publish())
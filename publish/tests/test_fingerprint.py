@@ -0,0 +1,96 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from django.test import TransactionTestCase
+
+    from publish.models import Publishable
+    from publish.signals import pre_publish, post_publish
+    from .models import Author, FlatPage, Page
+
+    class TestFingerprint(TransactionTestCase):
+
+        def setUp(self):
+            super(TestFingerprint, self).setUp()
+            self.author = Author.objects.create(name='author')
+            self.page1 = Page.objects.create(slug='page1', title='Page 1', content='content 1')
+            self.page1.authors.add(self.author)
+            self.published = []
+
+        def _handler(self, sender, instance, deleted, **kw):
+            self.published.append(instance)
+
+        def _publish(self, publish):
+            pre_publish.connect(self._handler, sender=Page)
+            post_publish.connect(self._handler, sender=Page)
+            try:
+                publish()
+            finally:
+                pre_publish.disconnect(self._handler, sender=Page)
+                post_publish.disconnect(self._handler, sender=Page)
+
+        def test_fingerprint(self):
+            self.failUnless(Page._get_copy_plan().fingerprint)
+            self.failIf(FlatPage._get_copy_plan().fingerprint)
+
+        def test_fingerprint_stored_on_draft_and_public(self):
+            self.page1.publish()
+            page1 = Page.objects.get(id=self.page1.id)
+            self.failUnless(page1.publish_fingerprint)
+            self.failUnlessEqual(page1.publish_fingerprint, page1.public.publish_fingerprint)
+
+        def test_fingerprint_changes(self):
+            fingerprint = self.page1._get_fingerprint(self.page1._get_many_to_many_pks())
+            self.failUnlessEqual(fingerprint, self.page1._get_fingerprint(self.page1._get_many_to_many_pks()))
+
+            self.page1.title = 'new title'
+            self.failIfEqual(fingerprint, self.page1._get_fingerprint(self.page1._get_many_to_many_pks()))
+            self.page1.title = 'Page 1'
+
+            self.page1.authors.clear()
+            self.failIfEqual(fingerprint, self.page1._get_fingerprint(self.page1._get_many_to_many_pks()))
+
+        def test_publish_skips_unchanged(self):
+            self.page1.publish()
+            page1 = Page.objects.get(id=self.page1.id)
+            Page.objects.filter(id=page1.public_id).update(content='public content')
+
+            page1.save()
+            self.failUnlessEqual(Publishable.PUBLISH_CHANGED, page1.publish_state)
+            self._publish(page1.publish)
+
+            self.failUnlessEqual([], self.published)
+            page1 = Page.objects.get(id=self.page1.id)
+            self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, page1.publish_state)
+            # not copied again
+            self.failUnlessEqual('public content', page1.public.content)
+
+        def test_publish_queryset_skips_unchanged(self):
+            page2 = Page.objects.create(slug='page2', title='Page 2', content='content 2')
+            Page.objects.draft().publish()
+            page1 = Page.objects.get(id=self.page1.id)
+            Page.objects.filter(id=page1.public_id).update(content='public content')
+
+            page1.save()
+            page2 = Page.objects.get(id=page2.id)
+            page2.title = 'new title'
+            page2.save()
+            self._publish(Page.objects.changed().publish)
+
+            self.failUnlessEqual([page2, page2], self.published)
+            page1 = Page.objects.get(id=self.page1.id)
+            self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, page1.publish_state)
+            self.failUnlessEqual('public content', page1.public.content)
+            page2 = Page.objects.get(id=page2.id)
+            self.failUnlessEqual('new title', page2.public.title)
+            self.failUnlessEqual(page2.publish_fingerprint, page2.public.publish_fingerprint)
+
+        def test_publish_many_to_many_change(self):
+            self.page1.publish()
+            page1 = Page.objects.get(id=self.page1.id)
+            page1.authors.clear()
+            page1.save()
+            Page.objects.changed().publish()
+
+            page1 = Page.objects.get(id=self.page1.id)
+            self.failUnlessEqual([], list(page1.public.authors.all()))
+            self.failUnlessEqual(page1.publish_fingerprint, page1.public.publish_fingerprint)
@@ -0,0 +1,85 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from django.db import transaction
+    from django.test import TransactionTestCase
+
+    from publish.bulk import BulkPublisher
+    from publish.plan import PublishPlan
+    from .models import Page
+
+    class TestForeignKeyCycles(TransactionTestCase):
+
+        def setUp(self):
+            super(TestForeignKeyCycles, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.page2 = Page.objects.create(slug='page2', title='page 2', parent=self.page1)
+            self.page1.parent = self.page2
+            self.page1.save()
+
+        def _check_published(self):
+            page1 = Page.objects.get(pk=self.page1.pk)
+            page2 = Page.objects.get(pk=self.page2.pk)
+            self.failUnless(page1.public)
+            self.failUnless(page2.public)
+            self.failUnlessEqual(page2.public, page1.public.parent)
+            self.failUnlessEqual(page1.public, page2.public.parent)
+
+        def test_plan_defers_foreign_key(self):
+            plan = PublishPlan.build(Page.objects.filter(pk=self.page1.pk))
+            nodes = dict((node.instance.pk, node) for node in plan.nodes)
+            page1, page2 = nodes[self.page1.pk], nodes[self.page2.pk]
+
+            # page1 was visited first, so page2's foreign key closes the cycle
+            self.failUnlessEqual(set(), page1.deferred)
+            self.failUnlessEqual(set(['parent']), page2.deferred)
+            self.failUnlessEqual(0, page2.level)
+            self.failUnlessEqual(1, page1.level)
+
+        def test_publish_queryset(self):
+            Page.objects.filter(pk=self.page1.pk).publish()
+            self._check_published()
+
+        def test_publish(self):
+            self.page1.publish()
+            self._check_published()
+
+        def test_dumps_keeps_deferred(self):
+            plan = PublishPlan.loads(PublishPlan.build(Page.objects.filter(pk=self.page1.pk)).dumps())
+            nodes = dict((node.instance.pk, node) for node in plan.nodes)
+            self.failUnlessEqual(set(['parent']), nodes[self.page2.pk].deferred)
+
+            plan.execute()
+            self._check_published()
+
+        def test_target_already_public(self):
+            self.page1.parent = None
+            self.page1.save()
+            self.page1.publish()
+            self.page1 = Page.objects.get(pk=self.page1.pk)
+            self.page1.parent = self.page2
+            self.page1.save()
+
+            plan = PublishPlan.build(Page.objects.filter(pk=self.page1.pk))
+            nodes = dict((node.instance.pk, node) for node in plan.nodes)
+            # page1 already has a public row, so page2's can point straight at it
+            self.failUnlessEqual(set(), nodes[self.page2.pk].deferred)
+            self.failUnlessEqual(set(), nodes[self.page1.pk].deferred)
+            self.failUnlessEqual(self.page1.public_id, nodes[self.page2.pk].foreign_keys['parent'])
+
+            publisher = BulkPublisher(plan, using='default')
+            with transaction.atomic():
+                publisher.execute()
+            self.failUnlessEqual([], publisher._deferred)
+            self._check_published()
+
+        def test_longer_cycle(self):
+            page3 = Page.objects.create(slug='page3', title='page 3', parent=self.page2)
+            self.page1.parent = page3
+            self.page1.save()
+
+            Page.objects.filter(pk=self.page2.pk).publish()
+            page1, page2, page3 = [Page.objects.get(pk=page.pk) for page in (self.page1, self.page2, page3)]
+            self.failUnlessEqual(page3.public, page1.public.parent)
+            self.failUnlessEqual(page1.public, page2.public.parent)
+            self.failUnlessEqual(page2.public, page3.public.parent)
@@ -0,0 +1,102 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from unittest import skipUnless
+
+    from django.core.management import call_command, CommandError
+    from django.db import connection, IntegrityError, transaction
+    from django.test import TransactionTestCase
+    from django.utils.six import StringIO
+
+    from publish.checks import check_cached_lookups_indexed, check_publish_indexes_exist
+    from publish.indexes import PublishIndex
+    from .models import FlatPage, Page
+
+    class TestPublishIndexes(TransactionTestCase):
+
+        def _create_flat_page(self, url):
+            return FlatPage.objects.create(url=url, title='title', enable_comments=False,
+                                           registration_required=False)
+
+        def test_indexes_added(self):
+            indexes = FlatPage._meta.indexes
+            self.failUnlessEqual([['is_public', 'publish_state'], ['url']], [index.fields for index in indexes])
+            self.failUnless(isinstance(indexes[1], PublishIndex))
+            self.failUnless(indexes[1].unique)
+            # not asked for
+            self.failUnlessEqual([], Page._meta.indexes)
+
+        def test_indexes_created(self):
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, FlatPage._meta.db_table)
+            for index in FlatPage._meta.indexes:
+                self.failUnless(index.name in constraints)
+
+        def test_unique_amongst_public(self):
+            fp1 = self._create_flat_page('/same/')
+            fp2 = self._create_flat_page('/same/')
+            # two drafts are fine
+            fp1.publish()
+            with self.assertRaises(IntegrityError):
+                with transaction.atomic():
+                    fp2.publish()
+
+        def test_deconstruct(self):
+            index = PublishIndex(fields=['url'], name='url_pub', unique=True)
+            path, args, kwargs = index.deconstruct()
+            self.failUnlessEqual('publish.indexes.PublishIndex', path)
+            self.failUnlessEqual({'fields': ['url'], 'name': 'url_pub', 'unique': True}, kwargs)
+            self.failUnlessEqual(index, index.clone())
+
+        def test_check_indexes_exist(self):
+            self.failUnlessEqual([], check_publish_indexes_exist())
+
+            index = FlatPage._meta.indexes[1]
+            with connection.schema_editor() as schema_editor:
+                schema_editor.execute(index.remove_sql(FlatPage, schema_editor))
+            try:
+                errors = check_publish_indexes_exist()
+                self.failUnlessEqual(['publish.W002'], [error.id for error in errors])
+                self.failUnless('CREATE UNIQUE INDEX' in errors[0].hint)
+            finally:
+                with connection.schema_editor() as schema_editor:
+                    schema_editor.execute(index.create_sql(FlatPage, schema_editor))
+
+        def test_check_cached_lookups_indexed(self):
+            self.failUnlessEqual([], check_cached_lookups_indexed())
+
+            class PublishMeta(Page.PublishMeta):
+                publish_cache_lookups = ['title']
+            original, Page.PublishMeta = Page.PublishMeta, PublishMeta
+            try:
+                errors = check_cached_lookups_indexed()
+            finally:
+                Page.PublishMeta = original
+            self.failUnlessEqual(['publish.W001'], [error.id for error in errors])
+
+    class TestPublishCluster(TransactionTestCase):
+
+        @skipUnless(connection.vendor == 'postgresql', 'CLUSTER is PostgreSQL only')
+        def test_sql(self):
+            out = StringIO()
+            call_command('publish_cluster', sql=True, stdout=out)
+            index = FlatPage._meta.indexes[0]
+            self.failUnlessEqual(['CLUSTER "publish_flatpage" USING "%s";' % index.name,
+                                  'ANALYZE "publish_flatpage";'], out.getvalue().splitlines())
+
+        @skipUnless(connection.vendor == 'postgresql', 'CLUSTER is PostgreSQL only')
+        def test_only_models_with_indexes(self):
+            out = StringIO()
+            call_command('publish_cluster', 'publish.Page', sql=True, stdout=out)
+            self.failUnlessEqual('', out.getvalue())
+
+        def test_postgresql_only(self):
+            if connection.vendor == 'postgresql':
+                return
+            with self.assertRaises(CommandError):
+                call_command('publish_cluster', stdout=StringIO())
+            # not even the SQL
+            out = StringIO()
+            with self.assertRaises(CommandError):
+                call_command('publish_cluster', sql=True, stdout=out)
+            self.failUnlessEqual('', out.getvalue())
@@ -79,3 +79,30 @@ if getattr(settings, 'TESTING_PUBLISH', False):
 
             self.failUnlessEqual(id(m1), id(self.nested.original(m1)))
             self.failUnlessEqual(id(m1), id(self.nested.original(MyObject('m1'))))
+
+        def test_iter_order(self):
+            for item in ['c', 'a', 'b']:
+                self.nested.add(item)
+            self.nested.add('a1', parent='a')
+            self.failUnlessEqual(['c', 'a', 'b', 'a1'], list(self.nested))
+
+        def test_parent(self):
+            self.nested.add('one')
+            self.nested.add('one2', parent='one')
+            self.failUnlessEqual(None, self.nested.parent('one'))
+            self.failUnlessEqual('one', self.nested.parent('one2'))
+            self.failUnlessEqual([('one', None), ('one2', 'one')], list(self.nested.items_and_parents()))
+
+    class TestNestedSetModels(unittest.TestCase):
+
+        def test_original_uses_model_and_pk(self):
+            from .models import Page, FlatPage
+            nested = NestedSet()
+            page = Page(id=1, slug='page')
+            nested.add(page)
+
+            self.failUnless(Page(id=1) in nested)
+            self.failUnless(page is nested.original(Page(id=1)))
+            self.failIf(FlatPage(id=1) in nested)
+            other = Page(id=2)
+            self.failUnless(other is nested.original(other))
@@ -0,0 +1,88 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    import threading
+
+    from django.db import transaction
+    from django.test import TransactionTestCase, override_settings
+
+    from publish.signals import post_publish, post_publish_batch
+    from .models import Page
+
+    @override_settings(PUBLISH_POST_PUBLISH_ON_COMMIT=True)
+    class TestPostPublishOnCommit(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPostPublishOnCommit, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.page2 = Page.objects.create(slug='page2', title='page 2')
+            self.published = []
+            self.received = threading.Event()
+            post_publish.connect(self.post_publish_handler, sender=Page)
+
+        def tearDown(self):
+            post_publish.disconnect(self.post_publish_handler, sender=Page)
+            super(TestPostPublishOnCommit, self).tearDown()
+
+        def post_publish_handler(self, sender, instance, deleted, **kw):
+            self.published.append((instance, threading.current_thread()))
+            self.received.set()
+
+        def test_sent_on_commit(self):
+            with transaction.atomic():
+                Page.objects.draft().publish()
+                self.failUnlessEqual([], self.published)
+            self.failUnlessEqual(set([self.page1, self.page2]), set(instance for instance, thread in self.published))
+
+        def test_not_sent_on_rollback(self):
+            try:
+                with transaction.atomic():
+                    Page.objects.draft().publish()
+                    raise ValueError
+            except ValueError:
+                pass
+            self.failUnlessEqual([], self.published)
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_sent_once_per_instance(self):
+            with transaction.atomic():
+                Page.objects.get(id=self.page1.id).publish()
+                page1 = Page.objects.get(id=self.page1.id)
+                page1.title = 'new title'
+                page1.save()
+                page1.publish()
+            self.failUnlessEqual([self.page1], [instance for instance, thread in self.published])
+
+        def test_sent_straight_away_outside_transaction(self):
+            Page.objects.get(id=self.page1.id).publish()
+            self.failUnlessEqual([self.page1], [instance for instance, thread in self.published])
+
+        def test_publish_batch(self):
+            batches = []
+
+            def post_publish_batch_handler(sender, changed, deleted, **kw):
+                batches.append(changed)
+
+            post_publish_batch.connect(post_publish_batch_handler)
+            try:
+                with transaction.atomic():
+                    Page.objects.draft().publish()
+                    self.failUnlessEqual([], batches)
+            finally:
+                post_publish_batch.disconnect(post_publish_batch_handler)
+            self.failUnlessEqual(1, len(batches))
+
+        @override_settings(PUBLISH_POST_PUBLISH_THREADS=1)
+        def test_threads(self):
+            with transaction.atomic():
+                Page.objects.get(id=self.page1.id).publish()
+            self.failUnless(self.received.wait(5))
+            [(instance, thread)] = self.published
+            self.failUnlessEqual(self.page1, instance)
+            self.failIfEqual(threading.current_thread(), thread)
+
+        @override_settings(PUBLISH_POST_PUBLISH_ON_COMMIT=False)
+        def test_disabled(self):
+            with transaction.atomic():
+                Page.objects.get(id=self.page1.id).publish()
+                self.failUnlessEqual([self.page1], [instance for instance, thread in self.published])
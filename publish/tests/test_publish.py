@@ -31,6 +31,35 @@ if getattr(settings, 'TESTING_PUBLISH', False):
             self.failIfEqual(pub_date, self.page.pub_date)
             self.failUnlessEqual(pub_date, self.page.public.pub_date)
 
+    class TestCopyPlan(TransactionTestCase):
+
+        def test_compiled_once(self):
+            self.failUnless(Page._get_copy_plan() is Page._get_copy_plan())
+
+        def test_fields(self):
+            copy_plan = Page._get_copy_plan()
+            names = [copy_field.field.name for copy_field in copy_plan.fields]
+            self.failUnlessEqual(['slug', 'title', 'content', 'pub_date', 'parent'], names)
+            self.failUnlessEqual(['parent'], [copy_field.field.name for copy_field in copy_plan.foreign_keys])
+
+            publish_functions = dict((copy_field.field.name, copy_field.publish_function)
+                                     for copy_field in copy_plan.fields)
+            self.failUnlessEqual(update_pub_date, publish_functions['pub_date'])
+            self.failUnlessEqual(None, publish_functions['title'])
+
+        def test_many_to_many_and_reverse(self):
+            copy_plan = Page._get_copy_plan()
+            # log is excluded and tags (which uses a publishable through model)
+            # gets published via it's reverse relation
+            self.failUnlessEqual(['authors'], [copy_m2m.field.name for copy_m2m in copy_plan.many_to_many])
+            self.failUnlessEqual(set(['pageblock_set', 'pagetagorder_set']),
+                                 set(copy_reverse.name for copy_reverse in copy_plan.reverse))
+
+        def test_one_to_one_reverse(self):
+            copy_plan = Author._get_copy_plan()
+            self.failUnlessEqual([('authorprofile', False)],
+                                 [(copy_reverse.name, copy_reverse.multiple) for copy_reverse in copy_plan.reverse])
+
     class TestPublishSignals(TransactionTestCase):
 
         def setUp(self):
@@ -0,0 +1,116 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from django.core.cache import cache
+    from django.http import HttpResponse
+    from django.test import TransactionTestCase
+    from django.test.client import RequestFactory
+
+    from publish.models import PublishGeneration
+    from publish.views import published_condition
+    from .models import Page, PageBlock, Author
+
+    class TestPublishGeneration(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishGeneration, self).setUp()
+            cache.clear()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.block = PageBlock.objects.create(page=self.page1, content='block')
+            self.author = Author.objects.create(name='author')
+
+        def tearDown(self):
+            cache.clear()
+            super(TestPublishGeneration, self).tearDown()
+
+        def generation(self, model=None):
+            return PublishGeneration.current(model)[0]
+
+        def test_nothing_published(self):
+            self.failUnlessEqual((0, None), PublishGeneration.current())
+            self.failUnlessEqual((0, None), PublishGeneration.current(Page))
+
+        def test_publish(self):
+            Page.objects.get(id=self.page1.id).publish()
+            self.failUnlessEqual(1, self.generation())
+            self.failUnlessEqual(1, self.generation(Page))
+            self.failUnlessEqual(1, self.generation(PageBlock))
+            self.failUnlessEqual(0, self.generation(Author))
+
+            self.author.publish()
+            self.failUnlessEqual(2, self.generation())
+            self.failUnlessEqual(1, self.generation(Page))
+            self.failUnlessEqual(1, self.generation(Author))
+
+        def test_queryset_publish(self):
+            Page.objects.draft().publish()
+            self.failUnlessEqual(1, self.generation())
+            self.failUnlessEqual(1, self.generation(PageBlock))
+
+        def test_publish_deletions(self):
+            Page.objects.draft().publish()
+            Page.objects.get(id=self.page1.id).delete()
+            PageBlock.objects.get(id=self.block.id).delete()
+
+            Page.objects.get(id=self.page1.id).publish()
+            self.failUnlessEqual(2, self.generation())
+            self.failUnlessEqual(2, self.generation(PageBlock))
+
+        def test_unpublish(self):
+            self.author.publish()
+            modified = PublishGeneration.current(Author)[1]
+            Author.objects.get(id=self.author.id).unpublish()
+            self.failUnlessEqual(2, self.generation(Author))
+            self.failUnless(PublishGeneration.current(Author)[1] >= modified)
+
+        def test_dry_run(self):
+            Page.objects.get(id=self.page1.id).publish(dry_run=True)
+            self.failUnlessEqual(0, self.generation())
+
+        def test_current_is_cached(self):
+            self.author.publish()
+            self.generation()
+            with self.assertNumQueries(0):
+                self.failUnlessEqual(1, self.generation())
+
+    class TestPublishedCondition(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishedCondition, self).setUp()
+            cache.clear()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.page1.publish()
+            self.rendered = []
+
+            @published_condition(Page)
+            def view(request):
+                self.rendered.append(request)
+                return HttpResponse('page')
+            self.view = view
+
+        def tearDown(self):
+            cache.clear()
+            super(TestPublishedCondition, self).tearDown()
+
+        def test_conditional_get(self):
+            response = self.view(RequestFactory().get('/'))
+            self.failUnlessEqual(200, response.status_code)
+            etag = response['ETag']
+
+            response = self.view(RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag))
+            self.failUnlessEqual(304, response.status_code)
+            self.failUnlessEqual(1, len(self.rendered))
+
+            response = self.view(RequestFactory().get('/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']))
+            self.failUnlessEqual(304, response.status_code)
+
+        def test_publish_changes_etag(self):
+            etag = self.view(RequestFactory().get('/'))['ETag']
+            page1 = Page.objects.get(id=self.page1.id)
+            page1.title = 'new title'
+            page1.save()
+            page1.publish()
+
+            response = self.view(RequestFactory().get('/', HTTP_IF_NONE_MATCH=etag))
+            self.failUnlessEqual(200, response.status_code)
+            self.failIfEqual(etag, response['ETag'])
@@ -0,0 +1,272 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    import json
+    from datetime import datetime
+
+    from django.conf.urls import include, url
+    from django.contrib.contenttypes.models import ContentType
+    from django.contrib.admin.sites import AdminSite
+    from django.test import TransactionTestCase
+    from django.test.utils import override_settings
+    from django.utils.encoding import force_unicode
+
+    from publish.actions import rollback_selected
+    from publish.admin import PublishOperationAdmin
+    from publish.history import recording, rollback
+    from publish.models import Publishable, PublishException, PublishOperation, PublishPreImage
+    from . import RequestFactoryMixin
+    from .models import Page, PageBlock, Author, Event
+
+    @override_settings(PUBLISH_HISTORY=True)
+    class TestPublishHistory(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishHistory, self).setUp()
+            self.page = Page.objects.create(slug='page', title='Page')
+            self.block = PageBlock.objects.create(page=self.page, content='block')
+            self.author = Author.objects.create(name='author')
+            self.page.authors.add(self.author)
+
+        def _public_page(self):
+            return Page.objects.get(pk=self.page.pk).public
+
+        def test_records_operation(self):
+            self.page.publish()
+            operation = PublishOperation.objects.get()
+            self.failUnless(operation.description)
+            created = operation.pre_images.filter(existed=False)
+            # public page, block and author
+            self.failUnlessEqual(3, created.count())
+            # and the drafts, as they were
+            self.failUnlessEqual(3, operation.pre_images.filter(existed=True).count())
+
+        def test_rollback_first_publish(self):
+            self.page.publish()
+            operation = PublishOperation.objects.get()
+
+            rollback(operation.pk)
+
+            self.failUnlessEqual(0, Page.objects.published().count())
+            self.failUnlessEqual(0, PageBlock.objects.published().count())
+            self.failUnlessEqual(0, Author.objects.published().count())
+            page = Page.objects.get(pk=self.page.pk)
+            self.failUnless(page.public is None)
+            self.failUnlessEqual(Publishable.PUBLISH_CHANGED, page.publish_state)
+            self.failUnlessEqual(1, PageBlock.objects.draft().count())
+            self.failUnless(PublishOperation.objects.get().rolled_back)
+
+        def test_rollback_changes(self):
+            self.page.publish()
+            public_pk = self._public_page().pk
+            self.page = Page.objects.get(pk=self.page.pk)
+            self.page.title = 'Changed'
+            self.page.save()
+            self.page.authors.clear()
+            self.page.publish()
+
+            public = self._public_page()
+            self.failUnlessEqual('Changed', public.title)
+            self.failUnlessEqual([], list(public.authors.all()))
+
+            PublishOperation.objects.order_by('-id')[0].rollback()
+
+            public = self._public_page()
+            self.failUnlessEqual(public_pk, public.pk)
+            self.failUnlessEqual('Page', public.title)
+            self.failUnlessEqual([Author.objects.get(pk=self.author.pk).public_id],
+                                 [author.pk for author in public.authors.all()])
+            page = Page.objects.get(pk=self.page.pk)
+            self.failUnlessEqual('Changed', page.title)
+            self.failUnlessEqual(Publishable.PUBLISH_CHANGED, page.publish_state)
+
+        def test_rollback_keeps_later_edits(self):
+            self.page.publish()
+            page = Page.objects.get(pk=self.page.pk)
+            page.title = 'Edited since'
+            page.save()
+
+            PublishOperation.objects.get().rollback()
+
+            page = Page.objects.get(pk=self.page.pk)
+            self.failUnlessEqual('Edited since', page.title)
+            self.failUnless(page.public is None)
+
+        def test_rollback_deleted_child(self):
+            self.page.publish()
+            public_block = PageBlock.objects.published().get()
+            PageBlock.objects.get(pk=self.block.pk).delete(mark_for_deletion=False)
+            Page.objects.get(pk=self.page.pk).publish()
+            self.failUnlessEqual(0, PageBlock.objects.published().count())
+
+            PublishOperation.objects.order_by('-id')[0].rollback()
+
+            self.failUnlessEqual(public_block, PageBlock.objects.published().get())
+            self.failUnlessEqual('block', PageBlock.objects.published().get().content)
+
+        def test_rollback_deletion(self):
+            self.page.publish()
+            public_pk = self._public_page().pk
+            page = Page.objects.get(pk=self.page.pk)
+            page.delete()
+            page.publish()
+            self.failUnlessEqual(0, Page.objects.count())
+
+            PublishOperation.objects.order_by('-id')[0].rollback()
+
+            page = Page.objects.get(pk=self.page.pk)
+            self.failUnlessEqual(public_pk, page.public_id)
+            self.failUnlessEqual(Publishable.PUBLISH_DELETE, page.publish_state)
+            self.failUnlessEqual(2, PageBlock.objects.count())
+
+        def test_draft_pre_images_are_partial(self):
+            self.page.publish()
+            pre_image = PublishOperation.objects.get().pre_images.get(
+                existed=True, content_type=ContentType.objects.get_for_model(Page), object_id=str(self.page.pk))
+            data = json.loads(pre_image.data)
+            self.failUnless(data['partial'])
+            self.failUnless('publish_state' in data['fields'])
+            self.failIf('title' in data['fields'])
+
+        def test_rollback_deletion_after_publish(self):
+            # the draft was only changed at first, but then deleted too
+            with recording('both'):
+                self.page.publish()
+                page = Page.objects.get(pk=self.page.pk)
+                page.delete()
+                page.publish()
+            self.failUnlessEqual(0, Page.objects.count())
+
+            PublishOperation.objects.get().rollback()
+
+            page = Page.objects.get(pk=self.page.pk)
+            self.failUnlessEqual('Page', page.title)
+            self.failUnless(page.public is None)
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_rollback_keeps_auto_now(self):
+            event = Event.objects.create(title='Event')
+            event.publish()
+            old = datetime(2001, 1, 1, 12, 0)
+            Event.objects.published().update(created=old, modified=old)
+            event = Event.objects.get(pk=event.pk)
+            event.title = 'Changed'
+            event.save()
+            event.publish()
+            self.failIfEqual(old, Event.objects.published().get().modified)
+
+            PublishOperation.objects.order_by('-id')[0].rollback()
+
+            public = Event.objects.published().get()
+            self.failUnlessEqual('Event', public.title)
+            self.failUnlessEqual(old, public.created)
+            self.failUnlessEqual(old, public.modified)
+
+        def test_rollback_queryset_publish(self):
+            Page.objects.create(slug='page2', title='Page 2')
+            Page.objects.draft().publish()
+            self.failUnlessEqual(2, Page.objects.published().count())
+            self.failUnlessEqual(1, PublishOperation.objects.count())
+
+            rollback(PublishOperation.objects.get().pk)
+            self.failUnlessEqual(0, Page.objects.published().count())
+            self.failUnlessEqual(0, PageBlock.objects.published().count())
+            self.failUnlessEqual(0, Page.objects.filter(public__isnull=False).count())
+
+        def test_rollback_unpublish(self):
+            self.page.publish()
+            public_pk = self._public_page().pk
+            Page.objects.draft().unpublish()
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+            PublishOperation.objects.order_by('-id')[0].rollback()
+
+            public = self._public_page()
+            self.failUnlessEqual(public_pk, public.pk)
+            self.failUnlessEqual(1, public.authors.count())
+            self.failUnlessEqual(1, PageBlock.objects.published().count())
+
+        def test_one_operation_when_recording(self):
+            with recording('both'):
+                self.page.publish()
+                Author.objects.create(name='another').publish()
+            self.failUnlessEqual(['both'], [operation.description for operation in PublishOperation.objects.all()])
+
+        def test_rollback_twice(self):
+            self.page.publish()
+            operation = PublishOperation.objects.get()
+            rollback(operation.pk)
+            self.failUnlessRaises(PublishException, rollback, operation.pk)
+
+        def test_rollback_out_of_order(self):
+            self.page.publish()
+            page = Page.objects.get(pk=self.page.pk)
+            page.title = 'Changed'
+            page.save()
+            page.publish()
+            first, second = PublishOperation.objects.order_by('id')
+
+            self.failUnlessRaises(PublishException, rollback, first.pk)
+            self.failUnlessEqual('Changed', self._public_page().title)
+
+            rollback(second.pk)
+            rollback(first.pk)
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_nothing_to_record(self):
+            Page.objects.get(pk=self.page.pk).publish(dry_run=True)
+            self.failUnlessEqual(0, PublishOperation.objects.count())
+
+        @override_settings(PUBLISH_HISTORY=False)
+        def test_not_recorded(self):
+            self.page.publish()
+            Page.objects.draft().unpublish()
+            self.failUnlessEqual(0, PublishOperation.objects.count())
+            self.failUnlessEqual(0, PublishPreImage.objects.count())
+
+    @override_settings(PUBLISH_HISTORY=True)
+    class TestRollbackAction(TransactionTestCase, RequestFactoryMixin):
+
+        def setUp(self):
+            super(TestRollbackAction, self).setUp()
+            self.admin_site = AdminSite('Test Admin')
+            self.operation_admin = PublishOperationAdmin(PublishOperation, self.admin_site)
+            settings.ROOT_URLCONF = [
+                url('^admin/', include(self.admin_site.urls)),
+            ]
+
+        def test_rollback_selected(self):
+            page1 = Page.objects.create(slug='page1', title='Page 1')
+            page2 = Page.objects.create(slug='page2', title='Page 2')
+            page1.publish()
+            page2.publish()
+            page1 = Page.objects.get(pk=page1.pk)
+            page1.title = 'Changed'
+            page1.save()
+            page1.publish()
+            self.failUnlessEqual(3, PublishOperation.objects.count())
+
+            # asks first
+            response = rollback_selected(self.operation_admin, self.build_post_request({}),
+                                         PublishOperation.objects.all())
+            self.failIf(response is None)
+            self.failUnless('value="rollback_selected"' in response.content)
+            for operation in PublishOperation.objects.all():
+                self.failUnless(force_unicode(operation) in response.content.decode('utf-8'))
+            self.failUnlessEqual(2, Page.objects.published().count())
+            self.failUnlessEqual(0, PublishOperation.objects.filter(rolled_back__isnull=False).count())
+
+            response = rollback_selected(self.operation_admin, self.build_post_request({'post': 'yes'}),
+                                         PublishOperation.objects.all())
+            self.failUnless(response is None)
+            self.failUnlessEqual(0, Page.objects.published().count())
+            self.failUnlessEqual(3, PublishOperation.objects.filter(rolled_back__isnull=False).count())
+
+        def test_rollback_selected_already_rolled_back(self):
+            Page.objects.create(slug='page1', title='Page 1').publish()
+            PublishOperation.objects.get().rollback()
+
+            response = rollback_selected(self.operation_admin, self.build_post_request({}),
+                                         PublishOperation.objects.all())
+            self.failIf('value="rollback_selected"' in response.content)
+            self.failUnless('already been rolled back' in response.content)
@@ -0,0 +1,233 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    import time
+    from datetime import timedelta
+
+    from django.conf.urls import include, url
+    from django.contrib.admin.models import LogEntry
+    from django.contrib.admin.sites import AdminSite
+    from django.core.management import call_command
+    from django.core.urlresolvers import clear_url_caches
+    from django.db import connections
+    from django.test import TransactionTestCase
+    from django.utils import timezone
+    from django.utils.six import StringIO
+
+    from publish.actions import publish_selected
+    from publish.admin import PublishableAdmin, PublishJobAdmin
+    from publish.models import Publishable, PublishJob, _JobHeartbeat
+    from publish.plan import PublishPlan
+    from . import RequestFactoryMixin
+    from .models import Page
+
+    class TestPublishJob(TransactionTestCase, RequestFactoryMixin):
+
+        def setUp(self):
+            super(TestPublishJob, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.page2 = Page.objects.create(slug='page2', title='page 2')
+
+        def test_enqueue(self):
+            job = PublishJob.enqueue(PublishPlan.build(Page.objects.draft()), description='two pages')
+            self.failUnlessEqual(PublishJob.PENDING, job.state)
+            self.failUnlessEqual(2, job.object_count)
+            self.failUnlessEqual(0, job.queue_position())
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_claim(self):
+            job1 = PublishJob.enqueue(PublishPlan.build(Page.objects.filter(id=self.page1.id)))
+            job2 = PublishJob.enqueue(PublishPlan.build(Page.objects.filter(id=self.page2.id)))
+            self.failUnlessEqual(1, job2.queue_position())
+
+            claimed = PublishJob.claim(worker='worker1')
+            self.failUnlessEqual(job1, claimed)
+            self.failUnlessEqual(PublishJob.RUNNING, PublishJob.objects.get(id=job1.id).state)
+            self.failUnlessEqual('worker1', PublishJob.objects.get(id=job1.id).worker)
+            self.failUnlessEqual(job2, PublishJob.claim(worker='worker2'))
+            self.failUnlessEqual(None, PublishJob.claim(worker='worker3'))
+
+        def test_expire(self):
+            job = PublishJob.enqueue(PublishPlan.build(Page.objects.draft()))
+            self.failUnlessEqual(job, PublishJob.claim(worker='worker1'))
+            started = PublishJob.objects.get(id=job.id).started
+            # the worker died, so the job is left running
+            self.failUnlessEqual(None, PublishJob.claim(worker='worker2', timeout=60))
+
+            self.failUnlessEqual(0, PublishJob.expire(timeout=60, now=started + timedelta(seconds=30)))
+            self.failUnlessEqual(1, PublishJob.expire(timeout=60, now=started + timedelta(seconds=90)))
+            self.failUnlessEqual(PublishJob.PENDING, PublishJob.objects.get(id=job.id).state)
+
+            claimed = PublishJob.claim(worker='worker2')
+            self.failUnlessEqual(job, claimed)
+            self.failUnlessEqual(2, claimed.attempts)
+            self.failUnless(claimed.run())
+            self.failUnlessEqual(2, Page.objects.published().count())
+
+        def test_expire_fails_after_attempts(self):
+            job = PublishJob.enqueue(PublishPlan.build(Page.objects.draft()))
+            with self.settings(PUBLISH_JOB_ATTEMPTS=2):
+                for i in range(2):
+                    self.failUnlessEqual(job, PublishJob.claim())
+                    PublishJob.expire(timeout=0, now=timezone.now() + timedelta(seconds=1))
+                job = PublishJob.objects.get(id=job.id)
+                self.failUnlessEqual(PublishJob.FAILED, job.state)
+                self.failUnless('Timed out' in job.error)
+                self.failUnlessEqual(None, PublishJob.claim())
+
+        def test_heartbeat(self):
+            job = PublishJob.enqueue(PublishPlan.build(Page.objects.draft()))
+            job = PublishJob.claim(worker='worker1')
+            started = job.started
+            # still going, so it is left alone
+            self.failUnless(job.beat(now=started + timedelta(seconds=80)))
+            self.failUnlessEqual(0, PublishJob.expire(timeout=60, now=started + timedelta(seconds=90)))
+            self.failUnlessEqual(1, PublishJob.expire(timeout=60, now=started + timedelta(seconds=150)))
+            self.failIf(job.beat())
+
+        def test_heartbeat_thread(self):
+            PublishJob.enqueue(PublishPlan.build(Page.objects.draft()))
+            job = PublishJob.claim(worker='worker1')
+            shared = connections['default']
+
+            class SharedHeartbeat(_JobHeartbeat):
+                # (like LiveServerTestCase, as other connections can't see an in-memory database)
+                def run(self):
+                    if getattr(shared, 'is_in_memory_db', lambda: False)():
+                        connections['default'] = shared
+                    super(SharedHeartbeat, self).run()
+
+            beating = SharedHeartbeat(job, 0.01)
+            shared.allow_thread_sharing = True
+            beating.start()
+            try:
+                for i in range(100):
+                    if PublishJob.objects.get(id=job.id).heartbeat > job.started:
+                        break
+                    time.sleep(0.01)
+            finally:
+                beating.stop()
+                shared.allow_thread_sharing = False
+            self.failUnless(PublishJob.objects.get(id=job.id).heartbeat > job.started)
+
+        def test_expired_while_running(self):
+            PublishJob.enqueue(PublishPlan.build(Page.objects.draft()))
+            job1 = PublishJob.claim(worker='worker1')
+            # worker1 was too slow to say it was still going, so another worker gets the job
+            PublishJob.expire(timeout=60, now=job1.started + timedelta(seconds=90))
+            job2 = PublishJob.claim(worker='worker2')
+            self.failUnlessEqual(job1, job2)
+
+            self.failUnless(job1.run())
+            self.failUnlessEqual(PublishJob.DONE, PublishJob.objects.get(id=job1.id).state)
+            # worker2's plan is stale by now, but the job was published
+            self.failIf(job2.run())
+            job = PublishJob.objects.get(id=job1.id)
+            self.failUnlessEqual(PublishJob.DONE, job.state)
+            self.failUnlessEqual('', job.error)
+            self.failUnlessEqual(2, Page.objects.published().count())
+
+        def test_failure_after_takeover(self):
+            PublishJob.enqueue(PublishPlan.build(Page.objects.draft()))
+            job1 = PublishJob.claim(worker='worker1')
+            PublishJob.expire(timeout=60, now=job1.started + timedelta(seconds=90))
+            PublishJob.claim(worker='worker2')
+            Page.objects.get(id=self.page1.id).publish()
+
+            # it's up to worker2 now
+            self.failIf(job1.run())
+            job = PublishJob.objects.get(id=job1.id)
+            self.failUnlessEqual(PublishJob.RUNNING, job.state)
+            self.failUnlessEqual('worker2', job.worker)
+
+        def test_run(self):
+            user = self.build_user()
+            PublishJob.enqueue(PublishPlan.build(Page.objects.draft()), user=user)
+            job = PublishJob.claim()
+            self.failUnless(job.run())
+
+            job = PublishJob.objects.get(id=job.id)
+            self.failUnlessEqual(PublishJob.DONE, job.state)
+            self.failUnless(job.finished)
+            self.failUnlessEqual(2, Page.objects.published().count())
+            self.failUnlessEqual(2, LogEntry.objects.filter(user=user).count())
+
+        def test_run_stale_plan(self):
+            PublishJob.enqueue(PublishPlan.build(Page.objects.draft()))
+            Page.objects.get(id=self.page1.id).publish()
+
+            job = PublishJob.claim()
+            self.failIf(job.run())
+            job = PublishJob.objects.get(id=job.id)
+            self.failUnlessEqual(PublishJob.FAILED, job.state)
+            self.failUnless('StalePlanException' in job.error)
+            self.failUnlessEqual(1, Page.objects.published().count())
+
+        def test_run_moved_since_enqueued(self):
+            PublishJob.enqueue(PublishPlan.build(Page.objects.filter(id=self.page2.id)))
+            page2 = Page.objects.get(id=self.page2.id)
+            page2.parent = self.page1
+            page2.save()
+
+            job = PublishJob.claim()
+            self.failIf(job.run())
+            self.failUnless('StalePlanException' in PublishJob.objects.get(id=job.id).error)
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_publish_worker(self):
+            PublishJob.enqueue(PublishPlan.build(Page.objects.filter(id=self.page1.id)))
+            PublishJob.enqueue(PublishPlan.build(Page.objects.filter(id=self.page2.id)))
+
+            call_command('publish_worker', once=True, stdout=StringIO())
+
+            self.failUnlessEqual(2, Page.objects.published().count())
+            self.failUnlessEqual(2, PublishJob.objects.filter(state=PublishJob.DONE).count())
+
+    class TestPublishSelectedInBackground(TransactionTestCase, RequestFactoryMixin):
+
+        def setUp(self):
+            super(TestPublishSelectedInBackground, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.admin_site = AdminSite('Test Admin')
+
+            class PageAdmin(PublishableAdmin):
+                publish_in_background = True
+
+            self.admin_site.register(Page, PageAdmin)
+            self.admin_site.register(PublishJob, PublishJobAdmin)
+            self.page_admin = PageAdmin(Page, self.admin_site)
+            settings.ROOT_URLCONF = [
+                url('^admin/', include(self.admin_site.urls)),
+            ]
+            clear_url_caches()
+
+        def tearDown(self):
+            clear_url_caches()
+            super(TestPublishSelectedInBackground, self).tearDown()
+
+        def test_publish_selected_enqueues(self):
+            request = self.build_post_request({'post': 'yes'})
+            response = publish_selected(self.page_admin, request, Page.objects.draft())
+
+            self.failUnless(response is None)
+            self.failUnlessEqual(0, Page.objects.published().count())
+            job = PublishJob.objects.get()
+            self.failUnlessEqual(PublishJob.PENDING, job.state)
+            self.failUnlessEqual(request.user, job.user)
+            messages = [str(message) for message in request._messages]
+            self.failUnless('/admin/publish/publishjob/%d/' % job.id in messages[0])
+
+            PublishJob.claim().run()
+            page1 = Page.objects.get(id=self.page1.id)
+            self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, page1.publish_state)
+            self.failUnless(page1.public)
+
+        def test_status_page(self):
+            request = self.build_post_request({'post': 'yes'})
+            publish_selected(self.page_admin, request, Page.objects.draft())
+            job = PublishJob.objects.get()
+
+            response = self.admin_site._registry[PublishJob].change_view(self.build_get_request(), str(job.id))
+            self.failUnlessEqual(200, response.status_code)
+            response.render()
+            self.failUnless('Waiting' in response.content)
@@ -0,0 +1,288 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    import os
+    import tempfile
+    from unittest import skipUnless
+
+    from django.conf.urls import include, url
+    from django.contrib.admin.sites import AdminSite
+    from django.core.management import call_command
+    from django.core.signing import BadSignature
+    from django.db import connection, connections
+    from django.test import TransactionTestCase
+
+    from publish.actions import publish_selected
+    from publish.admin import PublishableAdmin
+    from publish.models import Publishable
+    from publish.plan import PublishPlan, StalePlanException
+    from . import RequestFactoryMixin
+    from .models import Page, PageBlock, Author
+
+    class TestPublishPlan(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishPlan, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.child1 = Page.objects.create(parent=self.page1, slug='child1', title='Child 1')
+            self.block = PageBlock.objects.create(page=self.child1, content='block')
+            self.author = Author.objects.create(name='author')
+            self.child1.authors.add(self.author)
+
+        def test_build_is_dry_run(self):
+            plan = PublishPlan.build(Page.objects.filter(id=self.child1.id))
+
+            self.failUnlessEqual(4, len(plan))
+            self.failUnlessEqual(set([self.page1, self.child1, self.block, self.author]), set(plan.all_published))
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_execute(self):
+            plan = PublishPlan.build(Page.objects.filter(id=self.child1.id))
+            plan.execute()
+
+            child1 = Page.objects.get(id=self.child1.id)
+            page1 = Page.objects.get(id=self.page1.id)
+            author = Author.objects.get(id=self.author.id)
+            self.failUnlessEqual(page1.public, child1.public.parent)
+            self.failUnlessEqual([author.public], list(child1.public.authors.all()))
+            self.failUnlessEqual(1, child1.public.pageblock_set.count())
+
+        def test_dumps_loads(self):
+            plan = PublishPlan.build(Page.objects.filter(id=self.child1.id))
+            loaded = PublishPlan.loads(plan.dumps())
+
+            self.failUnlessEqual(plan.all_published.nested_items(), loaded.all_published.nested_items())
+            self.failUnlessEqual([self.child1], loaded.roots)
+
+            loaded.execute()
+
+            child1 = Page.objects.get(id=self.child1.id)
+            page1 = Page.objects.get(id=self.page1.id)
+            author = Author.objects.get(id=self.author.id)
+            self.failUnlessEqual(Publishable.PUBLISH_DEFAULT, child1.publish_state)
+            self.failUnlessEqual(page1.public, child1.public.parent)
+            self.failUnlessEqual([author.public], list(child1.public.authors.all()))
+            self.failUnlessEqual(1, child1.public.pageblock_set.count())
+
+        def test_loads_tampered(self):
+            signed = PublishPlan.build(Page.objects.draft()).dumps()
+            with self.assertRaises(BadSignature):
+                PublishPlan.loads(signed[:-1] + ('A' if signed[-1] != 'A' else 'B'))
+
+        def test_stale_plan(self):
+            signed = PublishPlan.build(Page.objects.filter(id=self.page1.id)).dumps()
+
+            # published elsewhere in the meantime
+            self.page1.publish()
+
+            plan = PublishPlan.loads(signed)
+            with self.assertRaises(StalePlanException):
+                plan.execute()
+
+        def test_stale_plan_relations_changed(self):
+            signed = PublishPlan.build(Page.objects.filter(id=self.child1.id)).dumps()
+
+            # moved (and retitled) in the meantime, without changing it's publish state
+            page2 = Page.objects.create(slug='page2', title='page 2')
+            child1 = Page.objects.get(id=self.child1.id)
+            child1.parent = page2
+            child1.title = 'Moved'
+            child1.save()
+
+            plan = PublishPlan.loads(signed)
+            with self.assertRaises(StalePlanException):
+                plan.execute()
+            self.failUnlessEqual(0, Page.objects.published().count())
+            self.failUnlessEqual(Publishable.PUBLISH_CHANGED, Page.objects.get(id=self.child1.id).publish_state)
+
+        def test_stale_plan_many_to_many_changed(self):
+            signed = PublishPlan.build(Page.objects.filter(id=self.child1.id)).dumps()
+            self.child1.authors.clear()
+
+            with self.assertRaises(StalePlanException):
+                PublishPlan.loads(signed).execute()
+
+        def test_stale_plan_reverse_changed(self):
+            signed = PublishPlan.build(Page.objects.filter(id=self.child1.id)).dumps()
+            PageBlock.objects.create(page=self.child1, content='another block')
+
+            with self.assertRaises(StalePlanException):
+                PublishPlan.loads(signed).execute()
+
+        def test_stale_plan_deleted_object(self):
+            signed = PublishPlan.build(Page.objects.filter(id=self.child1.id)).dumps()
+            self.block.delete()
+            with self.assertRaises(StalePlanException):
+                PublishPlan.loads(signed)
+
+    class TestPublishPlanPrefetch(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishPlanPrefetch, self).setUp()
+            for i in range(5):
+                parent = Page.objects.create(slug='parent%d' % i, title='parent')
+                page = Page.objects.create(slug='page%d' % i, title='page', parent=parent)
+                PageBlock.objects.create(page=page, content='block')
+
+        def test_prefetch_foreign_keys(self):
+            blocks = list(PageBlock.objects.all())
+            with self.assertNumQueries(2):
+                # one for the pages and one for their parents
+                PublishPlan()._prefetch_foreign_keys(blocks)
+            with self.assertNumQueries(0):
+                for block in blocks:
+                    self.failUnless(block.page.parent.slug.startswith('parent'))
+
+        def test_prefetch_skips_published_targets(self):
+            for page in Page.objects.filter(parent__isnull=True):
+                page.publish()
+            pages = list(Page.objects.filter(parent__isnull=False))
+            with self.assertNumQueries(1):
+                PublishPlan()._prefetch_foreign_keys(pages)
+
+    class TestPublishSelectedPlan(TransactionTestCase, RequestFactoryMixin):
+
+        def setUp(self):
+            super(TestPublishSelectedPlan, self).setUp()
+            self.fp1 = Page.objects.create(slug='fp1', title='FP1')
+            self.fp2 = Page.objects.create(slug='fp2', title='FP2')
+            self.admin_site = AdminSite('Test Admin')
+            self.page_admin = PublishableAdmin(Page, self.admin_site)
+            settings.ROOT_URLCONF = [
+                url('^admin/', include(self.admin_site.urls)),
+            ]
+
+        def test_confirmation_includes_plan(self):
+            response = publish_selected(self.page_admin, self.build_post_request({}), Page.objects.draft())
+            self.failUnless('name="publish_plan"' in response.content)
+
+        def test_publish_with_plan(self):
+            signed = PublishPlan.build(Page.objects.draft()).dumps()
+
+            request = self.build_post_request({'post': 'yes', 'publish_plan': signed})
+            response = publish_selected(self.page_admin, request, Page.objects.draft())
+
+            self.failUnless(response is None)
+            self.failUnlessEqual(2, Page.objects.published().count())
+
+        def test_publish_with_stale_plan(self):
+            signed = PublishPlan.build(Page.objects.draft()).dumps()
+            Page.objects.get(id=self.fp1.id).publish()
+
+            request = self.build_post_request({'post': 'yes', 'publish_plan': signed})
+            response = publish_selected(self.page_admin, request, Page.objects.draft())
+
+            self.failUnless(response is None)
+            # only the one published outside the plan
+            self.failUnlessEqual(1, Page.objects.published().count())
+
+    class TestPublishPlanComponents(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishPlanComponents, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.child1 = Page.objects.create(parent=self.page1, slug='child1', title='Child 1')
+            self.page2 = Page.objects.create(slug='page2', title='page 2')
+            self.block = PageBlock.objects.create(page=self.page2, content='block')
+            self.page3 = Page.objects.create(slug='page3', title='page 3')
+            self.author = Author.objects.create(name='author')
+            self.page3.authors.add(self.author)
+
+        def test_components(self):
+            plan = PublishPlan.build(Page.objects.draft())
+            components = plan.components()
+
+            self.failUnlessEqual(set([frozenset([self.page1, self.child1]), frozenset([self.page2, self.block]),
+                                      frozenset([self.page3, self.author])]),
+                                 set(frozenset(component.all_published) for component in components))
+            self.failUnlessEqual(len(plan.nodes), sum(len(component.nodes) for component in components))
+            self.failUnlessEqual(set(plan.roots), set(root for component in components for root in component.roots))
+
+        def test_shared_target_joins_components(self):
+            self.page1.authors.add(self.author)
+            plan = PublishPlan.build(Page.objects.filter(id__in=[self.page1.id, self.page3.id]))
+            self.failUnlessEqual(1, len(plan.components()))
+
+        def test_execute_parallel(self):
+            report = PublishPlan.build(Page.objects.draft()).execute_parallel(processes=1)
+
+            self.failUnless(report.ok)
+            self.failUnlessEqual(3, report.components)
+            self.failUnlessEqual(6, report.published)
+            self.failUnlessEqual(4, Page.objects.published().count())
+            child1 = Page.objects.get(id=self.child1.id)
+            self.failUnlessEqual(Page.objects.get(id=self.page1.id).public, child1.public.parent)
+
+        def test_execute_parallel_merges_errors(self):
+            plan = PublishPlan.build(Page.objects.draft())
+            # published elsewhere in the meantime
+            self.page2.publish()
+
+            report = plan.execute_parallel(processes=1)
+            self.failIf(report.ok)
+            self.failUnlessEqual(3, report.components)
+            self.failUnlessEqual(1, len(report.errors))
+            self.failUnless('StalePlanException' in report.errors[0][1])
+            # the others were still published
+            self.failUnless(Page.objects.get(id=self.page1.id).public)
+            self.failUnless(Page.objects.get(id=self.page3.id).public)
+
+        def test_queryset_publish_processes(self):
+            report = Page.objects.draft().publish(processes=2)
+            self.failUnless(report.ok)
+            self.failUnlessEqual(4, Page.objects.published().count())
+
+    @skipUnless(connection.vendor == 'sqlite', 'the test database is only in-memory with sqlite')
+    class TestExecuteParallelProcesses(TransactionTestCase):
+        # the in-memory test database can't be seen by other processes, so
+        # swap in a file-backed one to go through the real pool of workers
+
+        def setUp(self):
+            fd, self.db_name = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+            self.old_connection = connections['default']
+            settings_dict = dict(self.old_connection.settings_dict, NAME=self.db_name)
+            connections['default'] = self.old_connection.__class__(settings_dict, 'default')
+            call_command('migrate', run_syncdb=True, verbosity=0, interactive=False)
+            super(TestExecuteParallelProcesses, self).setUp()
+
+            self.page1 = Page.objects.create(slug='page1', title='page 1')
+            self.child1 = Page.objects.create(parent=self.page1, slug='child1', title='Child 1')
+            PageBlock.objects.create(page=self.child1, content='block')
+            self.page2 = Page.objects.create(slug='page2', title='page 2')
+            self.page3 = Page.objects.create(slug='page3', title='page 3')
+            self.author = Author.objects.create(name='author')
+            self.page3.authors.add(self.author)
+
+        def tearDown(self):
+            connections['default'].close()
+            connections['default'] = self.old_connection
+            os.remove(self.db_name)
+            super(TestExecuteParallelProcesses, self).tearDown()
+
+        def test_execute_parallel_processes(self):
+            plan = PublishPlan.build(Page.objects.draft())
+            self.failUnless(plan._can_use_processes('default'))
+
+            report = plan.execute_parallel(processes=2)
+            self.failUnless(report.ok, report.errors)
+            self.failUnlessEqual(3, report.components)
+            self.failUnlessEqual(6, report.published)
+            self.failUnlessEqual(4, Page.objects.published().count())
+            self.failUnlessEqual(1, PageBlock.objects.published().count())
+            child1 = Page.objects.get(id=self.child1.id)
+            self.failUnlessEqual(Page.objects.get(id=self.page1.id).public, child1.public.parent)
+            self.failUnlessEqual([Author.objects.get(id=self.author.id).public],
+                                 list(Page.objects.get(id=self.page3.id).public.authors.all()))
+
+        def test_execute_parallel_processes_errors(self):
+            plan = PublishPlan.build(Page.objects.draft())
+            # published elsewhere in the meantime
+            self.page2.publish()
+
+            report = plan.execute_parallel(processes=2)
+            self.failIf(report.ok)
+            self.failUnlessEqual(1, len(report.errors))
+            self.failUnless('StalePlanException' in report.errors[0][1])
+            self.failUnless(Page.objects.get(id=self.page1.id).public)
+            self.failUnless(Page.objects.get(id=self.page3.id).public)
@@ -0,0 +1,125 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from datetime import timedelta
+
+    from django.core.management import call_command
+    from django.db import connection
+    from django.test import TransactionTestCase
+    from django.utils import timezone
+    from django.utils.six import StringIO
+
+    from publish.models import PublishException, PublishSchedule
+    from publish.signals import pre_publish
+    from .models import Page, Author
+
+    class TestPublishSchedule(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishSchedule, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='Page 1')
+            self.page2 = Page.objects.create(slug='page2', title='Page 2')
+            self.now = timezone.now()
+            self.later = self.now + timedelta(hours=1)
+
+        def test_publish_at(self):
+            self.page1.publish_at(self.later)
+            self.page2.publish_at(self.later)
+
+            self.failUnlessEqual(0, PublishSchedule.run_due(now=self.now))
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+            self.failUnlessEqual(2, PublishSchedule.run_due(now=self.later))
+            self.failUnlessEqual(2, Page.objects.published().count())
+            self.failUnlessEqual(0, PublishSchedule.objects.count())
+            self.failUnlessEqual(0, PublishSchedule.run_due(now=self.later))
+
+        def test_unpublish_at(self):
+            self.page1.publish()
+            self.page1 = Page.objects.get(pk=self.page1.pk)
+            self.page1.unpublish_at(self.later)
+
+            PublishSchedule.run_due(now=self.later)
+            page1 = Page.objects.get(pk=self.page1.pk)
+            self.failUnlessEqual(None, page1.public)
+            self.failUnlessEqual(Page.PUBLISH_CHANGED, page1.publish_state)
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_reschedule(self):
+            self.page1.publish_at(self.later)
+            self.page1.publish_at(self.now)
+            self.failUnlessEqual(1, PublishSchedule.objects.count())
+            self.failUnlessEqual(1, PublishSchedule.run_due(now=self.now))
+
+        def test_cancel_scheduled(self):
+            self.page1.publish_at(self.later)
+            self.page1.unpublish_at(self.later)
+            self.page1.cancel_scheduled(PublishSchedule.PUBLISH)
+            self.failUnlessEqual([PublishSchedule.UNPUBLISH],
+                                 list(PublishSchedule.objects.values_list('action', flat=True)))
+            self.page1.cancel_scheduled()
+            self.failUnlessEqual(0, PublishSchedule.objects.count())
+
+        def test_schedule_public(self):
+            self.page1.publish()
+            public = Page.objects.get(pk=self.page1.pk).public
+            self.failUnlessRaises(PublishException, public.publish_at, self.later)
+
+        def test_batches(self):
+            self.page1.publish_at(self.now)
+            self.page2.publish_at(self.later)
+            self.failUnlessEqual(1, PublishSchedule.run_due(now=self.later, batch_size=1))
+            self.failUnlessEqual(1, Page.objects.published().count())
+            self.failUnlessEqual([self.page2.pk], [int(pk) for pk in
+                                                   PublishSchedule.objects.values_list('object_id', flat=True)])
+
+        def test_failure(self):
+            author = Author.objects.create(name='author')
+            self.page1.publish_at(self.now)
+            author.publish_at(self.now)
+
+            def fail(sender, instance, **kw):
+                raise Exception('fail')
+            pre_publish.connect(fail, sender=Author)
+            try:
+                self.failUnlessEqual(2, PublishSchedule.run_due(now=self.now))
+            finally:
+                pre_publish.disconnect(fail, sender=Author)
+
+            # the page was still published
+            self.failUnlessEqual(1, Page.objects.published().count())
+            self.failUnlessEqual(0, Author.objects.published().count())
+            entry = PublishSchedule.objects.get()
+            self.failUnless(entry.failed)
+            self.failUnless('fail' in entry.error)
+            self.failUnlessEqual(0, PublishSchedule.run_due(now=self.later))
+
+        def test_due_entries_use_index(self):
+            if connection.vendor != 'sqlite':
+                return
+            sql, params = PublishSchedule.due_entries(self.now)[:100].query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = ' '.join(str(row) for row in cursor.fetchall())
+            self.failUnless('publish_schedule_due' in plan, plan)
+
+        def test_run_publish_scheduler(self):
+            self.page1.publish_at(self.now)
+            out = StringIO()
+            call_command('run_publish_scheduler', once=True, stdout=out)
+            self.failUnless('Ran 1 scheduled publish' in out.getvalue())
+            self.failUnlessEqual(1, Page.objects.published().count())
+
+    class TestUnpublishQuerySet(TransactionTestCase):
+
+        def test_unpublish(self):
+            page1 = Page.objects.create(slug='page1', title='Page 1')
+            page2 = Page.objects.create(slug='page2', title='Page 2')
+            Page.objects.draft().publish()
+
+            self.failUnlessEqual(2, Page.objects.draft().unpublish())
+            self.failUnlessEqual(0, Page.objects.published().count())
+            for page in Page.objects.filter(pk__in=[page1.pk, page2.pk]):
+                self.failUnlessEqual(None, page.public)
+                self.failUnlessEqual(Page.PUBLISH_CHANGED, page.publish_state)
+            self.failUnlessEqual(0, Page.objects.draft().unpublish())
@@ -0,0 +1,243 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from django.conf.urls import include, url
+    from django.contrib.auth.models import Permission
+    from django.contrib.admin.sites import AdminSite
+    from django.test import TransactionTestCase
+
+    from publish.actions import add_to_release, publish_release
+    from publish.admin import PublishableAdmin, ReleaseAdmin
+    from publish.models import PublishException, Release
+    from publish.signals import pre_publish
+    from . import RequestFactoryMixin
+    from .models import Page, PageBlock, Author, FlatPage
+
+    class TestRelease(TransactionTestCase):
+
+        def setUp(self):
+            super(TestRelease, self).setUp()
+            self.page = Page.objects.create(slug='page', title='Page')
+            self.block = PageBlock.objects.create(page=self.page, content='block')
+            self.author = Author.objects.create(name='author')
+            self.flat_page = FlatPage.objects.create(url='/flat/', title='Flat', enable_comments=False,
+                                                     registration_required=False)
+            self.release = Release.objects.create(name='launch')
+
+        def test_add_and_remove(self):
+            self.release.add(self.page, self.author, self.flat_page)
+            self.release.add(self.page)
+            self.failUnlessEqual([self.page, self.author, self.flat_page], self.release.drafts())
+
+            self.release.remove(self.author)
+            self.failUnlessEqual([self.page, self.flat_page], self.release.drafts())
+
+        def test_add_public(self):
+            self.page.publish()
+            public = Page.objects.get(pk=self.page.pk).public
+            self.failUnlessRaises(PublishException, self.release.add, public)
+
+        def test_build_plan(self):
+            self.release.add(self.page, self.flat_page)
+            plan = self.release.build_plan()
+            self.failUnlessEqual(set([self.page, self.block, self.flat_page]), set(plan.all_published))
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_publish(self):
+            self.release.add(self.page, self.author, self.flat_page)
+            self.release.publish()
+
+            self.failUnlessEqual(1, Page.objects.published().count())
+            self.failUnlessEqual(1, PageBlock.objects.published().count())
+            self.failUnlessEqual(1, Author.objects.published().count())
+            self.failUnlessEqual(1, FlatPage.objects.published().count())
+
+            release = Release.objects.get(pk=self.release.pk)
+            self.failUnlessEqual(Release.PUBLISHED, release.state)
+            self.failUnless(release.published)
+            self.failUnlessRaises(PublishException, release.publish)
+            self.failUnlessRaises(PublishException, release.add, self.page)
+
+        def test_publish_prepared(self):
+            self.release.add(self.page)
+            self.release.prepare()
+            self.failUnless(Release.objects.get(pk=self.release.pk).plan)
+
+            self.release.publish()
+            self.failUnlessEqual(1, Page.objects.published().count())
+
+        def test_publish_changed_since_prepared(self):
+            self.release.add(self.page)
+            self.release.prepare()
+            self.page.title = 'Changed'
+            self.page.save()
+            self.release.add(self.author)
+            # the prepared plan no longer covers everything
+            self.failUnlessEqual('', Release.objects.get(pk=self.release.pk).plan)
+
+            self.release.publish()
+            self.failUnlessEqual('Changed', Page.objects.get(pk=self.page.pk).public.title)
+            self.failUnlessEqual(1, Author.objects.published().count())
+
+        def test_publish_stale_plan(self):
+            self.release.add(self.page)
+            self.release.prepare()
+            self.page.publish()
+            self.page.title = 'Changed'
+            self.page.save()
+
+            self.release.publish()
+            self.failUnlessEqual('Changed', Page.objects.get(pk=self.page.pk).public.title)
+
+        def test_publish_with_plan(self):
+            self.release.add(self.page)
+            plan = self.release.build_plan()
+
+            self.failUnless(plan is self.release.publish(plan=plan))
+            self.failUnlessEqual(1, Page.objects.published().count())
+
+        def test_publish_with_stale_plan(self):
+            self.release.add(self.page)
+            plan = self.release.build_plan()
+            self.page.publish()
+            self.page.title = 'Changed'
+            self.page.save()
+
+            self.failIf(plan is self.release.publish(plan=plan))
+            self.failUnlessEqual('Changed', Page.objects.get(pk=self.page.pk).public.title)
+
+        def test_publish_moved_since_prepared(self):
+            self.release.add(self.block)
+            self.release.prepare()
+            page2 = Page.objects.create(slug='page2', title='Page 2')
+            block = PageBlock.objects.get(pk=self.block.pk)
+            block.page = page2
+            block.save()
+
+            self.release.publish()
+            self.failUnlessEqual(Page.objects.get(pk=page2.pk).public,
+                                 PageBlock.objects.get(pk=self.block.pk).public.page)
+
+        def test_publish_is_all_or_nothing(self):
+            self.release.add(self.page, self.author)
+
+            def fail(sender, instance, **kw):
+                raise Exception('fail')
+            pre_publish.connect(fail, sender=Author)
+            try:
+                self.failUnlessRaises(Exception, self.release.publish)
+            finally:
+                pre_publish.disconnect(fail, sender=Author)
+
+            self.failUnlessEqual(0, Page.objects.published().count())
+            self.failUnlessEqual(Release.OPEN, Release.objects.get(pk=self.release.pk).state)
+
+    class TestReleaseActions(TransactionTestCase, RequestFactoryMixin):
+
+        def setUp(self):
+            super(TestReleaseActions, self).setUp()
+            self.page1 = Page.objects.create(slug='page1', title='Page 1')
+            self.page2 = Page.objects.create(slug='page2', title='Page 2')
+            self.admin_site = AdminSite('Test Admin')
+            self.page_admin = PublishableAdmin(Page, self.admin_site)
+            self.admin_site.register(Page, PublishableAdmin)
+            self.release_admin = ReleaseAdmin(Release, self.admin_site)
+            settings.ROOT_URLCONF = [
+                url('^admin/', include(self.admin_site.urls)),
+            ]
+
+        def test_add_to_release_confirmation(self):
+            release = Release.objects.create(name='launch')
+            response = add_to_release(self.page_admin, self.build_post_request({}), Page.objects.draft())
+            self.failUnless('launch' in response.content)
+            self.failUnless('value="%s"' % release.pk in response.content)
+
+        def test_add_to_new_release(self):
+            request = self.build_post_request({'post': 'yes', 'release_name': 'new'})
+            response = add_to_release(self.page_admin, request, Page.objects.filter(pk=self.page1.pk))
+            self.failUnless(response is None)
+            release = Release.objects.get(name='new')
+            self.failUnlessEqual([self.page1], release.drafts())
+            self.failUnlessEqual(request.user, release.user)
+
+        def test_add_to_existing_release(self):
+            release = Release.objects.create(name='launch')
+            request = self.build_post_request({'post': 'yes', 'release': release.pk})
+            response = add_to_release(self.page_admin, request, Page.objects.draft())
+            self.failUnless(response is None)
+            self.failUnlessEqual(set([self.page1, self.page2]), set(release.drafts()))
+
+        def test_publish_release_preview(self):
+            release = Release.objects.create(name='launch')
+            release.add(self.page1, self.page2)
+            response = publish_release(self.release_admin, self.build_post_request({}), Release.objects.all())
+            self.failUnless('launch' in response.content)
+            self.failUnless('page/%d/' % self.page1.pk in response.content)
+            self.failUnless('page/%d/' % self.page2.pk in response.content)
+            self.failUnlessEqual(0, Page.objects.published().count())
+
+        def test_publish_release(self):
+            release = Release.objects.create(name='launch')
+            release.add(self.page1, self.page2)
+            request = self.build_post_request({'post': 'yes'})
+            response = publish_release(self.release_admin, request, Release.objects.all())
+            self.failUnless(response is None)
+            self.failUnlessEqual(2, Page.objects.published().count())
+            self.failUnlessEqual(Release.PUBLISHED, Release.objects.get(pk=release.pk).state)
+
+        def test_publish_release_builds_plan_once(self):
+            release = Release.objects.create(name='launch')
+            release.add(self.page1, self.page2)
+            built = []
+            build_plan = Release.build_plan
+
+            def counting_build_plan(release):
+                built.append(release)
+                return build_plan(release)
+            Release.build_plan = counting_build_plan
+            try:
+                publish_release(self.release_admin, self.build_post_request({'post': 'yes'}), Release.objects.all())
+            finally:
+                Release.build_plan = build_plan
+            self.failUnlessEqual(1, len(built))
+            self.failUnlessEqual(2, Page.objects.published().count())
+
+        def _release_user(self, *codenames):
+            user = self.build_common_user()
+            user.user_permissions = Permission.objects.filter(content_type__app_label='publish',
+                                                              codename__in=codenames)
+            return user
+
+        def test_add_to_release_without_permission(self):
+            release = Release.objects.create(name='launch')
+            request = self.build_post_request({'post': 'yes', 'release': release.pk})
+            request.user = self._release_user()
+            response = add_to_release(self.page_admin, request, Page.objects.draft())
+            self.failUnless(response is None)
+            self.failUnlessEqual([], release.drafts())
+            self.failUnlessEqual(1, len(request._messages._queued_messages))
+
+        def test_add_to_new_release_without_add_permission(self):
+            release = Release.objects.create(name='launch')
+            request = self.build_post_request({'post': 'yes', 'release_name': 'new'})
+            request.user = self._release_user('change_release')
+            response = add_to_release(self.page_admin, request, Page.objects.draft())
+            self.failUnless(response is None)
+            self.failIf(Release.objects.filter(name='new').exists())
+
+            # but can still add to an existing one
+            request = self.build_post_request({'post': 'yes', 'release': release.pk})
+            request.user = self._release_user('change_release')
+            add_to_release(self.page_admin, request, Page.objects.draft())
+            self.failUnlessEqual(set([self.page1, self.page2]), set(release.drafts()))
+
+        def test_add_to_release_checks_release_admin(self):
+            self.admin_site.register(Release, ReleaseAdmin)
+            release_admin = self.admin_site._registry[Release]
+            release_admin.has_change_permission = lambda request, obj=None: False
+            release_admin.has_add_permission = lambda request: False
+            release = Release.objects.create(name='launch')
+            request = self.build_post_request({'post': 'yes', 'release': release.pk})
+            response = add_to_release(self.page_admin, request, Page.objects.draft())
+            self.failUnless(response is None)
+            self.failUnlessEqual([], release.drafts())
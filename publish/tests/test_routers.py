@@ -0,0 +1,86 @@
+from django.conf import settings
+
+if getattr(settings, 'TESTING_PUBLISH', False):
+    from django.db import transaction
+    from django.http import HttpResponse
+    from django.test import TransactionTestCase, override_settings
+    from django.test.client import RequestFactory
+
+    from publish.routers import PublishedReadMiddleware, get_read_database, pinned_to_primary
+    from .models import Page
+
+    @override_settings(DATABASE_ROUTERS=['publish.routers.PublishedReadRouter'], PUBLISH_READ_DATABASE='replica')
+    class TestPublishedReadRouter(TransactionTestCase):
+
+        def test_published_reads(self):
+            self.failUnlessEqual('replica', Page.objects.published().db)
+            self.failUnlessEqual('replica', Page.objects.published().filter(slug='page').db)
+            self.failUnlessEqual('replica', Page.objects.all().published().db)
+
+        def test_other_reads(self):
+            self.failUnlessEqual('default', Page.objects.draft().db)
+            self.failUnlessEqual('default', Page.objects.all().db)
+            pages = Page.objects.all()
+            pages.published()
+            # doesn't change the queryset it came from
+            self.failUnlessEqual('default', pages.db)
+
+        def test_writes(self):
+            self.failUnlessEqual('default', Page.objects.published()._clone(_for_write=True).db)
+
+        def test_pinned_to_primary(self):
+            with pinned_to_primary():
+                self.failUnlessEqual('default', Page.objects.published().db)
+            self.failUnlessEqual('replica', Page.objects.published().db)
+
+        def test_in_transaction(self):
+            with transaction.atomic():
+                self.failUnlessEqual('default', Page.objects.published().db)
+
+        @override_settings(PUBLISH_READ_DATABASE=None)
+        def test_no_read_database(self):
+            self.failUnlessEqual('default', Page.objects.published().db)
+
+    @override_settings(DATABASE_ROUTERS=['publish.routers.PublishedReadRouter'], PUBLISH_READ_DATABASE='default')
+    class TestPublishedReadMiddleware(TransactionTestCase):
+
+        def setUp(self):
+            super(TestPublishedReadMiddleware, self).setUp()
+            self.middleware = PublishedReadMiddleware()
+            self.page = Page.objects.create(slug='page', title='page')
+            self.page.publish()
+
+        def _request(self, view, cookie=None):
+            request = RequestFactory().get('/')
+            if cookie is not None:
+                request.COOKIES[PublishedReadMiddleware.cookie_name] = cookie
+            self.failUnless(self.middleware.process_request(request) is None)
+            return self.middleware.process_response(request, view(request))
+
+        def test_publish_sets_cookie(self):
+            def view(request):
+                page = Page.objects.get(id=self.page.id)
+                page.title = 'new title'
+                page.save()
+                page.publish()
+                return HttpResponse()
+
+            response = self._request(view)
+            self.failUnlessEqual('2', response.cookies[PublishedReadMiddleware.cookie_name].value)
+
+        def test_pinned_until_caught_up(self):
+            databases = []
+
+            def view(request):
+                databases.append(get_read_database())
+                return HttpResponse()
+
+            # the read database hasn't seen generation 5 yet
+            response = self._request(view, cookie='5')
+            self.failIf(PublishedReadMiddleware.cookie_name in response.cookies)
+            # but has seen 1
+            response = self._request(view, cookie='1')
+            self.failUnlessEqual('', response.cookies[PublishedReadMiddleware.cookie_name].value)
+            self._request(view)
+
+            self.failUnlessEqual([None, 'default', 'default'], databases)
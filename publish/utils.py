@@ -1,4 +1,15 @@
 # -*- coding: utf-8 -*-
+import sys
+from collections import OrderedDict
+
+
+def _identity(item):
+    # model instances are identified by (model, pk) - which is what
+    # they compare equal on - other items by themselves
+    meta = getattr(item, '_meta', None)
+    if meta is not None:
+        return (meta.concrete_model, item.pk)
+    return item
 
 
 class NestedSet(object):
@@ -9,45 +20,117 @@ class NestedSet(object):
 
     def __init__(self):
         self._root_elements = []
+        # identity -> original item, in the order they were added
+        self._items = OrderedDict()
         self._children = {}
+        self._parents = {}
 
     def add(self, item, parent=None):
+        identity = _identity(item)
         if parent is None:
             self._root_elements.append(item)
         else:
-            self._children[parent].append(item)
-        self._children[item] = []
+            self._children[_identity(parent)].append(item)
+        self._items[identity] = item
+        self._children[identity] = []
+        self._parents[identity] = parent
 
     def __contains__(self, item):
-        return item in self._children
+        return _identity(item) in self._items
 
     def __len__(self):
-        return len(self._children)
+        return len(self._items)
 
     def __iter__(self):
-        return iter(self._children)
+        return iter(self._items.values())
 
     def original(self, item):
         # return the original item added
         # or this item if that's not the case
-        for child in self:
-            if child == item:
-                return child
-        return item
-
-    def _add_nested_items(self, items, nested):
-        for item in items:
-            nested.append(item)
-            children = self._nested_children(item)
-            if children:
-                nested.append(children)
-
-    def _nested_children(self, item):
-        children = []
-        self._add_nested_items(self._children[item], children)
-        return children
+        return self._items.get(_identity(item), item)
+
+    def parent(self, item):
+        # the item this item was added under (or None)
+        return self._parents.get(_identity(item))
+
+    def items_and_parents(self):
+        '''
+        all (item, parent) pairs, with parents always
+        coming before their children
+        '''
+        stack = [(item, None) for item in reversed(self._root_elements)]
+        while stack:
+            item, parent = stack.pop()
+            yield item, parent
+            stack.extend((child, item) for child in reversed(self._children[_identity(item)]))
 
     def nested_items(self):
+        '''
+        the items as a nested list (in the form the unordered_list
+        template filter takes), each item followed by a list of it's
+        children if it has any
+        '''
         items = []
-        self._add_nested_items(self._root_elements, items)
+        # (remaining siblings, list they go in) for each level we are in
+        stack = [(iter(self._root_elements), items)]
+        while stack:
+            siblings, nested = stack[-1]
+            for item in siblings:
+                nested.append(item)
+                children = self._children[_identity(item)]
+                if children:
+                    nested_children = []
+                    nested.append(nested_children)
+                    stack.append((iter(children), nested_children))
+                    break
+            else:
+                stack.pop()
         return items
+
+
+class Return(object):
+    '''
+    yielded by a generator being run by run_steps to give it's
+    result (as a generator can't return a value in python 2)
+    '''
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+def run_steps(steps):
+    '''
+    run the generator steps, which can yield another generator to have it
+    run (and it's Return value sent back) in place of a recursive call.
+
+    the generators waiting on each other are kept on a list, rather than
+    on the call stack, so how deep they can go is only limited by memory
+    and not by the recursion limit
+    '''
+    stack = [steps]
+    value, error = None, None
+    while True:
+        try:
+            if error is not None:
+                step = stack[-1].throw(*error)
+            else:
+                step = stack[-1].send(value)
+        except StopIteration:
+            step = Return()
+        except Exception:
+            stack.pop()
+            if not stack:
+                raise
+            # pass it on to whatever was waiting for the result
+            error = sys.exc_info()
+            continue
+        error = None
+
+        if isinstance(step, Return):
+            stack.pop()
+            if not stack:
+                return step.value
+            value = step.value
+        else:
+            stack.append(step)
+            value = None
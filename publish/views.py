@@ -0,0 +1,27 @@
+from django.views.decorators.http import condition
+
+from .models import PublishGeneration
+
+
+def published_condition(*models):
+    '''
+    decorator for views that only show published objects (of the given models,
+    or of any model if none are given), that sets the ETag and Last-Modified
+    headers from the publish generation - so conditional GETs are answered
+    without running the view
+    '''
+    def current(request):
+        generations = getattr(request, '_publish_generations', None)
+        if generations is None:
+            generations = request._publish_generations = [PublishGeneration.current(model)
+                                                          for model in models or [None]]
+        return generations
+
+    def etag(request, *arg, **kw):
+        return 'publish-%s' % '-'.join(str(generation) for generation, modified in current(request))
+
+    def last_modified(request, *arg, **kw):
+        modified = [modified for generation, modified in current(request) if modified is not None]
+        return max(modified) if modified else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)